@@ -8,9 +8,26 @@ from plotly.subplots import make_subplots
 import numpy as np
 from datetime import datetime
 import re
+import string
+import difflib
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import os
+import hashlib
+import sys
+import time
+import logging
+import contextlib
+import functools
+import threading
+import random
+import uuid
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from types import MappingProxyType
+import openpyxl
 
 # Configuración de la página
 st.set_page_config(
@@ -20,181 +37,3443 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Modo operador (SAI_OPERATOR_MODE=1): muestra las herramientas de administración (revisión de la tabla
+# compartida de coincidencias de nombres) y los diagnósticos de rendimiento (cachés, agregados, consultas
+# IA y tiempos por fragmento). Desactivado para los usuarios del dashboard.
+OPERATOR_MODE = os.environ.get('SAI_OPERATOR_MODE', '0') == '1'
+
+# ==========================================
+# FUNCIONES: SNAPSHOT COLUMNAR DE LOS DATOS PROCESADOS
+# ==========================================
+
+# Directorio (relativo al directorio actual) donde se guardan snapshots y cachés persistentes
+CACHE_DIR_NAME = '.cache_sai'
+
+# Versión del formato del snapshot: incrementar cuando cambie el procesamiento de los archivos
+SNAPSHOT_VERSION = 3
+
+def compute_file_fingerprint(file_path):
+    """
+    Calcula la huella de un archivo de entrada (tamaño, fecha de modificación y hash del contenido)
+
+    Args:
+        file_path: Ruta del archivo
+
+    Returns:
+        dict: Huella del archivo
+    """
+    file_stat = os.stat(file_path)
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+
+    return {
+        'size': file_stat.st_size,
+        'mtime_ns': file_stat.st_mtime_ns,
+        'sha256': sha256.hexdigest()
+    }
+
+def get_snapshot_dir():
+    """
+    Devuelve el directorio donde se guarda el snapshot de los datos procesados
+    """
+    return os.path.join(os.getcwd(), CACHE_DIR_NAME, 'snapshot')
+
+def same_file_content(stored_fingerprint, current_fingerprint):
+    """
+    Compara dos huellas de archivo. El tamaño permite descartar rápido y el hash del contenido
+    es el criterio definitivo (la fecha de modificación cambia al copiar o volver a descargar
+    el archivo aunque su contenido sea el mismo).
+    """
+    if not stored_fingerprint:
+        return False
+
+    return (stored_fingerprint.get('size') == current_fingerprint['size']
+            and stored_fingerprint.get('sha256') == current_fingerprint['sha256'])
+
+def fingerprints_match(stored_fingerprints, current_fingerprints):
+    """
+    Indica si todos los archivos de entrada tienen el mismo contenido que cuando se generó el snapshot
+    """
+    if set(stored_fingerprints) != set(current_fingerprints):
+        return False
+
+    return all(
+        same_file_content(stored_fingerprints[file_name], current)
+        for file_name, current in current_fingerprints.items()
+    )
+
+def compute_usage_hash(usage_values):
+    """
+    Calcula el hash de los usos de un mes (alineados con las filas del snapshot) para detectar cambios
+    """
+    return hashlib.sha256(np.asarray(usage_values, dtype=np.float64).tobytes()).hexdigest()
+
+def compute_keys_hash(name_keys):
+    """
+    Calcula el hash del conjunto (con repeticiones) de nombres normalizados que cruzan entre archivos
+    """
+    return hashlib.sha256('\n'.join(sorted(name_keys)).encode('utf-8')).hexdigest()
+
+def read_snapshot_manifest():
+    """
+    Lee el manifiesto del snapshot
+
+    Returns:
+        dict: Manifiesto o None si no existe, está dañado o es de otra versión
+    """
+    manifest_path = os.path.join(get_snapshot_dir(), 'manifest.json')
+
+    if not os.path.exists(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        return None
+
+    # Los nombres normalizados (y por tanto el cruce) dependen del modo de normalización
+    if manifest.get('name_folding') != FOLD_NAME_ACCENTS_AND_PUNCTUATION:
+        return None
+
+    return manifest
+
+def write_snapshot_manifest(manifest):
+    """
+    Escribe el manifiesto de forma atómica. Se escribe siempre al final para que un snapshot
+    a medio escribir nunca se considere válido.
+    """
+    manifest_path = os.path.join(get_snapshot_dir(), 'manifest.json')
+    tmp_manifest_path = manifest_path + '.tmp'
+    with open(tmp_manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_manifest_path, manifest_path)
+
+def write_snapshot_parquet(df, relative_path):
+    """
+    Escribe un DataFrame del snapshot de forma atómica (archivo temporal + renombrado)
+    """
+    file_path = os.path.join(get_snapshot_dir(), relative_path)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = file_path + '.tmp'
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, file_path)
+
+def write_month_partition(month, month_slice, usage_hash):
+    """
+    Guarda las filas en formato long de un mes como partición independiente del snapshot
+
+    Returns:
+        dict: Entrada del manifiesto para la partición (archivo y hash de los usos)
+    """
+    file_name = f"mes_{hashlib.sha1(month.encode('utf-8')).hexdigest()[:12]}.parquet"
+    write_snapshot_parquet(month_slice, os.path.join('meses', file_name))
+    return {'file': file_name, 'hash': usage_hash}
+
+def assemble_snapshot_tables(df_dimensions, month_columns, month_slices, month_columns_sorted):
+    """
+    Reconstruye df_merged y df_melted a partir de las dimensiones y las particiones por mes
+
+    Args:
+        df_dimensions: Columnas de df_merged sin meses más la clave NOMBRE_NORMALIZADO
+        month_columns: Columnas de meses en el orden del archivo de uso
+        month_slices: Particiones (formato long) en el mismo orden que month_columns
+        month_columns_sorted: Meses en orden cronológico (orden de la categoría Mes)
+
+    Returns:
+        tuple: (df_merged, df_melted)
+    """
+    df_melted = compact_melted_dtypes(pd.concat(month_slices, ignore_index=True), month_columns_sorted)
+
+    df_merged = df_dimensions.drop(columns=['NOMBRE_NORMALIZADO'])
+    for month, month_slice in zip(month_columns, month_slices):
+        df_merged[month] = month_slice['usos_ia'].to_numpy()
+
+    return df_merged, df_melted
+
+def compact_melted_dtypes(df_melted, month_columns_sorted):
+    """
+    OPTIMIZACIÓN: Convierte la tabla long a tipos compactos. Las dimensiones (que se repiten una vez
+    por usuario y mes) pasan a categóricas, Mes a categórica ordenada cronológicamente y usos_ia, si
+    todos los usos son enteros, al entero más pequeño capaz de contener la suma total de usos, de modo
+    que ninguna suma por grupo (que pandas calcula en el mismo tipo) pueda desbordarse. Los usos con
+    decimales (ver clean_usage_values) se conservan como float64.
+
+    Args:
+        df_melted: Tabla long con columnas NOMBRE, PAIS, CARGO, AREA, Mes y usos_ia
+        month_columns_sorted: Meses en orden cronológico
+
+    Returns:
+        pd.DataFrame: La misma tabla con tipos compactos
+    """
+    for column in BASIC_COLUMNS:
+        df_melted[column] = df_melted[column].astype('category')
+
+    df_melted['Mes'] = pd.Categorical(df_melted['Mes'], categories=month_columns_sorted, ordered=True)
+
+    usage_values = df_melted['usos_ia'].to_numpy()
+    if not (usage_values % 1 == 0).all():
+        df_melted['usos_ia'] = usage_values.astype(np.float64)
+        return df_melted
+
+    usage_values = usage_values.astype(np.int64)
+    usage_bound = int(np.abs(usage_values).sum())
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        if usage_bound <= np.iinfo(dtype).max:
+            df_melted['usos_ia'] = usage_values.astype(dtype)
+            break
+
+    return df_melted
+
+def load_data_snapshot(current_fingerprints):
+    """
+    Carga el snapshot en disco si fue generado a partir de los mismos archivos de entrada
+
+    Args:
+        current_fingerprints: Huellas actuales de los archivos de entrada
+
+    Returns:
+        tuple: (df_merged, df_melted, month_columns_sorted, fuzzy_stats) o None si no hay snapshot válido
+    """
+    manifest = read_snapshot_manifest()
+    if manifest is None or not fingerprints_match(manifest.get('fingerprints', {}), current_fingerprints):
+        return None
+
+    # Aprobar o rechazar coincidencias aproximadas cambia el cruce aunque los Excel no hayan cambiado
+    if USE_FUZZY_NAME_MATCHING and manifest.get('fuzzy_matches_hash') != compute_fuzzy_matches_hash(load_fuzzy_match_table()):
+        return None
+
+    try:
+        snapshot_dir = get_snapshot_dir()
+        df_dimensions = pd.read_parquet(os.path.join(snapshot_dir, 'dimensiones.parquet'))
+        month_slices = [
+            pd.read_parquet(os.path.join(snapshot_dir, 'meses', manifest['month_partitions'][month]['file']))
+            for month in manifest['month_columns']
+        ]
+        df_merged, df_melted = assemble_snapshot_tables(
+            df_dimensions, manifest['month_columns'], month_slices, manifest['month_columns_sorted']
+        )
+        return df_merged, df_melted, manifest['month_columns_sorted'], manifest.get('fuzzy_match_stats')
+
+    except Exception:
+        # Un snapshot corrupto o incompleto no debe impedir la carga desde Excel
+        return None
+
+def save_data_snapshot(current_fingerprints, df_dimensions, roster_keys, matched_keys,
+                       month_columns, month_slices, month_columns_sorted, fuzzy_stats):
+    """
+    Guarda los datos procesados como snapshot Parquet: dimensiones de los usuarios cruzados, claves
+    del archivo de personas y una partición por mes, junto con las huellas de los archivos de entrada.
+
+    Returns:
+        bool: True si el snapshot se guardó correctamente
+    """
+    # El manifiesto usa los nombres de los meses como claves JSON
+    if not all(isinstance(month, str) for month in month_columns):
+        return False
+
+    try:
+        snapshot_dir = get_snapshot_dir()
+        os.makedirs(snapshot_dir, exist_ok=True)
+        manifest_path = os.path.join(snapshot_dir, 'manifest.json')
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        write_snapshot_parquet(df_dimensions, 'dimensiones.parquet')
+        write_snapshot_parquet(pd.DataFrame({'NOMBRE_NORMALIZADO': roster_keys}), 'claves_personas.parquet')
+
+        month_partitions = {}
+        for month, month_slice in zip(month_columns, month_slices):
+            usage_hash = compute_usage_hash(month_slice['usos_ia'])
+            month_partitions[month] = write_month_partition(month, month_slice, usage_hash)
+
+        write_snapshot_manifest({
+            'version': SNAPSHOT_VERSION,
+            'created_at': datetime.now().isoformat(),
+            'fingerprints': current_fingerprints,
+            'name_folding': FOLD_NAME_ACCENTS_AND_PUNCTUATION,
+            'matched_keys_hash': compute_keys_hash(matched_keys),
+            'fuzzy_matches_hash': fuzzy_stats['table_hash'] if fuzzy_stats else None,
+            'fuzzy_match_stats': fuzzy_stats,
+            'month_columns': list(month_columns),
+            'month_columns_sorted': list(month_columns_sorted),
+            'month_partitions': month_partitions
+        })
+        remove_orphan_partitions(month_partitions)
+        return True
+
+    except Exception:
+        # Si no se puede escribir el snapshot (permisos, tipos no soportados), se sigue sin él
+        return False
+
+def remove_orphan_partitions(month_partitions):
+    """
+    Elimina particiones de meses que ya no están referenciadas por el manifiesto
+    """
+    partitions_dir = os.path.join(get_snapshot_dir(), 'meses')
+    referenced_files = {partition['file'] for partition in month_partitions.values()}
+
+    for file_name in os.listdir(partitions_dir):
+        if file_name not in referenced_files:
+            os.remove(os.path.join(partitions_dir, file_name))
+
+# ==========================================
+# FUNCIONES: LECTURA EN STREAMING DE ARCHIVOS EXCEL
+# ==========================================
+
+# OPTIMIZACIÓN: Leer los Excel fila a fila (openpyxl en modo solo lectura) en lugar de pd.read_excel
+USE_STREAMING_EXCEL_READER = True
+
+def coerce_excel_number(value):
+    """
+    Convierte el valor de una celda a número con la misma semántica que pd.to_numeric(errors='coerce')
+
+    Returns:
+        float: Valor numérico o NaN si la celda está vacía o no es numérica
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    if isinstance(value, str):
+        try:
+            return float(value.strip())
+        except ValueError:
+            return float('nan')
+
+    return float('nan')
+
+def read_excel_streaming(file_path, text_columns=None, drop_columns=(), skip_rows=()):
+    """
+    Lee la primera hoja de un archivo Excel fila a fila y vuelca los valores directamente en
+    buffers tipados por columna, sin construir el modelo completo del libro en memoria.
+    Al igual que pd.read_excel, la primera fila es el encabezado y se omiten las filas vacías finales.
+
+    Args:
+        file_path: Ruta del archivo Excel
+        text_columns: Columnas que se guardan como texto. Si es None, todas las columnas son de texto;
+                      si no, las demás se guardan en buffers float64 (celdas vacías o no numéricas → NaN)
+        drop_columns: Columnas que se descartan durante la lectura
+        skip_rows: Índices de filas de datos (0 = primera fila después del encabezado) que se descartan
+
+    Returns:
+        pd.DataFrame: Datos leídos
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+
+        # Nombres de columnas con la misma convención que pandas para encabezados vacíos o duplicados
+        column_names = []
+        for index, name in enumerate(header):
+            name = f"Unnamed: {index}" if name is None else name
+            duplicates = column_names.count(name)
+            column_names.append(f"{name}.{duplicates}" if duplicates else name)
+
+        kept_columns = [(index, name) for index, name in enumerate(column_names) if name not in drop_columns]
+        is_text = [text_columns is None or name in text_columns for _, name in kept_columns]
+        buffers = [[] if text else array('d') for text in is_text]
+
+        skip_rows = set(skip_rows)
+        data_row_index = -1
+        pending_blank_rows = 0
+
+        for row in rows:
+            data_row_index += 1
+            if data_row_index in skip_rows:
+                continue
+
+            # Las filas vacías solo se conservan si después hay más datos (pandas descarta las finales)
+            if all(value is None for value in row):
+                pending_blank_rows += 1
+                continue
+
+            for _ in range(pending_blank_rows):
+                for buffer, text in zip(buffers, is_text):
+                    buffer.append(None if text else float('nan'))
+            pending_blank_rows = 0
+
+            row_length = len(row)
+            for buffer, text, (index, _) in zip(buffers, is_text, kept_columns):
+                value = row[index] if index < row_length else None
+                buffer.append(value if text else coerce_excel_number(value))
+    finally:
+        workbook.close()
+
+    columns = {}
+    for buffer, text, (_, name) in zip(buffers, is_text, kept_columns):
+        if text:
+            columns[name] = pd.Series(buffer, dtype=object if not buffer else None)
+        else:
+            values = np.array(buffer, dtype=np.float64)
+            # Columnas completas de enteros se devuelven como int64, igual que pd.read_excel
+            if len(values) and not np.isnan(values).any() and (values % 1 == 0).all():
+                values = values.astype(np.int64)
+            columns[name] = pd.Series(values)
+
+    return pd.DataFrame(columns)
+
+# ==========================================
+# FUNCIONES AUXILIARES: NORMALIZACIÓN Y ACTUALIZACIÓN INCREMENTAL POR MES
+# ==========================================
+
+# Columnas básicas de cada fila en formato long
+BASIC_COLUMNS = ['NOMBRE', 'PAIS', 'CARGO', 'AREA']
+
+# Caracteres que str.split() considera espacios (la normalización vectorizada replica ' '.join(name.split()))
+WHITESPACE_CHARACTERS = ''.join(chr(code) for code in range(0x3001) if chr(code).isspace())
+
+# Signos de puntuación que se eliminan al plegar nombres
+PUNCTUATION_CHARACTERS = string.punctuation + '¡¿´¨'
+
+# Plegar tildes y signos de puntuación al normalizar nombres (ej: "Peña-López" → "PENA LOPEZ") para
+# cruzar nombres que solo difieren en acentos o guiones entre ambos archivos
+FOLD_NAME_ACCENTS_AND_PUNCTUATION = False
+
+def normalize_names(names, fold_accents_and_punctuation=False):
+    """
+    Normaliza una serie de nombres de forma vectorizada: elimina espacios al inicio/final, reemplaza
+    múltiples espacios por uno solo y convierte a mayúsculas. Los nombres vacíos quedan como ''.
+
+    Args:
+        names: Serie con los nombres
+        fold_accents_and_punctuation: Si es True, además elimina tildes y signos de puntuación
+
+    Returns:
+        pd.Series: Nombres normalizados
+    """
+    normalized = names.fillna('').astype(str)
+
+    if fold_accents_and_punctuation:
+        normalized = normalized.str.normalize('NFKD').str.replace('[\u0300-\u036f]', '', regex=True)
+        normalized = normalized.str.replace(f'[{re.escape(PUNCTUATION_CHARACTERS)}]', ' ', regex=True)
+
+    # El reemplazo por expresión regular es el paso más costoso: solo se aplica a los nombres que tienen
+    # espacios repetidos, espacios en los extremos u otros caracteres de espacio (tabulaciones, etc.)
+    other_whitespace = re.escape(WHITESPACE_CHARACTERS.replace(' ', ''))
+    needs_cleanup = normalized.str.contains(f'[{other_whitespace}]|  |^ | $', regex=True)
+    if needs_cleanup.any():
+        normalized = normalized.copy()
+        normalized[needs_cleanup] = normalized[needs_cleanup].str.replace(
+            f'[{re.escape(WHITESPACE_CHARACTERS)}]+', ' ', regex=True
+        )
+
+    return normalized.str.strip(' ').str.upper()
+
+def get_name_table_path():
+    """
+    Devuelve la ruta de la tabla persistente de nombres normalizados (una por modo de normalización)
+    """
+    suffix = '_plegados' if FOLD_NAME_ACCENTS_AND_PUNCTUATION else ''
+    return os.path.join(os.getcwd(), CACHE_DIR_NAME, f'nombres_normalizados{suffix}.parquet')
+
+def normalize_names_cached(names):
+    """
+    OPTIMIZACIÓN: Normaliza nombres reutilizando una tabla persistente nombre → nombre normalizado
+    entre ejecuciones. Solo los nombres que nunca se habían visto pasan por normalize_names.
+
+    Args:
+        names: Serie con los nombres
+
+    Returns:
+        pd.Series: Nombres normalizados (mismo índice que names)
+    """
+    table_path = get_name_table_path()
+
+    # Cada nombre distinto se busca una sola vez; el resultado se expande con los códigos de factorize
+    codes, unique_names = pd.factorize(names.fillna('').astype(str))
+    unique_names = pd.Index(unique_names)
+
+    try:
+        df_name_table = pd.read_parquet(table_path)
+    except (OSError, ValueError):
+        df_name_table = pd.DataFrame({'NOMBRE': pd.Series(dtype=str), 'NOMBRE_NORMALIZADO': pd.Series(dtype=str)})
+
+    positions = pd.Index(df_name_table['NOMBRE']).get_indexer(unique_names)
+    known = positions >= 0
+    unique_normalized = np.empty(len(unique_names), dtype=object)
+    unique_normalized[known] = df_name_table['NOMBRE_NORMALIZADO'].to_numpy()[positions[known]]
+
+    if not known.all():
+        unseen_names = unique_names[~known]
+        unseen_normalized = normalize_names(pd.Series(unseen_names), FOLD_NAME_ACCENTS_AND_PUNCTUATION).to_numpy()
+        unique_normalized[~known] = unseen_normalized
+
+        try:
+            os.makedirs(os.path.dirname(table_path), exist_ok=True)
+            tmp_path = table_path + '.tmp'
+            pd.concat([
+                df_name_table,
+                pd.DataFrame({'NOMBRE': unseen_names, 'NOMBRE_NORMALIZADO': unseen_normalized})
+            ], ignore_index=True).to_parquet(tmp_path)
+            os.replace(tmp_path, table_path)
+        except OSError:
+            # Sin tabla persistente la normalización sigue funcionando, solo que sin reutilización
+            pass
+
+    normalized = pd.Series(unique_normalized[codes], index=names.index, dtype=str)
+    return normalized
+
+def read_usage_file(file_uso_por_mes):
+    """
+    Carga uso_por_mes.xlsx sin la columna 'Total' ni la segunda fila (índice 1) y con la
+    columna de nombres renombrada a NOMBRE
+    """
+    if USE_STREAMING_EXCEL_READER:
+        # OPTIMIZACIÓN: Lectura en streaming; la columna 'Total' y la segunda fila (índice 1)
+        # del archivo de uso se descartan durante la lectura en lugar de después
+        df_usage = read_excel_streaming(
+            file_uso_por_mes,
+            text_columns=['Custom Date', 'NOMBRE'],
+            drop_columns=['Total'],
+            skip_rows=[1]
+        )
+    else:
+        # Cargar archivo de uso y eliminar la segunda fila (índice 1)
+        df_usage = pd.read_excel(file_uso_por_mes)
+        df_usage = df_usage.drop('Total', axis=1)
+        if len(df_usage) > 1:
+            df_usage = df_usage.drop(df_usage.index[1]).reset_index(drop=True)
+
+    return df_usage.rename(columns={'Custom Date': 'NOMBRE'})
+
+def clean_usage_values(usage_values):
+    """
+    Limpia los usos de IA de un mes: valores no numéricos o vacíos pasan a 0 y, como son
+    conteos, se devuelven como enteros cuando todos los valores lo son
+    """
+    usage = pd.to_numeric(pd.Series(usage_values), errors='coerce').fillna(0)
+
+    if (usage % 1 == 0).all():
+        usage = usage.astype('int64')
+
+    return usage.to_numpy()
+
+def build_month_slice(df_dimensions, month, usage_values):
+    """
+    Construye las filas en formato long de un solo mes (equivalente a pd.melt sobre una columna)
+
+    Args:
+        df_dimensions: DataFrame con las columnas básicas de cada usuario
+        month: Nombre del mes
+        usage_values: Usos de IA del mes, alineados con las filas de df_dimensions
+
+    Returns:
+        pd.DataFrame: Filas con columnas NOMBRE, PAIS, CARGO, AREA, Mes y usos_ia
+    """
+    month_slice = df_dimensions[BASIC_COLUMNS].reset_index(drop=True)
+    month_slice['Mes'] = month
+    month_slice['usos_ia'] = usage_values
+    return month_slice
+
+def update_snapshot_incrementally(current_fingerprints, file_uso_por_mes):
+    """
+    OPTIMIZACIÓN: Actualiza el snapshot cuando solo cambió uso_por_mes.xlsx, procesando únicamente
+    los meses nuevos o modificados. Los meses sin cambios se reutilizan tal cual desde el snapshot.
+
+    Solo es posible si areas_personas.xlsx no cambió y el conjunto de personas que cruzan entre
+    ambos archivos es el mismo; en cualquier otro caso se requiere una reconstrucción completa.
+
+    Args:
+        current_fingerprints: Huellas actuales de los archivos de entrada
+        file_uso_por_mes: Ruta de uso_por_mes.xlsx
+
+    Returns:
+        tuple: (df_merged, df_melted, month_columns_sorted, months_updated, fuzzy_stats) o None si se
+               requiere reconstrucción completa
+    """
+    manifest = read_snapshot_manifest()
+    if manifest is None:
+        return None
+
+    stored_fingerprints = manifest.get('fingerprints', {})
+    if not same_file_content(stored_fingerprints.get('areas_personas.xlsx'), current_fingerprints['areas_personas.xlsx']):
+        return None
+
+    try:
+        snapshot_dir = get_snapshot_dir()
+        df_usage = read_usage_file(file_uso_por_mes)
+        if 'NOMBRE' not in df_usage.columns:
+            return None
+
+        df_usage['NOMBRE_NORMALIZADO'] = normalize_names_cached(df_usage['NOMBRE'])
+        month_columns = [col for col in df_usage.columns if col not in ['NOMBRE', 'NOMBRE_NORMALIZADO']]
+        if not month_columns or not all(isinstance(month, str) for month in month_columns):
+            return None
+
+        # Si cambian las personas que cruzan entre archivos, cambian también las filas de meses anteriores
+        roster_keys = pd.read_parquet(os.path.join(snapshot_dir, 'claves_personas.parquet'))['NOMBRE_NORMALIZADO']
+        fuzzy_mapping, fuzzy_stats = match_unmatched_names(roster_keys, df_usage['NOMBRE_NORMALIZADO'])
+        if fuzzy_mapping:
+            df_usage['NOMBRE_NORMALIZADO'] = df_usage['NOMBRE_NORMALIZADO'].replace(fuzzy_mapping)
+
+        df_matched_usage = df_usage[df_usage['NOMBRE_NORMALIZADO'].isin(roster_keys)]
+        matched_keys = df_matched_usage['NOMBRE_NORMALIZADO']
+        if matched_keys.duplicated().any() or compute_keys_hash(matched_keys) != manifest['matched_keys_hash']:
+            return None
+
+        # Alinear los usos del archivo nuevo con las filas ya procesadas usando el nombre normalizado
+        df_dimensions = pd.read_parquet(os.path.join(snapshot_dir, 'dimensiones.parquet'))
+        usage_by_key = df_matched_usage.set_index('NOMBRE_NORMALIZADO')
+
+        month_partitions = {}
+        month_slices = []
+        months_updated = []
+
+        for month in month_columns:
+            usage_values = clean_usage_values(usage_by_key[month].reindex(df_dimensions['NOMBRE_NORMALIZADO']))
+            usage_hash = compute_usage_hash(usage_values)
+            stored_partition = manifest['month_partitions'].get(month)
+
+            if stored_partition is not None and stored_partition['hash'] == usage_hash:
+                # Mes sin cambios: reutilizar la partición existente
+                month_partitions[month] = stored_partition
+                month_slices.append(pd.read_parquet(os.path.join(snapshot_dir, 'meses', stored_partition['file'])))
+            else:
+                # Mes nuevo o modificado: solo se convierte a formato long este mes
+                month_slice = build_month_slice(df_dimensions, month, usage_values)
+                month_partitions[month] = write_month_partition(month, month_slice, usage_hash)
+                month_slices.append(month_slice)
+                months_updated.append(month)
+
+        month_columns_sorted = sort_months_chronologically(month_columns)
+
+        manifest.update({
+            'created_at': datetime.now().isoformat(),
+            'fingerprints': current_fingerprints,
+            'fuzzy_matches_hash': fuzzy_stats['table_hash'] if fuzzy_stats else None,
+            'fuzzy_match_stats': fuzzy_stats,
+            'month_columns': month_columns,
+            'month_columns_sorted': month_columns_sorted,
+            'month_partitions': month_partitions
+        })
+        write_snapshot_manifest(manifest)
+        remove_orphan_partitions(month_partitions)
+
+        df_merged, df_melted = assemble_snapshot_tables(df_dimensions, month_columns, month_slices, month_columns_sorted)
+        return df_merged, df_melted, month_columns_sorted, months_updated, fuzzy_stats
+
+    except Exception:
+        # Ante cualquier inconsistencia del snapshot se hace una reconstrucción completa
+        return None
+
+# ==========================================
+# FUNCIONES: CRUCE APROXIMADO DE NOMBRES (BLOCKING INDEX)
+# ==========================================
+
+# Segunda etapa del cruce: emparejar nombres que no cruzaron de forma exacta (tildes, letras
+# repetidas o faltantes, orden de nombres y apellidos)
+USE_FUZZY_NAME_MATCHING = True
+
+# Puntaje mínimo para proponer una coincidencia y puntaje a partir del cual se aplica sin revisión
+FUZZY_MATCH_REVIEW_THRESHOLD = 0.85
+FUZZY_MATCH_AUTO_THRESHOLD = 0.95
+
+# Aplicar sin revisión las coincidencias con puntaje alto (opcional, SAI_FUZZY_AUTO_APPLY=1). Por
+# defecto toda coincidencia nueva queda pendiente y solo las aprobadas por un operador cambian las cifras
+FUZZY_MATCH_AUTO_APPLY = os.environ.get('SAI_FUZZY_AUTO_APPLY', '0') == '1'
+
+# Los bloques con más nombres que este límite (combinaciones muy comunes) no generan candidatos
+FUZZY_MATCH_MAX_BLOCK_SIZE = 50
+
+# Estados de la tabla de coincidencias revisada: se aplican al cruce las 'aprobado' y, si está activada
+# la aplicación automática, las 'automatico'
+FUZZY_MATCH_STATES = ['automatico', 'pendiente', 'aprobado', 'rechazado']
+FUZZY_MATCH_APPLIED_STATES = {'automatico', 'aprobado'} if FUZZY_MATCH_AUTO_APPLY else {'aprobado'}
+FUZZY_MATCH_COLUMNS = ['NOMBRE_USO', 'NOMBRE_PERSONAS', 'PUNTAJE', 'ESTADO']
+
+def get_fuzzy_match_table_path():
+    """
+    Devuelve la ruta de la tabla persistente de coincidencias aproximadas (una por modo de normalización)
+    """
+    suffix = '_plegados' if FOLD_NAME_ACCENTS_AND_PUNCTUATION else ''
+    return os.path.join(os.getcwd(), CACHE_DIR_NAME, f'coincidencias_nombres{suffix}.parquet')
+
+def load_fuzzy_match_table():
+    """
+    Carga la tabla de coincidencias aproximadas revisada
+
+    Returns:
+        pd.DataFrame: Coincidencias (NOMBRE_USO, NOMBRE_PERSONAS, PUNTAJE, ESTADO); vacía si no existe
+    """
+    try:
+        return pd.read_parquet(get_fuzzy_match_table_path())[FUZZY_MATCH_COLUMNS]
+    except (OSError, ValueError, KeyError):
+        return pd.DataFrame({
+            'NOMBRE_USO': pd.Series(dtype=str),
+            'NOMBRE_PERSONAS': pd.Series(dtype=str),
+            'PUNTAJE': pd.Series(dtype=float),
+            'ESTADO': pd.Series(dtype=str)
+        })
+
+def save_fuzzy_match_table(df_match_table):
+    """
+    Guarda la tabla de coincidencias aproximadas de forma atómica
+
+    Returns:
+        bool: True si la tabla se guardó correctamente
+    """
+    table_path = get_fuzzy_match_table_path()
+
+    try:
+        os.makedirs(os.path.dirname(table_path), exist_ok=True)
+        tmp_path = table_path + '.tmp'
+        df_match_table[FUZZY_MATCH_COLUMNS].reset_index(drop=True).to_parquet(tmp_path)
+        os.replace(tmp_path, table_path)
+        return True
+    except OSError:
+        return False
+
+def compute_fuzzy_matches_hash(df_match_table):
+    """
+    Calcula el hash de las coincidencias aplicadas al cruce; cambia cuando se aprueba o rechaza alguna
+    """
+    applied = df_match_table[df_match_table['ESTADO'].isin(FUZZY_MATCH_APPLIED_STATES)]
+    return compute_keys_hash(applied['NOMBRE_USO'] + '\t' + applied['NOMBRE_PERSONAS'])
+
+def get_blocking_keys(folded_name):
+    """
+    Claves de bloqueo de un nombre plegado: cada par (ordenado) de prefijos de 4 letras de sus palabras
+    y cada par de sufijos de 4 letras. Dos nombres comparten bloque si coinciden en el comienzo (o en el
+    final) de al menos dos palabras, sin importar el orden, lo que tolera errores de escritura en el
+    resto del nombre.
+
+    Returns:
+        list: Claves de bloqueo (vacía para nombres vacíos)
+    """
+    tokens = folded_name.split()
+    blocking_keys = []
+
+    for marker, fragments in (('P', {token[:4] for token in tokens}), ('S', {token[-4:] for token in tokens})):
+        fragments = sorted(fragments)
+        if len(fragments) == 1:
+            blocking_keys.append(f'{marker}:{fragments[0]}')
+
+        blocking_keys.extend(
+            f'{marker}:{first} {second}'
+            for index, first in enumerate(fragments)
+            for second in fragments[index + 1:]
+        )
+
+    return blocking_keys
+
+def score_name_pair(first_name, second_name):
+    """
+    Similitud entre dos nombres plegados (0 a 1): la mejor entre el nombre tal cual y con las palabras
+    ordenadas alfabéticamente (para nombres con apellidos y nombres en distinto orden)
+    """
+    score = difflib.SequenceMatcher(None, first_name, second_name).ratio()
+
+    first_sorted = ' '.join(sorted(first_name.split()))
+    second_sorted = ' '.join(sorted(second_name.split()))
+    if first_sorted != first_name or second_sorted != second_name:
+        score = max(score, difflib.SequenceMatcher(None, first_sorted, second_sorted).ratio())
+
+    return score
+
+def find_fuzzy_candidates(roster_names, usage_names, rejected_pairs):
+    """
+    OPTIMIZACIÓN: Construye un índice de bloqueo sobre los nombres de personas sin cruce y compara
+    cada nombre de uso solo con los nombres de sus mismos bloques, en lugar de con todos (O(n·m)).
+
+    Args:
+        roster_names: Nombres normalizados de areas_personas.xlsx sin cruce exacto
+        usage_names: Nombres normalizados de uso_por_mes.xlsx sin cruce exacto
+        rejected_pairs: Pares (nombre de uso, nombre de personas) rechazados en revisiones anteriores
+
+    Returns:
+        tuple: (propuestas [(puntaje, nombre de uso, nombre de personas)], pares candidatos comparados)
+    """
+    roster_folded = normalize_names(pd.Series(roster_names, dtype=str), fold_accents_and_punctuation=True).tolist()
+    usage_folded = normalize_names(pd.Series(usage_names, dtype=str), fold_accents_and_punctuation=True).tolist()
+
+    blocking_index = {}
+    for position, folded_name in enumerate(roster_folded):
+        for key in get_blocking_keys(folded_name):
+            blocking_index.setdefault(key, []).append(position)
+
+    proposals = []
+    candidate_pairs = 0
+
+    for usage_name, folded_name in zip(usage_names, usage_folded):
+        candidates = set()
+        for key in get_blocking_keys(folded_name):
+            block = blocking_index.get(key, [])
+            if len(block) <= FUZZY_MATCH_MAX_BLOCK_SIZE:
+                candidates.update(block)
+
+        candidate_pairs += len(candidates)
+        best_match = None
+
+        for position in candidates:
+            if (usage_name, roster_names[position]) in rejected_pairs:
+                continue
+
+            score = score_name_pair(folded_name, roster_folded[position])
+            if score >= FUZZY_MATCH_REVIEW_THRESHOLD and (best_match is None or score > best_match[0]):
+                best_match = (score, usage_name, roster_names[position])
+
+        if best_match is not None:
+            proposals.append(best_match)
+
+    return proposals, candidate_pairs
+
+def match_unmatched_names(roster_keys, usage_keys):
+    """
+    Segunda etapa del cruce entre archivos: empareja los nombres que no cruzaron de forma exacta
+    reutilizando la tabla revisada de coincidencias y buscando candidatos solo para los nombres nuevos.
+    Las coincidencias nuevas quedan pendientes de revisión (o, con FUZZY_MATCH_AUTO_APPLY, se aplican
+    automáticamente las de puntaje alto).
+
+    Args:
+        roster_keys: Nombres normalizados de areas_personas.xlsx
+        usage_keys: Nombres normalizados de uso_por_mes.xlsx
+
+    Returns:
+        tuple: (dict nombre de uso → nombre de personas a aplicar, métricas del cruce) o ({}, None)
+               si el cruce aproximado está desactivado
+    """
+    if not USE_FUZZY_NAME_MATCHING:
+        return {}, None
+
+    start_time = time.perf_counter()
+
+    roster_set = set(roster_keys) - {''}
+    usage_set = set(usage_keys) - {''}
+    unmatched_roster = roster_set - usage_set
+    unmatched_usage = usage_set - roster_set
+
+    df_match_table = load_fuzzy_match_table()
+
+    # Coincidencias ya revisadas (o aplicadas automáticamente) en ejecuciones anteriores
+    name_mapping = {}
+    taken_roster_names = set()
+    decided_usage_names = set()
+
+    for usage_name, roster_name, state in df_match_table[['NOMBRE_USO', 'NOMBRE_PERSONAS', 'ESTADO']].itertuples(index=False):
+        if state == 'rechazado' or usage_name not in unmatched_usage or roster_name not in unmatched_roster:
+            continue
+
+        decided_usage_names.add(usage_name)
+        if roster_name in taken_roster_names:
+            continue
+
+        taken_roster_names.add(roster_name)
+        if state in FUZZY_MATCH_APPLIED_STATES:
+            name_mapping[usage_name] = roster_name
+
+    # Buscar candidatos solo para los nombres sin decisión previa
+    usage_to_score = sorted(unmatched_usage - decided_usage_names)
+    roster_to_score = sorted(unmatched_roster - taken_roster_names)
+    rejected_pairs = set(
+        df_match_table.loc[df_match_table['ESTADO'] == 'rechazado', ['NOMBRE_USO', 'NOMBRE_PERSONAS']].itertuples(index=False, name=None)
+    )
+    proposals, candidate_pairs = find_fuzzy_candidates(roster_to_score, usage_to_score, rejected_pairs)
+
+    # Asignación uno a uno, de mayor a menor puntaje
+    new_rows = []
+    for score, usage_name, roster_name in sorted(proposals, reverse=True):
+        if roster_name in taken_roster_names:
+            continue
+
+        taken_roster_names.add(roster_name)
+        state = 'automatico' if FUZZY_MATCH_AUTO_APPLY and score >= FUZZY_MATCH_AUTO_THRESHOLD else 'pendiente'
+        if state == 'automatico':
+            name_mapping[usage_name] = roster_name
+        new_rows.append({'NOMBRE_USO': usage_name, 'NOMBRE_PERSONAS': roster_name, 'PUNTAJE': round(score, 4), 'ESTADO': state})
+
+    if new_rows:
+        df_match_table = pd.concat([df_match_table, pd.DataFrame(new_rows)], ignore_index=True)
+        df_match_table = df_match_table.sort_values('PUNTAJE', ascending=False, kind='stable')
+        save_fuzzy_match_table(df_match_table)
+
+    pending_matches = df_match_table[
+        (df_match_table['ESTADO'] == 'pendiente')
+        & df_match_table['NOMBRE_USO'].isin(unmatched_usage)
+        & df_match_table['NOMBRE_PERSONAS'].isin(unmatched_roster)
+    ]
+    exact_matches = len(usage_set & roster_set)
+
+    fuzzy_stats = {
+        'usage_names': len(usage_set),
+        'exact_matches': exact_matches,
+        'fuzzy_matches': len(name_mapping),
+        'pending_matches': len(pending_matches),
+        'match_rate': (exact_matches + len(name_mapping)) / len(usage_set) if usage_set else 0.0,
+        'fuzzy_match_rate': len(name_mapping) / len(unmatched_usage) if unmatched_usage else 0.0,
+        'names_scored': len(usage_to_score),
+        'candidate_pairs': candidate_pairs,
+        'naive_pairs': len(usage_to_score) * len(roster_to_score),
+        'seconds': time.perf_counter() - start_time,
+        'table_hash': compute_fuzzy_matches_hash(df_match_table)
+    }
+
+    return name_mapping, fuzzy_stats
+
+def show_fuzzy_match_review(fuzzy_stats):
+    """
+    Muestra en el sidebar las métricas del cruce aproximado de nombres y la tabla de coincidencias
+    para revisarla (aprobar o rechazar coincidencias propuestas). La tabla es compartida por todas las
+    sesiones, así que solo se muestra en modo operador (ver OPERATOR_MODE).
+
+    Args:
+        fuzzy_stats: Métricas devueltas por match_unmatched_names (None si el cruce está desactivado)
+    """
+    if not fuzzy_stats:
+        return
+
+    with st.sidebar.expander("🔗 Cruce aproximado de nombres"):
+        st.caption(
+            f"Cruces exactos: {fuzzy_stats['exact_matches']:,} | Aproximados: {fuzzy_stats['fuzzy_matches']:,} | "
+            f"Pendientes de revisión: {fuzzy_stats['pending_matches']:,}"
+        )
+        st.caption(
+            f"Tasa de cruce: {fuzzy_stats['match_rate']:.1%} de los nombres de uso_por_mes.xlsx "
+            f"({fuzzy_stats['fuzzy_match_rate']:.1%} de los que no cruzaban de forma exacta)"
+        )
+        st.caption(
+            f"Pares candidatos: {fuzzy_stats['candidate_pairs']:,} de {fuzzy_stats['naive_pairs']:,} posibles | "
+            f"{fuzzy_stats['seconds']:.2f} s"
+        )
+
+        df_match_table = load_fuzzy_match_table()
+        if df_match_table.empty:
+            st.caption("No hay coincidencias aproximadas registradas")
+            return
+
+        df_reviewed = st.data_editor(
+            df_match_table,
+            column_config={
+                'ESTADO': st.column_config.SelectboxColumn('ESTADO', options=FUZZY_MATCH_STATES, required=True),
+                'PUNTAJE': st.column_config.NumberColumn('PUNTAJE', format="%.3f")
+            },
+            disabled=['NOMBRE_USO', 'NOMBRE_PERSONAS', 'PUNTAJE'],
+            hide_index=True,
+            key="fuzzy_match_editor"
+        )
+
+        if st.button("💾 Guardar revisión", help="Aplica las coincidencias aprobadas y vuelve a procesar los datos"):
+            if save_fuzzy_match_table(df_reviewed):
+                process_input_files.clear()
+                st.rerun()
+            else:
+                st.error("❌ No se pudo guardar la tabla de coincidencias")
+
+# ==========================================
+# FUNCIONES: MOTOR MATRICIAL USUARIO × MES
+# ==========================================
+
+# Columnas de dimensión por usuario que se guardan como códigos en el motor matricial
+ENGINE_DIMENSIONS = ['PAIS', 'AREA', 'CARGO']
+
+def get_usage_sum_dtype(usage):
+    """
+    Tipo de las sumas de usos: int64 si los usos son enteros (ver compact_melted_dtypes) o float64 si
+    tienen decimales, como las sumas de pandas
+    """
+    return np.int64 if np.issubdtype(usage.dtype, np.integer) else np.float64
+
+def build_usage_engine(df_melted, month_columns_sorted):
+    """
+    OPTIMIZACIÓN: Construye la representación matricial de los datos: una matriz densa usuario × mes
+    con los usos de IA (meses en orden cronológico), la matriz booleana de usuarios activos y los
+    códigos de nombre y de cada dimensión por usuario, más el cubo (PAIS, AREA, Mes) precalculado a
+    partir de ellos (ver build_adoption_cube). Las métricas se calculan sobre el cubo y la matriz en
+    lugar de con nunique sobre la tabla long.
+
+    df_melted se arma concatenando una partición por mes con las mismas filas de usuarios en el
+    mismo orden (ver assemble_snapshot_tables), así que la fila i del mes j está en la posición
+    j * n_usuarios + i.
+
+    Args:
+        df_melted: Tabla long con tipos compactos (ver compact_melted_dtypes)
+        month_columns_sorted: Meses en orden cronológico (orden de las columnas de la matriz)
+
+    Returns:
+        dict: Motor matricial
+    """
+    n_months = len(month_columns_sorted)
+    n_users = len(df_melted) // n_months if n_months else 0
+    if n_users == 0:
+        raise ValueError("no quedan usuarios con datos de uso para el análisis")
+
+    # Reordenar las particiones (meses en el orden del archivo de uso) al orden cronológico
+    month_position = {month: position for position, month in enumerate(df_melted['Mes'].iloc[::max(n_users, 1)])}
+    column_order = [month_position[month] for month in month_columns_sorted]
+    usage = df_melted['usos_ia'].to_numpy().reshape(n_months, n_users)[column_order].T.copy()
+
+    user_rows = df_melted.iloc[:n_users]
+    name_codes = user_rows['NOMBRE'].cat.codes.to_numpy()
+
+    usage_engine = {
+        'months': list(month_columns_sorted),
+        'month_index': {month: position for position, month in enumerate(month_columns_sorted)},
+        'usage': usage,
+        'active': usage > 0,
+        'name_codes': name_codes,
+        'n_names': len(user_rows['NOMBRE'].cat.categories),
+        'dimension_codes': {column: user_rows[column].cat.codes.to_numpy() for column in ENGINE_DIMENSIONS},
+        'dimension_values': {column: list(user_rows[column].cat.categories) for column in ENGINE_DIMENSIONS}
+    }
+    usage_engine['cube'] = build_adoption_cube(usage_engine)
+
+    # Grupos (valor, NOMBRE) de cada usuario por dimensión (ver compute_dimension_statistics)
+    usage_engine['name_groups'] = {}
+    for column in ['PAIS', 'AREA']:
+        group_keys, user_groups = np.unique(
+            usage_engine['dimension_codes'][column].astype(np.int64) * usage_engine['n_names'] + name_codes,
+            return_inverse=True
+        )
+        usage_engine['name_groups'][column] = {
+            'user_groups': user_groups,
+            'group_codes': group_keys // usage_engine['n_names']
+        }
+    usage_engine['filter_index'] = build_filter_index(df_melted)
+
+    return usage_engine
+
+def create_engine_view(usage_engine, selected_months, selected_countries, selected_areas):
+    """
+    Selección de filtros sobre el motor: celdas (PAIS, AREA) del cubo incluidas en la selección y
+    columnas de los meses seleccionados, en el mismo orden que selected_months
+
+    Returns:
+        dict: Vista con el motor, la máscara de celdas, los meses y sus columnas en la matriz
+    """
+    adoption_cube = usage_engine['cube']
+    dimension_values = usage_engine['dimension_values']
+
+    def codes_for(column, selected_values):
+        selected_values = set(selected_values)
+        return [code for code, value in enumerate(dimension_values[column]) if value in selected_values]
+
+    cell_mask = (
+        np.isin(adoption_cube['cell_codes']['PAIS'], codes_for('PAIS', selected_countries))
+        & np.isin(adoption_cube['cell_codes']['AREA'], codes_for('AREA', selected_areas))
+    )
+
+    months = [month for month in selected_months if month in usage_engine['month_index']]
+    month_columns = np.array([usage_engine['month_index'][month] for month in months], dtype=np.intp)
+
+    # Sin meses seleccionados no queda ninguna fila en la tabla filtrada
+    if len(months) == 0:
+        cell_mask = np.zeros_like(cell_mask)
+
+    return {
+        'engine': usage_engine,
+        'cell_mask': cell_mask,
+        'months': months,
+        'month_columns': month_columns
+    }
+
+# ==========================================
+# FUNCIONES: CUBO (PAIS, AREA, Mes) CON BITSETS DE USUARIOS
+# ==========================================
+
+# Cantidad de bits en 1 de cada byte posible (popcount por tabla de búsqueda si numpy < 2.0)
+POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+def build_adoption_cube(usage_engine):
+    """
+    OPTIMIZACIÓN: Precalcula el cubo (PAIS, AREA, Mes). Cada celda guarda la suma de usos por mes, el
+    bitset de usuarios elegibles y, por mes, el bitset de usuarios activos. Los usuarios distintos no se
+    pueden sumar entre celdas (un mismo nombre puede estar en varias), pero sí unir: cualquier
+    combinación de filtros se responde con OR de bitsets y popcount, sin volver a recorrer las filas.
+
+    Cada bit representa un nombre distinto (igual que nunique de NOMBRE). Los nombres se numeran celda
+    por celda empezando cada celda en un byte nuevo, así que cada celda solo guarda los bytes de su
+    rango y el cubo completo ocupa del orden de n_usuarios / 8 bytes por mes. Si un nombre aparece en
+    varias celdas, conserva el bit de la primera y los rangos de las celdas se superponen.
+
+    Los elegibles de una celda son los mismos en todos los meses (cada usuario aparece en todos los
+    meses de la tabla long), por lo que se guarda un solo bitset de elegibles por celda.
+
+    Args:
+        usage_engine: Motor matricial (ver build_usage_engine)
+
+    Returns:
+        dict: Cubo con una entrada por celda (PAIS, AREA) no vacía
+    """
+    pais_codes = usage_engine['dimension_codes']['PAIS'].astype(np.int64)
+    area_codes = usage_engine['dimension_codes']['AREA'].astype(np.int64)
+    name_codes = usage_engine['name_codes'].astype(np.int64)
+    usage = usage_engine['usage']
+    active = usage_engine['active']
+    n_users, n_months = usage.shape
+
+    # Celda de cada usuario (solo existen las celdas con al menos un usuario)
+    n_areas = len(usage_engine['dimension_values']['AREA'])
+    cell_ids, user_cells = np.unique(pais_codes * n_areas + area_codes, return_inverse=True)
+    n_cells = len(cell_ids)
+
+    # Numerar los nombres en el orden en que aparecen recorriendo los usuarios celda por celda
+    users_by_cell = np.argsort(user_cells, kind='stable')
+    sorted_cells = user_cells[users_by_cell]
+    sorted_names = name_codes[users_by_cell]
+    first_seen = np.zeros(n_users, dtype=bool)
+    first_seen[np.unique(sorted_names, return_index=True)[1]] = True
+
+    new_names_per_cell = np.bincount(sorted_cells[first_seen], minlength=n_cells)
+    cell_bit_start = np.concatenate([[0], np.cumsum((new_names_per_cell + 7) // 8 * 8)])
+    new_names_before_cell = np.concatenate([[0], np.cumsum(new_names_per_cell)])
+    name_bits = np.full(usage_engine['n_names'], -1, dtype=np.int64)
+    new_name_cells = sorted_cells[first_seen]
+    name_bits[sorted_names[first_seen]] = (
+        cell_bit_start[new_name_cells]
+        + np.arange(first_seen.sum()) - new_names_before_cell[new_name_cells]
+    )
+    user_bits = name_bits[name_codes]
+
+    cell_offsets = np.zeros(n_cells + 1, dtype=np.int64)
+    cell_word_start = np.zeros(n_cells, dtype=np.int64)
+    eligible_chunks = []
+    active_chunks = []
+
+    cell_boundaries = np.searchsorted(sorted_cells, np.arange(n_cells + 1))
+    for cell in range(n_cells):
+        cell_users = users_by_cell[cell_boundaries[cell]:cell_boundaries[cell + 1]]
+        bits = user_bits[cell_users]
+        word_start = bits.min() // 8
+        local_bits = bits - word_start * 8
+        n_cell_bits = (bits.max() // 8 - word_start + 1) * 8
+
+        eligible = np.zeros(n_cell_bits, dtype=bool)
+        eligible[local_bits] = True
+        active_by_month = np.zeros((n_months, n_cell_bits), dtype=bool)
+        month_columns, active_users = np.nonzero(active[cell_users].T)
+        active_by_month[month_columns, local_bits[active_users]] = True
+
+        eligible_chunks.append(np.packbits(eligible))
+        active_chunks.append(np.packbits(active_by_month, axis=1))
+        cell_word_start[cell] = word_start
+        cell_offsets[cell + 1] = cell_offsets[cell] + n_cell_bits // 8
+
+    # Celda y posición global de cada byte de los bitsets concatenados
+    cell_lengths = np.diff(cell_offsets)
+    byte_cells = np.repeat(np.arange(n_cells), cell_lengths)
+    byte_positions = cell_word_start[byte_cells] + np.arange(cell_offsets[-1]) - cell_offsets[byte_cells]
+
+    cell_cargos = np.zeros((n_cells, len(usage_engine['dimension_values']['CARGO'])), dtype=bool)
+    cell_cargos[user_cells, usage_engine['dimension_codes']['CARGO']] = True
+
+    cell_usage = np.zeros((n_cells, n_months), dtype=get_usage_sum_dtype(usage))
+    np.add.at(cell_usage, user_cells, usage)
+
+    # Primera fila de cada celda en la tabla long (para conservar el orden de Series.unique)
+    cell_first_user = np.full(n_cells, n_users, dtype=np.int64)
+    np.minimum.at(cell_first_user, user_cells, np.arange(n_users))
+
+    return {
+        'n_words': int(cell_bit_start[-1] // 8),
+        'cell_codes': {'PAIS': cell_ids // n_areas, 'AREA': cell_ids % n_areas},
+        'byte_cells': byte_cells,
+        'byte_positions': byte_positions,
+        # Un nombre en varias celdas hace que sus rangos de bytes se superpongan
+        'overlapping_cells': int(first_seen.sum()) < len(np.unique(user_cells * usage_engine['n_names'] + name_codes)),
+        'eligible_bits': np.concatenate(eligible_chunks) if eligible_chunks else np.zeros(0, dtype=np.uint8),
+        'active_bits': np.concatenate(active_chunks, axis=1) if active_chunks else np.zeros((n_months, 0), dtype=np.uint8),
+        'usage': cell_usage,
+        'user_count': np.bincount(user_cells, minlength=n_cells),
+        'cargos': cell_cargos,
+        'first_user': cell_first_user,
+        'user_cells': user_cells
+    }
+
+def popcount_bytes(bitset):
+    """
+    Cantidad de bits en 1 de cada byte de un bitset
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bitset)
+
+    return POPCOUNT_TABLE[bitset]
+
+def count_union_by_group(adoption_cube, cell_mask, cell_groups, n_groups, cell_bits):
+    """
+    Une (OR) los bitsets de las celdas seleccionadas de cada grupo y cuenta los usuarios de cada unión
+
+    Args:
+        adoption_cube: Cubo (ver build_adoption_cube)
+        cell_mask: Máscara de celdas seleccionadas
+        cell_groups: Grupo de cada celda (por ejemplo, su código de país)
+        n_groups: Cantidad de grupos
+        cell_bits: Bitsets concatenados por celda; 1D o 2D (una fila por mes)
+
+    Returns:
+        np.ndarray: Usuarios distintos por grupo (n_groups) o por fila y grupo (filas × n_groups)
+    """
+    byte_mask = cell_mask[adoption_cube['byte_cells']]
+    byte_groups = cell_groups[adoption_cube['byte_cells'][byte_mask]]
+    selected_bits = np.atleast_2d(cell_bits)[:, byte_mask]
+    counts = np.zeros((len(selected_bits), n_groups), dtype=np.int64)
+
+    if not adoption_cube['overlapping_cells']:
+        # Las celdas no comparten nombres: la unión es la concatenación y basta con sumar popcounts
+        byte_counts = popcount_bytes(selected_bits)
+        for row in range(len(selected_bits)):
+            counts[row] = np.bincount(byte_groups, weights=byte_counts[row], minlength=n_groups)
+    else:
+        byte_positions = adoption_cube['byte_positions'][byte_mask]
+        for group in np.unique(byte_groups):
+            group_bytes = byte_groups == group
+            for row in range(len(selected_bits)):
+                union_bits = np.zeros(adoption_cube['n_words'], dtype=np.uint8)
+                np.bitwise_or.at(union_bits, byte_positions[group_bytes], selected_bits[row, group_bytes])
+                counts[row, group] = popcount_bytes(union_bits).sum()
+
+    return counts if np.ndim(cell_bits) == 2 else counts[0]
+
+def compute_monthly_adoption(engine_view):
+    """
+    Serie mensual de adopción de la selección en orden cronológico: usuarios elegibles, activos,
+    % de adopción y usos totales de cada mes seleccionado, más la línea de tendencia (ajuste lineal
+    con np.polyfit sobre el % de adopción) cuando hay más de un mes
+
+    OPTIMIZACIÓN: Todos los meses se calculan juntos uniendo los bitsets de las celdas seleccionadas
+    del cubo. Las métricas, la tendencia y el resumen reutilizan la misma serie (ver build_metrics_context)
+
+    Returns:
+        dict: Elegibles de la selección, serie mensual (DataFrame) y coeficientes de la tendencia
+              (pendiente, intercepto) o None
+    """
+    adoption_cube = engine_view['engine']['cube']
+    cell_mask = engine_view['cell_mask']
+    single_group = np.zeros(len(cell_mask), dtype=np.int64)
+    chronological_order = np.argsort(engine_view['month_columns'], kind='stable')
+    month_columns = engine_view['month_columns'][chronological_order]
+
+    # Cada usuario aparece en todos los meses, así que los elegibles de cada mes son los de la selección
+    eligible_users = int(count_union_by_group(adoption_cube, cell_mask, single_group, 1, adoption_cube['eligible_bits'])[0])
+    monthly_active = count_union_by_group(adoption_cube, cell_mask, single_group, 1, adoption_cube['active_bits'][month_columns])[:, 0]
+    monthly_total = np.full(len(month_columns), eligible_users)
+
+    monthly = pd.DataFrame({
+        'Mes': [engine_view['engine']['months'][column] for column in month_columns],
+        'Total_Usuarios': monthly_total,
+        'Usuarios_Activos': monthly_active,
+        'Porcentaje_Adopcion': (monthly_active / monthly_total) * 100 if eligible_users > 0 else np.zeros(len(month_columns)),
+        'Total_Usos': adoption_cube['usage'][cell_mask][:, month_columns].sum(axis=0)
+    })
+
+    # Línea de tendencia del % de adopción (un punto por mes, en orden cronológico)
+    trend = None
+    if len(monthly) > 1:
+        trend = np.polyfit(list(range(len(monthly))), monthly['Porcentaje_Adopcion'].values, 1)
+        monthly['Tendencia'] = np.poly1d(trend)(list(range(len(monthly))))
+
+    return {
+        'eligible_users': eligible_users,
+        'series': monthly,
+        'trend': trend
+    }
+
+def compute_adoption_overview(engine_view, monthly_adoption):
+    """
+    Métricas principales de adopción para la selección: profesionales elegibles, usuarios activos,
+    % acumulado de adopción y totales/activos por mes (en el orden de los meses seleccionados)
+
+    OPTIMIZACIÓN: Se derivan de la serie mensual (ver compute_monthly_adoption); solo los activos en
+    cualquiera de los meses requieren una unión adicional de bitsets
+
+    Returns:
+        dict: Métricas de adopción
+    """
+    adoption_cube = engine_view['engine']['cube']
+    cell_mask = engine_view['cell_mask']
+    monthly = monthly_adoption['series']
+    eligible_users = monthly_adoption['eligible_users']
+    monthly_total = dict(zip(monthly['Mes'], monthly['Total_Usuarios'].tolist()))
+    monthly_active = dict(zip(monthly['Mes'], monthly['Usuarios_Activos'].tolist()))
+
+    month_active_bits = adoption_cube['active_bits'][engine_view['month_columns']]
+    active_users = int(count_union_by_group(
+        adoption_cube, cell_mask, np.zeros(len(cell_mask), dtype=np.int64), 1, np.bitwise_or.reduce(month_active_bits, axis=0)
+    )[0]) if len(month_active_bits) else 0
+
+    cumulative_adoption_rate = (active_users / eligible_users) * 100 if eligible_users > 0 else 0
+    monthly_rates = [
+        (monthly_active[month] / monthly_total[month]) * 100
+        for month in engine_view['months'] if monthly_total[month] > 0
+    ]
+    average_adoption_rate = sum(monthly_rates) / len(monthly_rates) if monthly_rates else 0
+
+    return {
+        'eligible_users': eligible_users,
+        'active_users': active_users,
+        'cumulative_adoption_rate': cumulative_adoption_rate,
+        'average_adoption_rate': average_adoption_rate,
+        'monthly_total': {month: monthly_total[month] for month in engine_view['months']},
+        'monthly_active': {month: monthly_active[month] for month in engine_view['months']},
+        'records': int(adoption_cube['user_count'][cell_mask].sum()) * len(engine_view['months'])
+    }
+
+def compute_adoption_by_cell(engine_view):
+    """
+    Usuarios elegibles y activos de cada celda (PAIS, AREA) de la selección, pivoteados en matrices
+    área × país con las áreas y los países ordenados alfabéticamente (como DataFrame.pivot)
+
+    OPTIMIZACIÓN: Cada celda del cubo guarda sus propios bytes de bitset, así que los usuarios distintos
+    de cada celda son el popcount de sus bytes (bincount por celda), sin recorrer las filas
+
+    Returns:
+        dict: Áreas y países presentes y matrices de elegibles, activos y % de adopción
+              (NaN en las combinaciones sin usuarios)
+    """
+    adoption_cube = engine_view['engine']['cube']
+    dimension_values = engine_view['engine']['dimension_values']
+    cell_mask = engine_view['cell_mask']
+    n_cells = len(cell_mask)
+
+    # Bitset de activos de cada celda en cualquiera de los meses seleccionados
+    month_active_bits = adoption_cube['active_bits'][engine_view['month_columns']]
+    any_month_active_bits = np.bitwise_or.reduce(month_active_bits, axis=0) \
+        if len(month_active_bits) else np.zeros_like(adoption_cube['eligible_bits'])
+
+    cell_eligible = np.bincount(adoption_cube['byte_cells'], weights=popcount_bytes(adoption_cube['eligible_bits']), minlength=n_cells)
+    cell_active = np.bincount(adoption_cube['byte_cells'], weights=popcount_bytes(any_month_active_bits), minlength=n_cells)
+
+    # Las categorías de PAIS y AREA están ordenadas, así que sus códigos siguen el orden alfabético
+    cells = np.flatnonzero(cell_mask)
+    country_codes, country_columns = np.unique(adoption_cube['cell_codes']['PAIS'][cells], return_inverse=True)
+    area_codes, area_rows = np.unique(adoption_cube['cell_codes']['AREA'][cells], return_inverse=True)
+
+    eligible = np.full((len(area_codes), len(country_codes)), np.nan)
+    active = np.full((len(area_codes), len(country_codes)), np.nan)
+    eligible[area_rows, country_columns] = cell_eligible[cells]
+    active[area_rows, country_columns] = cell_active[cells]
+
+    return {
+        'areas': [dimension_values['AREA'][code] for code in area_codes],
+        'countries': [dimension_values['PAIS'][code] for code in country_codes],
+        'eligible': eligible,
+        'active': active,
+        # Toda celda del cubo tiene al menos un usuario elegible
+        'adoption': (active / eligible) * 100
+    }
+
+def compute_dimension_statistics(engine_view, column):
+    """
+    Estadísticas por valor de una dimensión (PAIS o AREA) para la selección: usuarios elegibles y activos
+    (nombres distintos), % de adopción, usos totales y desviación estándar de los usos totales por usuario
+
+    OPTIMIZACIÓN: Se calculan en una sola pasada sobre los usuarios seleccionados, sumando por grupo
+    (valor, NOMBRE) del motor con bincount. Todas las secciones (gráficos, rankings, estadísticas
+    detalladas y resumen) reutilizan el mismo resultado (ver build_metrics_context).
+
+    Returns:
+        pd.DataFrame: Columnas valor, Total_Usuarios, Usuarios_Activos, Porcentaje_Adopcion, Total_Usos y
+                      Desviacion_Estandar, una fila por valor presente en la selección, en orden de
+                      primera aparición de la tabla long
+    """
+    usage_engine = engine_view['engine']
+    name_groups = usage_engine['name_groups'][column]
+    group_values = usage_engine['dimension_values'][column]
+    n_name_groups = len(name_groups['group_codes'])
+
+    selected_users = np.flatnonzero(engine_view['cell_mask'][usage_engine['cube']['user_cells']])
+    user_groups = name_groups['user_groups'][selected_users]
+    usage_sum_dtype = get_usage_sum_dtype(usage_engine['usage'])
+    user_usage = usage_engine['usage'][:, engine_view['month_columns']].sum(axis=1, dtype=usage_sum_dtype)[selected_users]
+    user_active = usage_engine['active'][:, engine_view['month_columns']].any(axis=1)[selected_users]
+
+    # Usos totales y actividad de cada nombre dentro de cada valor (igual que groupby NOMBRE por valor)
+    name_usage = np.bincount(user_groups, weights=user_usage, minlength=n_name_groups)
+    name_active = np.bincount(user_groups, weights=user_active, minlength=n_name_groups) > 0
+    present_names = np.flatnonzero(np.bincount(user_groups, minlength=n_name_groups))
+    name_values = name_groups['group_codes'][present_names]
+    name_usage = name_usage[present_names]
+
+    total_users = np.bincount(name_values, minlength=len(group_values))
+    active_users = np.bincount(name_values, weights=name_active[present_names], minlength=len(group_values)).astype(np.int64)
+    total_usage = np.bincount(name_values, weights=name_usage, minlength=len(group_values))
+
+    # Desviación estándar muestral (ddof=1, como Series.std) de los usos totales por usuario
+    mean_usage = np.divide(total_usage, total_users, out=np.zeros(len(group_values)), where=total_users > 0)
+    squared_deviations = np.bincount(name_values, weights=(name_usage - mean_usage[name_values]) ** 2, minlength=len(group_values))
+    std_deviation = np.sqrt(np.divide(squared_deviations, total_users - 1, out=np.zeros(len(group_values)), where=total_users > 1))
+
+    # Orden de primera aparición (igual que Series.unique sobre la tabla filtrada), desde las celdas del cubo
+    adoption_cube = usage_engine['cube']
+    cell_mask = engine_view['cell_mask']
+    group_first_user = np.full(len(group_values), np.iinfo(np.int64).max)
+    np.minimum.at(group_first_user, adoption_cube['cell_codes'][column][cell_mask], adoption_cube['first_user'][cell_mask])
+    present_groups = np.flatnonzero(group_first_user < np.iinfo(np.int64).max)
+    present_groups = present_groups[np.argsort(group_first_user[present_groups], kind='stable')]
+
+    # Todo valor presente en la selección tiene al menos un usuario elegible
+    statistics = pd.DataFrame({
+        'valor': [group_values[group] for group in present_groups],
+        'Total_Usuarios': total_users[present_groups],
+        'Usuarios_Activos': active_users[present_groups],
+        'Porcentaje_Adopcion': (active_users[present_groups] / total_users[present_groups]) * 100,
+        'Total_Usos': total_usage[present_groups].astype(usage_sum_dtype),
+        'Desviacion_Estandar': std_deviation[present_groups]
+    })
+    return statistics
+
+# ==========================================
+# FUNCIONES: ÍNDICE INVERTIDO DE FILTROS (BITMAPS POR VALOR)
+# ==========================================
+
+# Columnas de df_melted que se pueden filtrar desde el sidebar
+FILTER_INDEX_COLUMNS = ['PAIS', 'AREA', 'Mes']
+
+def build_filter_index(df_melted):
+    """
+    OPTIMIZACIÓN: Construye un índice invertido de df_melted: para cada valor de PAIS, AREA y Mes, el
+    bitmap (empaquetado, 1 bit por fila) de las filas que lo contienen. Se construye una sola vez al
+    cargar los datos.
+
+    Args:
+        df_melted: Tabla long con dimensiones categóricas (ver compact_melted_dtypes)
+
+    Returns:
+        dict: Índice con la cantidad de filas y, por columna, los valores y sus bitmaps
+    """
+    filter_index = {'n_rows': len(df_melted), 'columns': {}}
+
+    for column in FILTER_INDEX_COLUMNS:
+        codes = df_melted[column].cat.codes.to_numpy()
+        categories = list(df_melted[column].cat.categories)
+        filter_index['columns'][column] = {
+            'code_by_value': {value: code for code, value in enumerate(categories)},
+            'bitmaps': np.packbits(codes[None, :] == np.arange(len(categories))[:, None], axis=1)
+        }
+
+    return filter_index
+
+def filter_rows_with_index(df_melted, filter_index, selections):
+    """
+    Filtra df_melted intersectando los bitmaps de los valores seleccionados en cada columna y tomando
+    las filas resultantes de una sola vez (sin copias intermedias). Equivale a encadenar
+    df[df[columna].isin(valores)] para cada columna.
+
+    Args:
+        df_melted: Tabla long
+        filter_index: Índice invertido (ver build_filter_index)
+        selections: dict columna → valores seleccionados
+
+    Returns:
+        pd.DataFrame: Filas filtradas (conservan el índice original de df_melted)
+    """
+    combined_bits = None
+
+    for column, selected_values in selections.items():
+        column_index = filter_index['columns'][column]
+        selected_codes = sorted({column_index['code_by_value'][value] for value in selected_values if value in column_index['code_by_value']})
+
+        # Si se seleccionaron todos los valores de la columna, el filtro no descarta ninguna fila
+        if len(selected_codes) == len(column_index['code_by_value']):
+            continue
+
+        column_bits = np.bitwise_or.reduce(column_index['bitmaps'][selected_codes], axis=0) if selected_codes \
+            else np.zeros(column_index['bitmaps'].shape[1], dtype=np.uint8)
+        combined_bits = column_bits if combined_bits is None else combined_bits & column_bits
+
+    if combined_bits is None:
+        return df_melted
+
+    rows = np.flatnonzero(np.unpackbits(combined_bits, count=filter_index['n_rows']))
+    return df_melted.take(rows)
+
+# ==========================================
+# FUNCIONES: CACHÉ LRU DE RESULTADOS POR SELECCIÓN DE FILTROS
+# ==========================================
+
+# Memoria máxima (MB) de la caché de resultados, compartida por todas las sesiones del servidor
+RESULT_CACHE_MAX_MB = float(os.environ.get('SAI_RESULT_CACHE_MAX_MB', '256'))
+
+@st.cache_resource
+def get_result_cache():
+    """
+    OPTIMIZACIÓN: Caché de resultados (agregados, tablas y figuras) por selección de filtros, compartida
+    por todas las sesiones del servidor. Las entradas se ordenan de la menos a la más usada y se
+    eliminan las menos usadas cuando se supera RESULT_CACHE_MAX_MB.
+
+    Returns:
+        dict: Entradas por clave de selección, lock y contadores de uso
+    """
+    return {
+        'entries': OrderedDict(),
+        'lock': threading.Lock(),
+        'max_bytes': int(RESULT_CACHE_MAX_MB * 1024 * 1024),
+        'bytes': 0,
+        'hits': 0,
+        'misses': 0,
+        'evictions': 0
+    }
+
+def compute_dataset_fingerprint(current_fingerprints, fuzzy_stats):
+    """
+    Huella de los datos cargados: contenido de los archivos de entrada y tabla de coincidencias de
+    nombres aplicada (una revisión de coincidencias cambia los datos sin cambiar los archivos)
+    """
+    fingerprint_source = {
+        'files': {file_name: fingerprint['sha256'] for file_name, fingerprint in current_fingerprints.items()},
+        'fuzzy_matches': fuzzy_stats.get('table_hash') if fuzzy_stats else None
+    }
+    return hashlib.sha256(json.dumps(fingerprint_source, sort_keys=True).encode('utf-8')).hexdigest()
+
+def compute_selection_key(dataset_fingerprint, selected_months, selected_countries, selected_areas):
+    """
+    Clave canónica de una selección de filtros: no depende del orden en que se eligieron los valores
+
+    Returns:
+        str: Hash SHA-256 de la huella de los datos y los valores seleccionados ordenados
+    """
+    canonical_selection = json.dumps({
+        'dataset': dataset_fingerprint,
+        'Mes': sorted(set(selected_months)),
+        'PAIS': sorted(set(selected_countries)),
+        'AREA': sorted(set(selected_areas))
+    }, ensure_ascii=False)
+    return hashlib.sha256(canonical_selection.encode('utf-8')).hexdigest()
+
+def get_selection_results(selection_key):
+    """
+    Devuelve el diccionario de resultados de una selección (vacío si es la primera vez que se pide) y
+    la marca como la más usada
+
+    Returns:
+        dict: Resultados ya calculados para la selección; los que se agreguen quedan en la caché
+    """
+    result_cache = get_result_cache()
+
+    with result_cache['lock']:
+        entry = result_cache['entries'].get(selection_key)
+        if entry is not None:
+            result_cache['entries'].move_to_end(selection_key)
+            result_cache['hits'] += 1
+        else:
+            entry = {'results': {}, 'bytes': 0, 'sized_results': 0}
+            result_cache['entries'][selection_key] = entry
+            result_cache['misses'] += 1
+
+    return entry['results']
+
+def get_view_result(metrics_context, name, builder):
+    """
+    Devuelve un resultado (tabla o figura) de la selección del contexto de métricas, calculándolo con
+    builder() solo si todavía no está en la caché
+    """
+    results = metrics_context['results']
+    if name not in results:
+        results[name] = builder()
+
+    return results[name]
+
+def estimate_result_size(value):
+    """
+    Estima la memoria (bytes) de un resultado cacheado
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, go.Figure):
+        return len(value.to_json())
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (dict, MappingProxyType)):
+        return sum(estimate_result_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_result_size(item) for item in value)
+
+    return sys.getsizeof(value)
+
+def update_result_cache_size(selection_key):
+    """
+    Actualiza la memoria de la entrada de una selección después del rerun y elimina las entradas
+    menos usadas hasta volver a quedar bajo el límite (nunca la entrada que se acaba de usar)
+    """
+    result_cache = get_result_cache()
+
+    with result_cache['lock']:
+        entry = result_cache['entries'].get(selection_key)
+        if entry is None or len(entry['results']) == entry['sized_results']:
+            return
+        results = dict(entry['results'])
+
+    # Estimar fuera del lock (serializar figuras puede tardar algunos milisegundos)
+    entry_bytes = estimate_result_size(results)
+
+    with result_cache['lock']:
+        if result_cache['entries'].get(selection_key) is not entry:
+            return
+        result_cache['bytes'] += entry_bytes - entry['bytes']
+        entry['bytes'] = entry_bytes
+        entry['sized_results'] = len(results)
+
+        while result_cache['bytes'] > result_cache['max_bytes'] and len(result_cache['entries']) > 1:
+            oldest_key, oldest_entry = next(iter(result_cache['entries'].items()))
+            if oldest_key == selection_key:
+                break
+            del result_cache['entries'][oldest_key]
+            result_cache['bytes'] -= oldest_entry['bytes']
+            result_cache['evictions'] += 1
+
+def show_result_cache_stats():
+    """
+    Muestra en el sidebar los contadores de la caché de resultados (para operadores)
+    """
+    result_cache = get_result_cache()
+
+    with result_cache['lock']:
+        hits = result_cache['hits']
+        misses = result_cache['misses']
+        n_entries = len(result_cache['entries'])
+        cache_mb = result_cache['bytes'] / (1024 * 1024)
+        evictions = result_cache['evictions']
+
+    with st.sidebar.expander("🗄️ Caché de resultados"):
+        st.caption(
+            f"Aciertos: {hits} | Fallos: {misses} | "
+            f"Tasa de aciertos: {(hits / (hits + misses)) * 100 if hits + misses > 0 else 0:.1f}%"
+        )
+        st.caption(
+            f"Entradas: {n_entries} | Memoria: {cache_mb:.1f} MB de {RESULT_CACHE_MAX_MB:.0f} MB | "
+            f"Entradas eliminadas (LRU): {evictions}"
+        )
+
+# ==========================================
+# FUNCIONES: CONTEXTO DE MÉTRICAS POR SELECCIÓN
+# ==========================================
+
+def compute_dimension_counts(engine_view):
+    """
+    Cantidad de países, áreas y cargos distintos presentes en la selección (desde las celdas del cubo)
+    """
+    adoption_cube = engine_view['engine']['cube']
+    cells = np.flatnonzero(engine_view['cell_mask'])
+
+    return {
+        'PAIS': len(np.unique(adoption_cube['cell_codes']['PAIS'][cells])),
+        'AREA': len(np.unique(adoption_cube['cell_codes']['AREA'][cells])),
+        'CARGO': int(adoption_cube['cargos'][cells].any(axis=0).sum())
+    }
+
+def build_metrics_context(engine_view, filtered_data, results):
+    """
+    OPTIMIZACIÓN: Construye el contexto de métricas de la selección: todos los agregados que usan el
+    dashboard y el texto para el LLM, calculados una sola vez por selección de filtros. Los agregados
+    se guardan en la entrada de la caché de resultados de la selección (results), así que en un rerun
+    con los mismos filtros no se vuelve a calcular ninguno.
+
+    El contexto es de solo lectura (MappingProxyType): las funciones de visualización leen de él y
+    nunca modifican los agregados.
+
+    Args:
+        engine_view: Selección de filtros sobre el motor matricial (ver create_engine_view)
+        filtered_data: Tabla long filtrada
+        results: Resultados ya calculados para la selección (ver get_selection_results)
+
+    Returns:
+        MappingProxyType: Agregados de la selección, resultados cacheados (para tablas y figuras) y
+                          los agregados calculados en este rerun con su tiempo en segundos
+    """
+    aggregate_builders = {
+        'monthly_adoption': lambda: compute_monthly_adoption(engine_view),
+        'overview': lambda: compute_adoption_overview(engine_view, results['monthly_adoption']),
+        'country_statistics': lambda: compute_dimension_statistics(engine_view, 'PAIS'),
+        'area_statistics': lambda: compute_dimension_statistics(engine_view, 'AREA'),
+        'cell_adoption': lambda: compute_adoption_by_cell(engine_view),
+        'dimension_counts': lambda: compute_dimension_counts(engine_view),
+        'top_5_users': lambda: create_top_5_users_by_usage(filtered_data)
+    }
+
+    # Instrumentación: agregados calculados en este rerun (los demás se reutilizan de la caché)
+    computed_aggregates = {}
+    for name, builder in aggregate_builders.items():
+        if name not in results:
+            start_time = time.perf_counter()
+            results[name] = builder()
+            computed_aggregates[name] = time.perf_counter() - start_time
+
+    metrics_context = {name: results[name] for name in aggregate_builders}
+    metrics_context['results'] = results
+    metrics_context['computed_aggregates'] = MappingProxyType(computed_aggregates)
+
+    return MappingProxyType(metrics_context)
+
+def show_metrics_context_stats(metrics_context):
+    """
+    Muestra en el sidebar qué agregados del contexto de métricas se calcularon en este rerun (para
+    operadores): cada agregado se calcula una sola vez por selección de filtros
+    """
+    computed_aggregates = metrics_context['computed_aggregates']
+
+    with st.sidebar.expander("🧮 Agregados del rerun"):
+        if not computed_aggregates:
+            st.caption("Ningún agregado calculado: todos se reutilizaron de la caché de resultados")
+            return
+
+        total_ms = sum(computed_aggregates.values()) * 1000
+        st.caption(f"Agregados calculados: {len(computed_aggregates)} (1 vez cada uno) en {total_ms:.1f} ms")
+        for name, seconds in computed_aggregates.items():
+            st.caption(f"- {name}: {seconds * 1000:.1f} ms")
+
+# ==========================================
+# FUNCIÓN OPTIMIZADA: PROCESAMIENTO DE ARCHIVOS DE ENTRADA (SIN INTERFAZ)
+# ==========================================
+
+@st.cache_data
+def process_input_files(_force_rebuild=False):
+    """
+    Procesa automáticamente dos archivos de entrada y los convierte en el formato requerido
+    para el dashboard de adopción SAI.
+    
+    Busca automáticamente los archivos en el directorio actual:
+    - areas_personas.xlsx: Datos de usuarios (debe contener columnas: NOMBRE, PAIS, CARGO, AREA)
+    - uso_por_mes.xlsx: Datos de uso mensual (debe contener NOMBRE y columnas de meses)
+    
+    OPTIMIZACIÓN: Si existe un snapshot generado a partir de los mismos archivos (misma huella),
+    se carga el snapshot en lugar de volver a leer los Excel. Si solo cambió uso_por_mes.xlsx,
+    se procesan únicamente los meses nuevos o modificados.
+    
+    Args:
+        _force_rebuild: Si es True, ignora el snapshot y vuelve a procesar los archivos Excel por completo.
+                        Con guion bajo para que no forme parte de la clave de st.cache_data: el resultado
+                        de la reconstrucción queda cacheado para los reruns normales
+    
+    Returns:
+        tuple: (df_original, df_melted, month_columns_sorted, usage_engine, load_info) o (None, None, None, None, None)
+               si hay error. usage_engine es el motor matricial usuario × mes (ver build_usage_engine).
+               load_info indica el origen de los datos ('snapshot', 'incremental' o 'excel') y el tiempo de carga.
+    """
+    try:
+        start_time = time.perf_counter()
+        
+        # Archivos fijos predefinidos
+        current_dir = os.getcwd()
+        file_areas_personas = os.path.join(current_dir, 'areas_personas.xlsx')
+        file_uso_por_mes = os.path.join(current_dir, 'uso_por_mes.xlsx')
+        
+        # Verificar que ambos archivos existan
+        if not os.path.exists(file_areas_personas):
+            st.error(f"❌ No se encontró el archivo: areas_personas.xlsx")
+            return None, None, None, None, None
+            
+        if not os.path.exists(file_uso_por_mes):
+            st.error(f"❌ No se encontró el archivo: uso_por_mes.xlsx")
+            return None, None, None, None, None
+        
+        # OPTIMIZACIÓN: Usar el snapshot si los archivos de entrada no cambiaron
+        current_fingerprints = {
+            'areas_personas.xlsx': compute_file_fingerprint(file_areas_personas),
+            'uso_por_mes.xlsx': compute_file_fingerprint(file_uso_por_mes)
+        }
+        
+        if not _force_rebuild:
+            snapshot = load_data_snapshot(current_fingerprints)
+            if snapshot is not None:
+                df_merged, df_melted, month_columns_sorted, fuzzy_stats = snapshot
+                load_info = {
+                    'source': 'snapshot',
+                    'seconds': time.perf_counter() - start_time,
+                    'fuzzy_stats': fuzzy_stats
+                }
+                usage_engine = build_usage_engine(df_melted, month_columns_sorted)
+                usage_engine['fingerprint'] = compute_dataset_fingerprint(current_fingerprints, fuzzy_stats)
+                return df_merged, df_melted, month_columns_sorted, usage_engine, load_info
+            
+            # OPTIMIZACIÓN: Si solo cambió uso_por_mes.xlsx, procesar únicamente los meses nuevos o modificados
+            incremental_update = update_snapshot_incrementally(current_fingerprints, file_uso_por_mes)
+            if incremental_update is not None:
+                df_merged, df_melted, month_columns_sorted, months_updated, fuzzy_stats = incremental_update
+                load_info = {
+                    'source': 'incremental',
+                    'seconds': time.perf_counter() - start_time,
+                    'months_updated': months_updated,
+                    'fuzzy_stats': fuzzy_stats
+                }
+                usage_engine = build_usage_engine(df_melted, month_columns_sorted)
+                usage_engine['fingerprint'] = compute_dataset_fingerprint(current_fingerprints, fuzzy_stats)
+                return df_merged, df_melted, month_columns_sorted, usage_engine, load_info
+        
+        # Cargar archivos automáticamente
+        if USE_STREAMING_EXCEL_READER:
+            df_users = read_excel_streaming(file_areas_personas)
+        else:
+            df_users = pd.read_excel(file_areas_personas)
+        
+        # Cargar archivo de uso sin la columna 'Total' ni la segunda fila (índice 1)
+        df_usage = read_usage_file(file_uso_por_mes)
+        
+        # Validar columnas requeridas en archivo de usuarios
+        required_user_columns = ['NOMBRE', 'PAIS', 'CARGO', 'AREA']
+        missing_user_cols = [col for col in required_user_columns if col not in df_users.columns]
+        
+        if missing_user_cols:
+            st.error(f"❌ Faltan columnas en areas_personas.xlsx: {missing_user_cols}")
+            st.info(f"📋 Columnas disponibles: {list(df_users.columns)}")
+            return None, None, None, None, None
+        
+        # Validar que archivo de uso tenga columna NOMBRE
+        if 'NOMBRE' not in df_usage.columns:
+            st.error(f"❌ Falta columna 'NOMBRE' en uso_por_mes.xlsx")
+            st.info(f"📋 Columnas disponibles: {list(df_usage.columns)}")
+            return None, None, None, None, None
+        
+        # OPTIMIZACIÓN: Normalizar nombres eliminando espacios extras y convirtiendo a mayúsculas
+        # Guardar nombres originales para mantenerlos en el resultado final
+        df_users['NOMBRE_ORIGINAL'] = df_users['NOMBRE']
+        df_usage['NOMBRE_ORIGINAL'] = df_usage['NOMBRE']
+        
+        # Aplicar normalización a ambos dataframes (vectorizada y con tabla persistente de nombres ya vistos)
+        df_users['NOMBRE_NORMALIZADO'] = normalize_names_cached(df_users['NOMBRE'])
+        df_usage['NOMBRE_NORMALIZADO'] = normalize_names_cached(df_usage['NOMBRE'])
+        
+        # Identificar columnas de meses en archivo de uso
+        month_columns = [col for col in df_usage.columns if col not in ['NOMBRE', 'NOMBRE_ORIGINAL', 'NOMBRE_NORMALIZADO']]
+        
+        if not month_columns:
+            st.error(f"❌ No se encontraron columnas de meses en uso_por_mes.xlsx")
+            return None, None, None, None, None
+        
+        # Segunda etapa del cruce: nombres que solo difieren levemente entre ambos archivos (tildes,
+        # letras de más o de menos) se reescriben con el nombre normalizado de areas_personas.xlsx
+        fuzzy_mapping, fuzzy_stats = match_unmatched_names(df_users['NOMBRE_NORMALIZADO'], df_usage['NOMBRE_NORMALIZADO'])
+        if fuzzy_mapping:
+            df_usage['NOMBRE_NORMALIZADO'] = df_usage['NOMBRE_NORMALIZADO'].replace(fuzzy_mapping)
+        
+        # Realizar merge usando nombres normalizados
+        df_merged = pd.merge(
+            df_users, 
+            df_usage, 
+            on='NOMBRE_NORMALIZADO', 
+            how='inner',
+            suffixes=('_users', '_usage')
+        )
+        
+        if len(df_merged) == 0:
+            st.error("❌ No se encontraron coincidencias entre los archivos. Verifica que los nombres coincidan.")
+            # Mostrar algunos ejemplos de nombres para debugging
+            st.info("📋 Ejemplos de nombres en areas_personas.xlsx (normalizados):")
+            st.text(df_users['NOMBRE_NORMALIZADO'].head(10).tolist())
+            st.info("📋 Ejemplos de nombres en uso_por_mes.xlsx (normalizados):")
+            st.text(df_usage['NOMBRE_NORMALIZADO'].head(10).tolist())
+            return None, None, None, None, None
+        
+        # Usar el nombre original del archivo de usuarios como nombre principal
+        df_merged['NOMBRE'] = df_merged['NOMBRE_ORIGINAL_users']
+        
+        # Eliminar columnas auxiliares que ya no necesitamos (el nombre normalizado se conserva para el snapshot)
+        columns_to_drop = ['NOMBRE_ORIGINAL_users', 'NOMBRE_ORIGINAL_usage']
+        df_merged = df_merged.drop(columns=columns_to_drop, errors='ignore')
+        
+        # Limpiar valores nulos en las columnas básicas
+        df_merged['NOMBRE'] = df_merged['NOMBRE'].fillna('Sin Nombre')
+        df_merged['PAIS'] = df_merged['PAIS'].fillna('Sin País')
+        df_merged['CARGO'] = df_merged['CARGO'].fillna('Sin Cargo')
+        df_merged['AREA'] = df_merged['AREA'].fillna('Sin Área')
+
+        # FILTRAR: Excluir área de "Operaciones"
+        df_merged = df_merged[df_merged['AREA'].str.lower() != 'operaciones']
+        
+        # Si todas las coincidencias eran de Operaciones no quedan usuarios para el dashboard (ni para
+        # el motor matricial, que necesita al menos un usuario por mes)
+        if len(df_merged) == 0:
+            st.error("❌ Todas las coincidencias entre los archivos pertenecen al área Operaciones, que se excluye del análisis.")
+            return None, None, None, None, None
+
+        # Ordenar meses cronológicamente
+        month_columns_sorted = sort_months_chronologically(month_columns)
+
+        # Convertir datos a formato long para mejor análisis (una partición por mes con los usos de IA ya limpios)
+        df_dimensions = df_merged.drop(columns=month_columns).reset_index(drop=True)
+        month_slices = [
+            build_month_slice(df_dimensions, month, clean_usage_values(df_merged[month]))
+            for month in month_columns
+        ]
+        df_merged, df_melted = assemble_snapshot_tables(df_dimensions, month_columns, month_slices, month_columns_sorted)
+        
+        # Guardar snapshot para que los próximos arranques no tengan que releer los Excel
+        roster_keys = df_users['NOMBRE_NORMALIZADO'].unique()
+        matched_keys = df_usage.loc[df_usage['NOMBRE_NORMALIZADO'].isin(roster_keys), 'NOMBRE_NORMALIZADO']
+        snapshot_saved = save_data_snapshot(
+            current_fingerprints, df_dimensions, roster_keys, matched_keys,
+            month_columns, month_slices, month_columns_sorted, fuzzy_stats
+        )
+        
+        load_info = {
+            'source': 'excel',
+            'seconds': time.perf_counter() - start_time,
+            'snapshot_saved': snapshot_saved,
+            'fuzzy_stats': fuzzy_stats
+        }
+        
+        usage_engine = build_usage_engine(df_melted, month_columns_sorted)
+        usage_engine['fingerprint'] = compute_dataset_fingerprint(current_fingerprints, fuzzy_stats)
+        return df_merged, df_melted, month_columns_sorted, usage_engine, load_info
+        
+    except Exception as e:
+        st.error(f"❌ Error al procesar los archivos: {str(e)}")
+        st.info("💡 Verifica que los archivos tengan el formato correcto y las columnas requeridas")
+        return None, None, None, None, None
+
+# ==========================================
+# FUNCIONES: CACHÉ PERSISTENTE DE RESPUESTAS DEL LLM
+# ==========================================
+
+# OPTIMIZACIÓN: Las respuestas del LLM se guardan en disco, por plantilla, datos enviados y pregunta, para
+# no repetir llamadas de varios segundos cuando se vuelve a pedir lo mismo sobre una selección sin cambios
+USE_LLM_RESPONSE_CACHE = os.environ.get('SAI_LLM_CACHE', '1') != '0'
+LLM_RESPONSE_CACHE_TTL_HOURS = float(os.environ.get('SAI_LLM_CACHE_TTL_HOURS', '24'))
+LLM_RESPONSE_CACHE_MAX_MB = float(os.environ.get('SAI_LLM_CACHE_MAX_MB', '50'))
+
+LLM_LOGGER = logging.getLogger('dash_sai.llm')
+if not LLM_LOGGER.handlers:
+    LLM_LOGGER.addHandler(logging.StreamHandler())
+    LLM_LOGGER.setLevel(logging.INFO)
+
+def get_llm_cache_dir():
+    """
+    Devuelve el directorio donde se guardan las respuestas cacheadas del LLM (un archivo JSON por respuesta)
+    """
+    return os.path.join(os.getcwd(), CACHE_DIR_NAME, 'respuestas_llm')
+
+@st.cache_resource
+def get_llm_cache_stats():
+    """
+    Contadores de la caché de respuestas del LLM, compartidos por todas las sesiones del proceso
+    """
+    return {
+        'lock': threading.Lock(),
+        'hits': 0,
+        'misses': 0,
+        'saved_seconds': 0.0
+    }
+
+def normalize_pregunta(pregunta):
+    """
+    Normaliza una pregunta para la clave de la caché: sin distinguir mayúsculas ni espacios repetidos
+    """
+    return ' '.join(pregunta.split()).casefold()
+
+def compute_llm_cache_key(template_id, data_text, pregunta=None):
+    """
+    Clave de la caché: plantilla, hash de los datos enviados y pregunta normalizada
+    """
+    data_hash = hashlib.sha256(data_text.encode('utf-8')).hexdigest()
+    key_parts = [template_id, data_hash, normalize_pregunta(pregunta) if pregunta is not None else None]
+    return hashlib.sha256(json.dumps(key_parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def read_llm_cache_entry(cache_key):
+    """
+    Lee una respuesta cacheada. Las entradas vencidas (más antiguas que el TTL) se eliminan.
+
+    Returns:
+        dict: Entrada (respuesta, fecha de creación y duración de la llamada original) o None
+    """
+    entry_path = os.path.join(get_llm_cache_dir(), f'{cache_key}.json')
+
+    try:
+        with open(entry_path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if time.time() - entry['created_at'] > LLM_RESPONSE_CACHE_TTL_HOURS * 3600:
+        with contextlib.suppress(OSError):
+            os.remove(entry_path)
+        return None
+
+    # La fecha de modificación marca el último uso (ver evict_llm_cache_entries)
+    with contextlib.suppress(OSError):
+        os.utime(entry_path)
+
+    return entry
+
+def write_llm_cache_entry(cache_key, entry):
+    """
+    Guarda una respuesta en la caché de forma atómica y aplica el límite de tamaño
+    """
+    cache_dir = get_llm_cache_dir()
+    entry_path = os.path.join(cache_dir, f'{cache_key}.json')
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{entry_path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, entry_path)
+    except OSError:
+        return
+
+    evict_llm_cache_entries()
+
+def evict_llm_cache_entries():
+    """
+    Elimina las respuestas vencidas y, si la caché supera LLM_RESPONSE_CACHE_MAX_MB, las usadas hace más
+    tiempo (LRU por fecha de modificación)
+    """
+    cache_dir = get_llm_cache_dir()
+    entries = []
+
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.json'):
+            with contextlib.suppress(OSError):
+                entry_stat = entry.stat()
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+
+    now = time.time()
+    max_bytes = LLM_RESPONSE_CACHE_MAX_MB * 1024 * 1024
+    total_bytes = sum(size for _, size, _ in entries)
+
+    for mtime, size, path in sorted(entries):
+        if total_bytes <= max_bytes and now - mtime <= LLM_RESPONSE_CACHE_TTL_HOURS * 3600:
+            continue
+        with contextlib.suppress(OSError):
+            os.remove(path)
+            total_bytes -= size
+
+def record_llm_cache_lookup(template_id, hit, saved_seconds=0.0):
+    """
+    Actualiza los contadores de la caché de respuestas y registra en el log la tasa de aciertos y el
+    tiempo de espera ahorrado
+    """
+    stats = get_llm_cache_stats()
+
+    with stats['lock']:
+        if hit:
+            stats['hits'] += 1
+            stats['saved_seconds'] += saved_seconds
+        else:
+            stats['misses'] += 1
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = stats['hits'] / lookups * 100
+        total_saved_seconds = stats['saved_seconds']
+
+    LLM_LOGGER.info(
+        "Caché LLM %s (plantilla %s): tasa de aciertos %.1f%% (%d consultas), %.1f s ahorrados en total",
+        'acierto' if hit else 'fallo', template_id, hit_rate, lookups, total_saved_seconds
+    )
+
+def show_llm_cache_stats():
+    """
+    Muestra en el sidebar los contadores de la caché de respuestas del LLM (para operadores)
+    """
+    stats = get_llm_cache_stats()
+
+    with stats['lock']:
+        hits = stats['hits']
+        misses = stats['misses']
+        saved_seconds = stats['saved_seconds']
+
+    with st.sidebar.expander("🤖 Caché de respuestas IA"):
+        if not USE_LLM_RESPONSE_CACHE:
+            st.caption("Caché desactivada (SAI_LLM_CACHE=0)")
+        else:
+            st.caption(
+                f"Aciertos: {hits} | Fallos: {misses} | "
+                f"Tasa de aciertos: {(hits / (hits + misses)) * 100 if hits + misses > 0 else 0:.1f}%"
+            )
+            st.caption(
+                f"Espera ahorrada: {saved_seconds:.1f} s | TTL: {LLM_RESPONSE_CACHE_TTL_HOURS:g} h | "
+                f"Límite: {LLM_RESPONSE_CACHE_MAX_MB:.0f} MB"
+            )
+        show_llm_flight_stats()
+
+def format_llm_cache_age(age_seconds):
+    """
+    Antigüedad de una respuesta cacheada en texto (segundos, minutos u horas)
+    """
+    if age_seconds < 60:
+        return f"{int(age_seconds)} s"
+    if age_seconds < 3600:
+        return f"{int(age_seconds // 60)} min"
+
+    return f"{age_seconds / 3600:.1f} h"
+
+def show_llm_cache_notice(llm_result):
+    """
+    Marca en la interfaz una respuesta servida desde la caché o compartida con una consulta idéntica
+    """
+    if llm_result['cached']:
+        st.info(
+            f"⚡ Respuesta desde caché (generada hace {format_llm_cache_age(llm_result['age_seconds'])}; "
+            f"evitó una espera de {llm_result['seconds']:.1f} s). Marca \"Forzar nueva consulta\" para regenerarla."
+        )
+    elif llm_result['coalesced']:
+        st.info("🤝 Respuesta compartida con una consulta idéntica que ya estaba en curso.")
+
+def show_llm_response_timing(llm_result):
+    """
+    Muestra cuánto tardó en llegar el primer fragmento de texto y la respuesta completa
+    """
+    if llm_result['first_chunk_seconds'] is not None:
+        st.caption(
+            f"⏱️ Primer texto a los {llm_result['first_chunk_seconds']:.1f} s · "
+            f"respuesta completa en {llm_result['seconds']:.1f} s"
+        )
+    
+    # Métricas por etapa de las consultas por bloques (map-reduce)
+    for stage in llm_result.get('stages', []):
+        stage_label = "Bloques en paralelo" if stage['stage'] == 'map' else "Combinación final"
+        st.caption(
+            f"🧩 {stage_label}: {stage['calls']} consulta(s) · {stage['payload_bytes'] / 1024:.1f} KB enviados "
+            f"(máx {stage['max_payload_bytes'] / 1024:.1f} KB por consulta) · {stage['seconds']:.1f} s · "
+            f"{stage['cached_calls']} desde caché"
+        )
+
+# ==========================================
+# FUNCIONES: CLIENTE HTTP DEL SERVICIO SAI
+# ==========================================
+
+# URL base del servicio (configurable, por ejemplo para apuntar a un servidor local de pruebas)
+LLM_SERVICE_URL = os.environ.get('SAI_API_BASE_URL', "https://sai-library.saiapplications.com").rstrip('/')
+
+# OPTIMIZACIÓN: Conexiones reutilizables (keep-alive) con tiempos máximos, reintentos acotados y un plazo
+# total por llamada, para que un servicio lento o caído no deje bloqueada la sesión indefinidamente
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('SAI_LLM_CONNECT_TIMEOUT', '5'))
+LLM_READ_TIMEOUT_SECONDS = float(os.environ.get('SAI_LLM_READ_TIMEOUT', '90'))
+LLM_CALL_DEADLINE_SECONDS = float(os.environ.get('SAI_LLM_DEADLINE', '120'))
+LLM_MAX_RETRIES = int(os.environ.get('SAI_LLM_MAX_RETRIES', '3'))
+LLM_RETRY_BACKOFF_SECONDS = 0.5
+LLM_RETRY_BACKOFF_MAX_SECONDS = 8.0
+LLM_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+LLM_POOL_SIZE = int(os.environ.get('SAI_LLM_POOL_SIZE', '10'))
+
+# OPTIMIZACIÓN: La respuesta se consume como stream (SSE o chunked, con fallback a la respuesta completa
+# si el servicio no la envía por partes) para mostrar el texto a medida que se genera
+USE_LLM_STREAMING = os.environ.get('SAI_LLM_STREAM', '1') != '0'
+LLM_STREAM_ACCEPT_HEADER = "text/event-stream, text/plain;q=0.9, */*;q=0.8"
+LLM_STREAM_TEXT_FIELDS = ('text', 'delta', 'content', 'token')
+
+@st.cache_resource
+def get_llm_http_session():
+    """
+    Sesión HTTP compartida por todas las sesiones del proceso: mantiene abiertas las conexiones con el
+    servicio (sin un handshake TLS nuevo por llamada). Los reintentos se hacen en post_llm_template.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_POOL_SIZE, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+def compute_retry_delay(attempt, response=None):
+    """
+    Espera antes del reintento número attempt (desde 0): backoff exponencial con jitter completo, o el
+    Retry-After del servicio si pide esperar más
+    """
+    delay = random.uniform(0, min(LLM_RETRY_BACKOFF_MAX_SECONDS, LLM_RETRY_BACKOFF_SECONDS * 2 ** attempt))
+
+    if response is not None:
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+
+    return delay
+
+def post_llm_template(template_id, inputs, api_key, deadline_seconds=None, cancel_event=None, stream=False, deadline=None):
+    """
+    Ejecuta una plantilla del servicio con la sesión compartida. Reintenta (hasta LLM_MAX_RETRIES veces)
+    los errores de conexión y las respuestas 429/5xx, sin superar el plazo total de la llamada ni
+    seguir reintentando si la consulta se canceló.
+
+    Args:
+        template_id: Id de la plantilla del servicio
+        inputs: Variables de la plantilla
+        api_key: Clave de API para el servicio
+        deadline_seconds: Plazo total de la llamada, reintentos incluidos (por defecto LLM_CALL_DEADLINE_SECONDS)
+        cancel_event: threading.Event opcional; si se activa no se hacen más intentos
+        stream: True para no leer el cuerpo de la respuesta (ver iter_llm_response_chunks)
+        deadline: Instante (time.monotonic) en que vence el plazo, si ya corre desde antes (por ejemplo
+                  para que la lectura del stream use el mismo plazo); por defecto ahora + deadline_seconds
+
+    Returns:
+        requests.Response: Última respuesta del servicio
+
+    Raises:
+        requests.RequestException: Error de conexión, plazo agotado tras los reintentos o consulta cancelada
+    """
+    session = get_llm_http_session()
+    deadline_seconds = deadline_seconds or LLM_CALL_DEADLINE_SECONDS
+    if deadline is None:
+        deadline = time.monotonic() + deadline_seconds
+    url = f"{LLM_SERVICE_URL}/api/templates/{template_id}/execute"
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        if cancel_event is not None and cancel_event.is_set():
+            raise requests.RequestException("consulta cancelada")
+
+        remaining_seconds = deadline - time.monotonic()
+        if remaining_seconds <= 0:
+            raise requests.Timeout(f"se superó el plazo de {deadline_seconds:g} s")
+
+        read_timeout = min(LLM_READ_TIMEOUT_SECONDS, remaining_seconds)
+        try:
+            response = session.post(
+                url,
+                json={"inputs": inputs},
+                headers={"X-Api-Key": api_key, "Accept": LLM_STREAM_ACCEPT_HEADER} if stream else {"X-Api-Key": api_key},
+                timeout=(min(LLM_CONNECT_TIMEOUT_SECONDS, remaining_seconds), read_timeout),
+                stream=stream
+            )
+        except requests.ReadTimeout:
+            # El servicio no respondió a tiempo: no se reintenta (volvería a esperar lo mismo)
+            if read_timeout < LLM_READ_TIMEOUT_SECONDS:
+                raise requests.Timeout(f"se superó el plazo de {deadline_seconds:g} s") from None
+            raise
+        except requests.ConnectionError:
+            # Sin respuesta del servicio (incluye el tiempo máximo de conexión): se puede reintentar
+            response = None
+            if attempt == LLM_MAX_RETRIES:
+                raise
+        else:
+            if response.status_code not in LLM_RETRY_STATUS_CODES or attempt == LLM_MAX_RETRIES:
+                return response
+
+        retry_delay = compute_retry_delay(attempt, response)
+        if time.monotonic() + retry_delay >= deadline:
+            if response is not None:
+                return response
+            raise requests.Timeout(f"se superó el plazo de {deadline_seconds:g} s")
+
+        LLM_LOGGER.info(
+            "Reintento %d de la plantilla %s en %.2f s (%s)",
+            attempt + 1, template_id, retry_delay,
+            f"código {response.status_code}" if response is not None else "error de conexión"
+        )
+        if response is not None:
+            # El cuerpo de una respuesta de error es breve: leerlo deja la conexión libre para el reintento
+            response.content
+            response.close()
+        # La espera se interrumpe en cuanto se cancela la consulta
+        if cancel_event is not None:
+            cancel_event.wait(retry_delay)
+        else:
+            time.sleep(retry_delay)
+
+def parse_sse_data(data):
+    """
+    Texto de un evento SSE: el campo de texto si el evento es JSON (ver LLM_STREAM_TEXT_FIELDS) o el
+    dato tal cual si es texto plano
+    """
+    if data[:1] not in ('{', '"'):
+        return data
+
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return data
+
+    if isinstance(payload, str):
+        return payload
+    if isinstance(payload, dict):
+        for field in LLM_STREAM_TEXT_FIELDS:
+            if isinstance(payload.get(field), str):
+                return payload[field]
+    return data
+
+def iter_sse_text(text_chunks):
+    """
+    Convierte un stream Server-Sent Events en los textos de sus eventos (une las líneas 'data:' de cada
+    evento, ignora comentarios y el marcador final [DONE])
+    """
+    pending_line = ''
+    event_lines = []
+
+    for text_chunk in text_chunks:
+        lines = (pending_line + text_chunk).split('\n')
+        pending_line = lines.pop()
+
+        for line in lines:
+            line = line.rstrip('\r')
+            if line:
+                if line.startswith('data:'):
+                    event_lines.append(line[6:] if line.startswith('data: ') else line[5:])
+                continue
+
+            # Línea vacía: fin del evento
+            if event_lines:
+                data = '\n'.join(event_lines)
+                event_lines = []
+                if data != '[DONE]':
+                    yield parse_sse_data(data)
+
+    if pending_line.startswith('data:'):
+        event_lines.append(pending_line[6:] if pending_line.startswith('data: ') else pending_line[5:])
+    if event_lines and '\n'.join(event_lines) != '[DONE]':
+        yield parse_sse_data('\n'.join(event_lines))
+
+def iter_llm_response_chunks(response, cancel_event=None, deadline=None, deadline_seconds=None):
+    """
+    Lee el cuerpo de una respuesta pedida con stream=True a medida que llega: eventos SSE si el servicio
+    responde text/event-stream, o los bloques de texto tal como llegan (chunked). Si el servicio envía la
+    respuesta completa de una vez se obtiene un único bloque.
+
+    Args:
+        response: Respuesta de post_llm_template(..., stream=True)
+        cancel_event: threading.Event opcional; si se activa se corta la lectura
+        deadline: Instante (time.monotonic) en que vence el plazo total de la llamada
+        deadline_seconds: Duración de ese plazo, para el mensaje de error (por defecto LLM_CALL_DEADLINE_SECONDS)
+
+    Yields:
+        str: Fragmentos de texto de la respuesta
+
+    Raises:
+        requests.RequestException: Consulta cancelada o plazo agotado durante la lectura
+    """
+    # Codificación indicada en las cabeceras, como en response.text (UTF-8 si no la indican)
+    if response.encoding is None:
+        response.encoding = 'utf-8'
+
+    text_chunks = response.iter_content(chunk_size=None, decode_unicode=True)
+    if response.headers.get('Content-Type', '').startswith('text/event-stream'):
+        text_chunks = iter_sse_text(text_chunks)
+
+    for text_chunk in text_chunks:
+        if cancel_event is not None and cancel_event.is_set():
+            raise requests.RequestException("consulta cancelada")
+        if deadline is not None and time.monotonic() > deadline:
+            raise requests.Timeout(f"se superó el plazo de {deadline_seconds or LLM_CALL_DEADLINE_SECONDS:g} s")
+        if text_chunk:
+            yield text_chunk
+
+# ==========================================
+# FUNCIONES: CONSULTAS IDÉNTICAS COMPARTIDAS (SINGLE-FLIGHT)
+# ==========================================
+
+# OPTIMIZACIÓN: Las consultas idénticas (misma plantilla y mismos datos) que coinciden en el tiempo, por
+# ejemplo varios gerentes generando el resumen con los filtros por defecto, comparten una sola llamada
+# al servicio y todas reciben su resultado. Como en la caché de respuestas, la API Key no forma parte de
+# la clave: la respuesta de una llamada autorizada se comparte con las unidas a ella sea cual sea su clave
+USE_LLM_SINGLE_FLIGHT = os.environ.get('SAI_LLM_SINGLE_FLIGHT', '1') != '0'
+LLM_FLIGHT_WAIT_SECONDS = 0.2
+# Errores propios de quien hizo la llamada: las consultas unidas a ella repiten la consulta
+LLM_CALLER_ERRORS = ("consulta cancelada", "Código de estado 401", "Código de estado 403")
+
+@st.cache_resource
+def get_llm_flights():
+    """
+    Consultas en curso por clave y contadores de consultas compartidas, para todas las sesiones del proceso
+    """
+    return {
+        'lock': threading.Lock(),
+        'flights': {},
+        'upstream_calls': 0,
+        'coalesced_calls': 0,
+        'repeated_calls': 0
+    }
+
+def is_caller_llm_error(response_text):
+    """
+    Indica si el error de una consulta depende de quien la hizo (cancelación o API Key rechazada) y
+    no debe compartirse con las consultas unidas a ella
+    """
+    return response_text.startswith("Error") and any(error in response_text for error in LLM_CALLER_ERRORS)
+
+def show_llm_flight_stats():
+    """
+    Muestra los contadores de consultas compartidas (dentro del expander de la caché de respuestas)
+    """
+    if not USE_LLM_SINGLE_FLIGHT:
+        st.caption("Consultas compartidas desactivadas (SAI_LLM_SINGLE_FLIGHT=0)")
+        return
+
+    flights = get_llm_flights()
+    with flights['lock']:
+        upstream_calls = flights['upstream_calls']
+        coalesced_calls = flights['coalesced_calls']
+        repeated_calls = flights['repeated_calls']
+
+    st.caption(
+        f"Llamadas al servicio: {upstream_calls} | Compartidas con una idéntica en curso: {coalesced_calls} | "
+        f"Repetidas tras un error propio: {repeated_calls}"
+    )
+
+def wait_llm_flight(flight, cancel_event=None, on_chunk=None):
+    """
+    Espera el resultado de una consulta idéntica en curso, pasando a on_chunk sus fragmentos de texto a
+    medida que llegan
+
+    Returns:
+        tuple: (resultado de la consulta o None si se canceló la espera, cantidad de fragmentos recibidos)
+    """
+    forwarded_chunks = 0
+    while True:
+        with flight['condition']:
+            if len(flight['chunks']) == forwarded_chunks and not flight['done']:
+                flight['condition'].wait(LLM_FLIGHT_WAIT_SECONDS)
+            new_chunks = flight['chunks'][forwarded_chunks:]
+            done = flight['done']
+
+        forwarded_chunks += len(new_chunks)
+        if on_chunk is not None:
+            for text_chunk in new_chunks:
+                on_chunk(text_chunk)
+
+        if done:
+            return flight['result'], forwarded_chunks
+        if cancel_event is not None and cancel_event.is_set():
+            return None, forwarded_chunks
+
+def run_llm_single_flight(flight_key, template_id, llm_request, cancel_event=None, on_chunk=None):
+    """
+    Ejecuta llm_request una sola vez entre las llamadas simultáneas con la misma clave: la primera hace
+    la consulta al servicio y las demás esperan su resultado (recibiendo también sus fragmentos de texto).
+    Si la consulta compartida termina con un error propio de quien la hizo (ver is_caller_llm_error), las
+    que esperaban la repiten, también compartida entre ellas. La clave no incluye la API Key (igual que la
+    caché de respuestas): una respuesta correcta se comparte aunque la API Key de quien espera no sea
+    válida; solo los errores 401/403 de quien hizo la llamada no se comparten.
+
+    Args:
+        flight_key: Clave de la consulta (plantilla y hash de los datos, ver compute_llm_cache_key)
+        template_id: Id de la plantilla (para el log)
+        llm_request: Función que recibe on_chunk y hace la consulta (ver request_llm_template)
+        cancel_event: threading.Event opcional para dejar de esperar una consulta compartida
+        on_chunk: Función opcional que recibe cada fragmento de texto a medida que llega
+
+    Returns:
+        dict: Resultado de la consulta ('coalesced' indica si se recibió de otra llamada)
+    """
+    flights = get_llm_flights()
+
+    while True:
+        with flights['lock']:
+            flight = flights['flights'].get(flight_key)
+            is_leader = flight is None
+            if is_leader:
+                flight = {'condition': threading.Condition(), 'chunks': [], 'done': False, 'result': None}
+                flights['flights'][flight_key] = flight
+                flights['upstream_calls'] += 1
+            else:
+                flights['coalesced_calls'] += 1
+                coalesced_calls = flights['coalesced_calls']
+
+        if is_leader:
+            break
+
+        LLM_LOGGER.info(
+            "Consulta unida a una idéntica en curso (plantilla %s): %d consultas compartidas en total",
+            template_id, coalesced_calls
+        )
+        llm_result, forwarded_chunks = wait_llm_flight(flight, cancel_event, on_chunk)
+
+        if llm_result is None:
+            return {
+                'text': "Error al conectar con el LLM: consulta cancelada",
+                'cached': False,
+                'coalesced': True,
+                'seconds': 0.0,
+                'age_seconds': 0.0,
+                'first_chunk_seconds': None
+            }
+        if not is_caller_llm_error(llm_result['text']):
+            return dict(llm_result, coalesced=True)
+
+        # La consulta compartida falló por causas de quien la hizo: se repite (sin volver a enviar
+        # fragmentos si ya se recibieron algunos)
+        with flights['lock']:
+            flights['repeated_calls'] += 1
+        if forwarded_chunks:
+            on_chunk = None
+
+    def share_chunk(text_chunk):
+        with flight['condition']:
+            flight['chunks'].append(text_chunk)
+            flight['condition'].notify_all()
+        if on_chunk is not None:
+            on_chunk(text_chunk)
+
+    llm_result = None
+    try:
+        llm_result = llm_request(share_chunk)
+    finally:
+        with flights['lock']:
+            del flights['flights'][flight_key]
+        with flight['condition']:
+            flight['result'] = llm_result if llm_result is not None else {
+                'text': "Error al conectar con el LLM: consulta cancelada",
+                'cached': False,
+                'coalesced': False,
+                'seconds': 0.0,
+                'age_seconds': 0.0,
+                'first_chunk_seconds': None
+            }
+            flight['done'] = True
+            flight['condition'].notify_all()
+
+    return llm_result
+
+# ==========================================
+# FUNCIONES: CONSULTAS AL LLM EN SEGUNDO PLANO
+# ==========================================
+
+# OPTIMIZACIÓN: Las consultas al LLM se ejecutan en un pool de hilos compartido por el proceso; la sesión
+# no queda bloqueada esperando la respuesta y un rerun no descarta la consulta en curso
+LLM_WORKER_POOL_SIZE = int(os.environ.get('SAI_LLM_WORKERS', '8'))
+LLM_MAX_CONCURRENCY_PER_SERVER = int(os.environ.get('SAI_LLM_MAX_CONCURRENCY_PER_SERVER', '4'))
+LLM_JOB_POLL_SECONDS = 1.0
+LLM_JOB_FAST_PATH_SECONDS = 0.25
+LLM_STREAM_REFRESH_SECONDS = 0.1
+LLM_JOBS_KEY = 'llm_jobs'
+LLM_LATEST_JOBS_KEY = 'llm_latest_jobs'
+LLM_BATCHES_KEY = 'llm_batches'
+LLM_LATEST_BATCHES_KEY = 'llm_latest_batches'
+
+# Lotes de preguntas: consultas simultáneas por lote (sin superar el límite por servidor) y tamaño máximo
+LLM_BATCH_PARALLELISM = int(os.environ.get('SAI_LLM_BATCH_PARALLELISM', '4'))
+LLM_BATCH_MAX_QUESTIONS = int(os.environ.get('SAI_LLM_BATCH_MAX_QUESTIONS', '20'))
+LLM_JOB_PENDING_STATES = {'en_cola', 'en_curso'}
+LLM_JOB_STATUS_LABELS = {
+    'en_cola': "⏳ En cola",
+    'en_curso': "🔄 Generando respuesta",
+    'completado': "✅ Completada",
+    'cancelado': "🚫 Cancelada"
+}
+
+@st.cache_resource
+def get_llm_job_pool():
+    """
+    Pool de hilos acotado (LLM_WORKER_POOL_SIZE) compartido por todas las sesiones del proceso, junto con
+    un semáforo por servidor que limita las consultas simultáneas a LLM_MAX_CONCURRENCY_PER_SERVER
+    """
+    return {
+        'executor': ThreadPoolExecutor(max_workers=LLM_WORKER_POOL_SIZE, thread_name_prefix='sai-llm'),
+        'lock': threading.Lock(),
+        'server_slots': {}
+    }
+
+def get_server_slots(server_url):
+    """
+    Semáforo que limita las consultas simultáneas a un servidor
+    """
+    job_pool = get_llm_job_pool()
+    with job_pool['lock']:
+        if server_url not in job_pool['server_slots']:
+            job_pool['server_slots'][server_url] = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY_PER_SERVER)
+        return job_pool['server_slots'][server_url]
+
+@contextlib.contextmanager
+def llm_server_slot(cancel_event=None):
+    """
+    Ocupa un turno del servicio SAI mientras dura la consulta. Solo lo toman las llamadas que van al
+    servicio: las que esperan el resultado de una consulta idéntica en curso no ocupan turno.
+
+    Raises:
+        requests.RequestException: La consulta se canceló mientras esperaba turno
+    """
+    server_slots = get_server_slots(LLM_SERVICE_URL)
+    while not server_slots.acquire(timeout=0.2):
+        if cancel_event is not None and cancel_event.is_set():
+            raise requests.RequestException("consulta cancelada")
+
+    try:
+        yield
+    finally:
+        server_slots.release()
+
+def finish_llm_job(job, status, result=None):
+    """
+    Marca el fin de una consulta con su estado final y su resultado. Solo la primera llamada tiene
+    efecto: una consulta ya terminada (por ejemplo cancelada) conserva su estado final.
+    """
+    with job['lock']:
+        if not is_llm_job_pending(job):
+            return
+        job['result'] = result
+        job['finished_at'] = time.time()
+        job['status'] = status
+        # OPTIMIZACIÓN: El registro queda en session_state; se sueltan la llamada (con el texto enviado)
+        # y los fragmentos, que ya están en el resultado
+        job['llm_call'] = None
+        job['chunks'] = []
+
+def release_llm_job_future(job):
+    """
+    Callback de fin del future de una consulta: suelta la referencia al future una vez terminado
+    """
+    def on_done(finished_future):
+        job['future'] = None
+
+    return on_done
+
+def run_llm_job(job, llm_call):
+    """
+    Ejecuta una consulta en un hilo del pool (el turno en el servidor lo toma la llamada al servicio,
+    ver llm_server_slot) y guarda el resultado en el propio registro de la consulta. Los cambios de
+    estado se hacen bajo el lock de la consulta, así que una cancelación simultánea (cancel_llm_job)
+    nunca queda sobrescrita y la consulta siempre termina con un estado final.
+    """
+    cancel_event = job['cancel_event']
+    with job['lock']:
+        if cancel_event.is_set() or not is_llm_job_pending(job):
+            return
+        job['status'] = 'en_curso'
+        job['started_at'] = time.time()
+
+    llm_result = None
+    try:
+        llm_result = llm_call(cancel_event, job['chunks'].append)
+    except Exception as e:
+        llm_result = {
+            'text': f"Error al conectar con el LLM: {str(e)}",
+            'cached': False,
+            'coalesced': False,
+            'seconds': 0.0,
+            'age_seconds': 0.0,
+            'first_chunk_seconds': None
+        }
+    finally:
+        # Una consulta cancelada mientras estaba en curso (o interrumpida sin resultado) descarta su resultado
+        if cancel_event.is_set() or llm_result is None:
+            finish_llm_job(job, 'cancelado')
+        else:
+            finish_llm_job(job, 'completado', llm_result)
+
+def create_llm_job(kind, llm_call, details):
+    """
+    Crea el registro de una consulta (todavía sin enviar al pool) y lo guarda en session_state por su id
+
+    Args:
+        kind: Tipo de consulta (una por pestaña, por ejemplo 'resumen_ejecutivo')
+        llm_call: Función que recibe el cancel_event y la función on_chunk y devuelve el resultado de
+                  execute_llm_template
+        details: Datos de la consulta para mostrar junto al resultado (texto enviado, pregunta, etc.)
+
+    Returns:
+        dict: Registro de la consulta (id, estado, tiempos, resultado)
+    """
+    job = {
+        'id': uuid.uuid4().hex[:12],
+        'kind': kind,
+        'status': 'en_cola',
+        'submitted_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        'result': None,
+        'chunks': [],
+        'details': details,
+        'llm_call': llm_call,
+        'future': None,
+        'cancel_event': threading.Event(),
+        # Protege los cambios de estado entre el hilo del pool y la sesión (ver run_llm_job)
+        'lock': threading.Lock()
+    }
+    st.session_state.setdefault(LLM_JOBS_KEY, {})[job['id']] = job
+
+    return job
+
+def start_llm_job(job, on_done=None):
+    """
+    Envía una consulta al pool; on_done (opcional) se llama con el future al terminar
+    """
+    future = get_llm_job_pool()['executor'].submit(run_llm_job, job, job['llm_call'])
+    job['future'] = future
+    # Si el future ya terminó, los callbacks se ejecutan en el acto (después de guardarlo en el registro)
+    future.add_done_callback(release_llm_job_future(job))
+    if on_done is not None:
+        future.add_done_callback(on_done)
+
+def submit_llm_job(kind, llm_call, details):
+    """
+    Envía una consulta al pool y la marca como la última de su tipo (ver create_llm_job)
+    """
+    job = create_llm_job(kind, llm_call, details)
+    start_llm_job(job)
+    st.session_state.setdefault(LLM_LATEST_JOBS_KEY, {})[kind] = job['id']
+    prune_llm_jobs()
+
+    return job
+
+def submit_llm_batch(kind, calls, parallelism):
+    """
+    Envía un lote de consultas con a lo sumo parallelism en curso a la vez: al terminar cada una se
+    envía la siguiente del lote (sin ocupar hilos del pool esperando turno)
+
+    Args:
+        kind: Tipo de lote (por ejemplo 'preguntas')
+        calls: Lista de (llm_call, details), una por consulta (ver create_llm_job)
+        parallelism: Consultas simultáneas del lote
+
+    Returns:
+        dict: Registro del lote (id, ids de sus consultas, inicio)
+    """
+    jobs = [create_llm_job(kind, llm_call, details) for llm_call, details in calls]
+    batch = {
+        'id': uuid.uuid4().hex[:12],
+        'kind': kind,
+        'job_ids': [job['id'] for job in jobs],
+        'submitted_at': time.time(),
+        'parallelism': parallelism
+    }
+    queued_jobs = list(jobs)
+    queue_lock = threading.Lock()
+
+    def start_next_job(finished_future=None):
+        with queue_lock:
+            next_job = None
+            while queued_jobs and next_job is None:
+                candidate_job = queued_jobs.pop(0)
+                if not candidate_job['cancel_event'].is_set():
+                    next_job = candidate_job
+        if next_job is not None:
+            start_llm_job(next_job, start_next_job)
+
+    for _ in range(min(parallelism, len(jobs))):
+        start_next_job()
+
+    st.session_state.setdefault(LLM_BATCHES_KEY, {})[batch['id']] = batch
+    st.session_state.setdefault(LLM_LATEST_BATCHES_KEY, {})[kind] = batch['id']
+    prune_llm_jobs()
+
+    return batch
+
+def prune_llm_jobs():
+    """
+    Quita de session_state las consultas y lotes terminados que ya no son los últimos de su tipo (las
+    pestañas solo muestran los últimos), para que la sesión no acumule resultados anteriores. Los
+    pendientes se conservan hasta terminar y se quitan en el siguiente envío.
+    """
+    batches = st.session_state.get(LLM_BATCHES_KEY, {})
+    latest_batch_ids = set(st.session_state.get(LLM_LATEST_BATCHES_KEY, {}).values())
+    for batch_id in list(batches):
+        if batch_id not in latest_batch_ids and not is_llm_batch_pending(batches[batch_id]):
+            del batches[batch_id]
+
+    jobs = st.session_state.get(LLM_JOBS_KEY, {})
+    kept_job_ids = set(st.session_state.get(LLM_LATEST_JOBS_KEY, {}).values())
+    for batch in batches.values():
+        kept_job_ids.update(batch['job_ids'])
+    for job_id in list(jobs):
+        if job_id not in kept_job_ids and not is_llm_job_pending(jobs[job_id]):
+            del jobs[job_id]
+
+def get_latest_llm_batch(kind):
+    """
+    Último lote enviado de un tipo en esta sesión (None si no hay)
+    """
+    batch_id = st.session_state.get(LLM_LATEST_BATCHES_KEY, {}).get(kind)
+    if batch_id is None:
+        return None
+    return st.session_state.get(LLM_BATCHES_KEY, {}).get(batch_id)
+
+def get_llm_batch_jobs(batch):
+    """
+    Consultas de un lote, en el orden en que se enviaron
+    """
+    jobs = st.session_state.get(LLM_JOBS_KEY, {})
+    return [jobs[job_id] for job_id in batch['job_ids']]
+
+def is_llm_batch_pending(batch):
+    """
+    Indica si alguna consulta del lote sigue en cola o en curso
+    """
+    return batch is not None and any(is_llm_job_pending(job) for job in get_llm_batch_jobs(batch))
+
+def get_latest_llm_job(kind):
+    """
+    Última consulta enviada de un tipo en esta sesión (None si no hay)
+    """
+    job_id = st.session_state.get(LLM_LATEST_JOBS_KEY, {}).get(kind)
+    if job_id is None:
+        return None
+    return st.session_state.get(LLM_JOBS_KEY, {}).get(job_id)
+
+def is_llm_job_pending(job):
+    """
+    Indica si la consulta sigue en cola o en curso
+    """
+    return job is not None and job['status'] in LLM_JOB_PENDING_STATES
+
+def cancel_llm_job(job):
+    """
+    Cancela una consulta: si sigue en la cola del pool no llega a ejecutarse; si ya está en curso se
+    dejan de hacer reintentos y su resultado se descarta
+    """
+    job['cancel_event'].set()
+    future = job['future']
+    if future is not None:
+        future.cancel()
+    finish_llm_job(job, 'cancelado')
+
+@st.fragment(run_every=LLM_JOB_POLL_SECONDS)
+def show_llm_job_progress(job_id, show_fallback=None, fallback_seconds=0):
+    """
+    Estado en vivo de una consulta en curso (fragmento que se actualiza solo cada LLM_JOB_POLL_SECONDS).
+    Durante cada ejecución redibuja el texto recibido cada LLM_STREAM_REFRESH_SECONDS, solo si llegaron
+    fragmentos nuevos; el estado con el tiempo transcurrido se redibuja una vez por ciclo (o si cambia). Al
+    terminar vuelve a ejecutar la app para mostrar el resultado en su pestaña. Si pasan
+    fallback_seconds sin texto del LLM muestra el respaldo (show_fallback) hasta que empiece a llegar.
+    """
+    job = st.session_state.get(LLM_JOBS_KEY, {}).get(job_id)
+    if not is_llm_job_pending(job):
+        st.rerun()
+
+    if st.button("🚫 Cancelar consulta", key=f"cancel_llm_job_{job_id}"):
+        cancel_llm_job(job)
+        st.rerun()
+
+    status_placeholder = st.empty()
+    fallback_placeholder = st.empty()
+    text_placeholder = st.empty()
+    shown_chunks = 0
+    shown_status = None
+    fallback_shown = False
+
+    # Termina antes del siguiente ciclo de run_every; cualquier interacción del usuario la interrumpe
+    refresh_until = time.monotonic() + LLM_JOB_POLL_SECONDS - LLM_STREAM_REFRESH_SECONDS
+    while True:
+        elapsed_seconds = time.time() - job['submitted_at']
+        # OPTIMIZACIÓN: Cada redibujo es un mensaje al navegador; el tiempo transcurrido se actualiza
+        # una vez por ciclo de run_every, no en cada pasada
+        if job['status'] != shown_status:
+            shown_status = job['status']
+            status_placeholder.info(
+                f"{LLM_JOB_STATUS_LABELS[shown_status]} · {elapsed_seconds:.1f} s — puedes seguir usando el "
+                "dashboard; el resultado aparecerá aquí al terminar."
+            )
+
+        # Al terminar, la consulta suelta sus fragmentos (ver finish_llm_job): se leen de una sola lista
+        job_chunks = job['chunks']
+        received_chunks = len(job_chunks)
+        if received_chunks > shown_chunks:
+            shown_chunks = received_chunks
+            text_placeholder.markdown(''.join(job_chunks[:received_chunks]) + " ▌")
+
+        # El texto del LLM reemplaza al respaldo apenas empieza a llegar
+        show_fallback_now = show_fallback is not None and received_chunks == 0 and elapsed_seconds >= fallback_seconds
+        if show_fallback_now and not fallback_shown:
+            with fallback_placeholder.container():
+                show_fallback(job)
+        elif fallback_shown and not show_fallback_now:
+            fallback_placeholder.empty()
+        fallback_shown = show_fallback_now
+
+        if not is_llm_job_pending(job):
+            st.rerun()
+        if time.monotonic() >= refresh_until:
+            break
+        time.sleep(LLM_STREAM_REFRESH_SECONDS)
+
+def show_llm_job(job, show_result, show_fallback=None, fallback_seconds=0):
+    """
+    Muestra una consulta: su estado en vivo mientras está pendiente, o su resultado cuando terminó
+
+    Args:
+        job: Registro de la consulta (ver submit_llm_job)
+        show_result: Función que muestra el resultado de una consulta completada
+        show_fallback: Función opcional que muestra un respaldo mientras la consulta sigue pendiente
+        fallback_seconds: Segundos sin texto del LLM a partir de los cuales se muestra el respaldo
+    """
+    # Las respuestas inmediatas (por ejemplo desde la caché) se muestran en la misma ejecución
+    future = job['future']
+    if is_llm_job_pending(job) and future is not None:
+        wait_futures([future], timeout=LLM_JOB_FAST_PATH_SECONDS)
+
+    if is_llm_job_pending(job):
+        show_llm_job_progress(job['id'], show_fallback, fallback_seconds)
+    elif job['status'] == 'cancelado':
+        st.warning("🚫 La consulta fue cancelada.")
+    else:
+        show_result(job)
+
+@st.fragment(run_every=LLM_JOB_POLL_SECONDS)
+def show_llm_batch_progress(batch_id, show_answers):
+    """
+    Estado en vivo de un lote de consultas (fragmento que se actualiza solo cada LLM_JOB_POLL_SECONDS):
+    muestra cada respuesta apenas termina; al terminar el lote vuelve a ejecutar la app
+    """
+    batch = st.session_state.get(LLM_BATCHES_KEY, {}).get(batch_id)
+    if not is_llm_batch_pending(batch):
+        st.rerun()
+
+    if st.button("🚫 Cancelar lote", key=f"cancel_llm_batch_{batch_id}"):
+        for job in get_llm_batch_jobs(batch):
+            if is_llm_job_pending(job):
+                cancel_llm_job(job)
+        st.rerun()
+
+    show_answers(batch)
+
+def show_llm_batch(batch, show_answers):
+    """
+    Muestra un lote: su estado en vivo mientras tiene consultas pendientes, o todas sus respuestas
+
+    Args:
+        batch: Registro del lote (ver submit_llm_batch)
+        show_answers: Función que muestra las respuestas del lote (las pendientes con su estado)
+    """
+    # Las respuestas inmediatas (por ejemplo desde la caché) se muestran en la misma ejecución
+    job_futures = [job['future'] for job in get_llm_batch_jobs(batch)]
+    pending_futures = [future for future in job_futures if future is not None]
+    wait_futures(pending_futures, timeout=LLM_JOB_FAST_PATH_SECONDS)
+
+    if is_llm_batch_pending(batch):
+        show_llm_batch_progress(batch['id'], show_answers)
+    else:
+        show_answers(batch)
+
+def is_llm_job_for_selection(job, data_text):
+    """
+    Indica si una consulta se envió con el texto de datos de la selección actual (mismos filtros)
+    """
+    return job['details'].get('data') == data_text
+
+def show_llm_job_for_selection(job, data_text, show_result, show_fallback=None, fallback_seconds=0):
+    """
+    Muestra la última consulta de una pestaña (ver show_llm_job) solo si se hizo con la selección actual.
+    La consulta queda en session_state entre reruns: si los filtros cambiaron, su respuesta es de otros
+    datos y no se muestra como si fuera de la selección actual.
+
+    Args:
+        job: Registro de la consulta (ver submit_llm_job)
+        data_text: Texto para el LLM de la selección actual (ver generate_summary_text)
+        show_result, show_fallback, fallback_seconds: Ver show_llm_job
+    """
+    if is_llm_job_for_selection(job, data_text):
+        show_llm_job(job, show_result, show_fallback, fallback_seconds)
+    elif is_llm_job_pending(job):
+        st.warning(
+            "🔀 Hay una consulta en curso con otra selección de filtros; su respuesta no se mostrará para la "
+            "selección actual."
+        )
+        show_llm_job_progress(job['id'])
+    else:
+        st.info("🔀 La última respuesta corresponde a otra selección de filtros. Genera una nueva para ver la de la selección actual.")
+
+def show_llm_batch_for_selection(batch, data_text, show_answers):
+    """
+    Muestra el último lote de una pestaña (ver show_llm_batch) solo si se envió con la selección actual
+    (ver show_llm_job_for_selection)
+    """
+    if all(is_llm_job_for_selection(job, data_text) for job in get_llm_batch_jobs(batch)):
+        show_llm_batch(batch, show_answers)
+    elif is_llm_batch_pending(batch):
+        st.warning(
+            "🔀 Hay un lote en curso con otra selección de filtros; sus respuestas no se mostrarán para la "
+            "selección actual."
+        )
+        show_llm_batch_progress(batch['id'], show_answers)
+    else:
+        st.info("🔀 El último lote corresponde a otra selección de filtros. Envíalo de nuevo para ver las respuestas de la selección actual.")
+
+def show_llm_job_stats():
+    """
+    Muestra en la barra lateral las consultas al LLM de esta sesión y la ocupación del pool
+    """
+    jobs = st.session_state.get(LLM_JOBS_KEY, {})
+    if not jobs:
+        return
+
+    pending_jobs = sum(is_llm_job_pending(job) for job in jobs.values())
+    with st.sidebar.expander("🧵 Consultas IA en segundo plano"):
+        st.write(f"**Pendientes:** {pending_jobs} de {len(jobs)} consultas de esta sesión")
+        st.write(f"**Límite por servidor:** {LLM_MAX_CONCURRENCY_PER_SERVER} consultas simultáneas")
+        st.write(f"**Hilos del pool:** {LLM_WORKER_POOL_SIZE}")
+
 # ==========================================
-# FUNCIÓN OPTIMIZADA: PROCESAMIENTO DE ARCHIVOS DE ENTRADA (SIN INTERFAZ)
+# FUNCIONES: PRESUPUESTO DEL TEXTO PARA EL LLM (MAP-REDUCE POR BLOQUES)
 # ==========================================
 
-@st.cache_data
-def process_input_files():
+# OPTIMIZACIÓN: Con selecciones muy grandes el texto para el LLM crece con la cantidad de países y áreas,
+# y con él la latencia del servicio y el riesgo de error. Si supera el presupuesto se divide en bloques
+# por país o por área que se resumen en paralelo con la misma plantilla (map), y los resúmenes
+# parciales se combinan en una consulta final (reduce). SAI_LLM_PAYLOAD_BUDGET_CHARS=0 lo desactiva.
+LLM_PAYLOAD_BUDGET_CHARS = int(os.environ.get('SAI_LLM_PAYLOAD_BUDGET_CHARS', '12000'))
+# Margen del presupuesto para los títulos de cada bloque
+LLM_CHUNK_TITLE_CHARS = 300
+
+def build_country_lines(metrics_context):
     """
-    Procesa automáticamente dos archivos de entrada y los convierte en el formato requerido
-    para el dashboard de adopción SAI.
-    
-    Busca automáticamente los archivos en el directorio actual:
-    - areas_personas.xlsx: Datos de usuarios (debe contener columnas: NOMBRE, PAIS, CARGO, AREA)
-    - uso_por_mes.xlsx: Datos de uso mensual (debe contener NOMBRE y columnas de meses)
-    
+    Líneas de análisis por país del texto para el LLM, en orden alfabético como groupby
+
     Returns:
-        tuple: (df_original, df_melted, month_columns_sorted) o (None, None, None) si hay error
+        list: (país, línea)
     """
-    try:
-        # Archivos fijos predefinidos
-        current_dir = os.getcwd()
-        file_areas_personas = os.path.join(current_dir, 'areas_personas.xlsx')
-        file_uso_por_mes = os.path.join(current_dir, 'uso_por_mes.xlsx')
-        
-        # Verificar que ambos archivos existan
-        if not os.path.exists(file_areas_personas):
-            st.error(f"❌ No se encontró el archivo: areas_personas.xlsx")
-            return None, None, None
-            
-        if not os.path.exists(file_uso_por_mes):
-            st.error(f"❌ No se encontró el archivo: uso_por_mes.xlsx")
-            return None, None, None
-        
-        # Cargar archivos automáticamente
-        df_users = pd.read_excel(file_areas_personas)
-        
-        # Cargar archivo de uso y eliminar la segunda fila (índice 1)
-        df_usage = pd.read_excel(file_uso_por_mes)
-        df_usage = df_usage.drop('Total', axis=1)
-        if len(df_usage) > 1:
-            df_usage = df_usage.drop(df_usage.index[1]).reset_index(drop=True)
-        
-        # Validar columnas requeridas en archivo de usuarios
-        df_usage.rename(columns={'Custom Date': 'NOMBRE'}, inplace=True) 
-        required_user_columns = ['NOMBRE', 'PAIS', 'CARGO', 'AREA']
-        missing_user_cols = [col for col in required_user_columns if col not in df_users.columns]
-        
-        if missing_user_cols:
-            st.error(f"❌ Faltan columnas en areas_personas.xlsx: {missing_user_cols}")
-            st.info(f"📋 Columnas disponibles: {list(df_users.columns)}")
-            return None, None, None
-        
-        # Validar que archivo de uso tenga columna NOMBRE
-        if 'NOMBRE' not in df_usage.columns:
-            st.error(f"❌ Falta columna 'NOMBRE' en uso_por_mes.xlsx")
-            st.info(f"📋 Columnas disponibles: {list(df_usage.columns)}")
-            return None, None, None
-        
-        # OPTIMIZACIÓN: Normalizar nombres eliminando espacios extras y convirtiendo a mayúsculas
-        # Guardar nombres originales para mantenerlos en el resultado final
-        df_users['NOMBRE_ORIGINAL'] = df_users['NOMBRE']
-        df_usage['NOMBRE_ORIGINAL'] = df_usage['NOMBRE']
-        
-        # Función para normalizar nombres: elimina espacios múltiples y espacios al inicio/final
-        def normalize_name(name):
-            """Normaliza un nombre eliminando espacios extras y convirtiendo a mayúsculas"""
-            if pd.isna(name):
-                return ''
-            # Convertir a string, eliminar espacios al inicio/final y reemplazar múltiples espacios por uno solo
-            return ' '.join(str(name).strip().split()).upper()
-        
-        # Aplicar normalización a ambos dataframes
-        df_users['NOMBRE_NORMALIZADO'] = df_users['NOMBRE'].apply(normalize_name)
-        df_usage['NOMBRE_NORMALIZADO'] = df_usage['NOMBRE'].apply(normalize_name)
-        
-        # Identificar columnas de meses en archivo de uso
-        month_columns = [col for col in df_usage.columns if col not in ['NOMBRE', 'NOMBRE_ORIGINAL', 'NOMBRE_NORMALIZADO']]
-        
-        if not month_columns:
-            st.error(f"❌ No se encontraron columnas de meses en uso_por_mes.xlsx")
-            return None, None, None
-        
-        # Realizar merge usando nombres normalizados
-        df_merged = pd.merge(
-            df_users, 
-            df_usage, 
-            on='NOMBRE_NORMALIZADO', 
-            how='inner',
-            suffixes=('_users', '_usage')
+    country_adoption = metrics_context['country_statistics'].sort_values('valor', kind='stable')
+
+    return [
+        (country, f"- {country}: {total_users} usuarios, {adoption_percentage:.1f}% adopción")
+        for country, total_users, adoption_percentage in zip(
+            country_adoption['valor'].tolist(),
+            country_adoption['Total_Usuarios'].tolist(),
+            country_adoption['Porcentaje_Adopcion'].tolist()
         )
-        
-        if len(df_merged) == 0:
-            st.error("❌ No se encontraron coincidencias entre los archivos. Verifica que los nombres coincidan.")
-            # Mostrar algunos ejemplos de nombres para debugging
-            st.info("📋 Ejemplos de nombres en areas_personas.xlsx (normalizados):")
-            st.text(df_users['NOMBRE_NORMALIZADO'].head(10).tolist())
-            st.info("📋 Ejemplos de nombres en uso_por_mes.xlsx (normalizados):")
-            st.text(df_usage['NOMBRE_NORMALIZADO'].head(10).tolist())
-            return None, None, None
-        
-        # Usar el nombre original del archivo de usuarios como nombre principal
-        df_merged['NOMBRE'] = df_merged['NOMBRE_ORIGINAL_users']
-        
-        # Eliminar columnas auxiliares que ya no necesitamos
-        columns_to_drop = ['NOMBRE_NORMALIZADO', 'NOMBRE_ORIGINAL_users', 'NOMBRE_ORIGINAL_usage']
-        df_merged = df_merged.drop(columns=columns_to_drop, errors='ignore')
-        
-        # Limpiar valores nulos en las columnas básicas
-        df_merged['NOMBRE'] = df_merged['NOMBRE'].fillna('Sin Nombre')
-        df_merged['PAIS'] = df_merged['PAIS'].fillna('Sin País')
-        df_merged['CARGO'] = df_merged['CARGO'].fillna('Sin Cargo')
-        df_merged['AREA'] = df_merged['AREA'].fillna('Sin Área')
+    ]
 
-        # FILTRAR: Excluir área de "Operaciones"
-        df_merged = df_merged[df_merged['AREA'].str.lower() != 'operaciones']
+def build_summary_chunks(metrics_context, selected_months, selected_countries, selected_areas, filter_type, budget_chars):
+    """
+    Divide el texto para el LLM (ver build_summary_text) en bloques de hasta budget_chars caracteres,
+    repartiendo entre los bloques la parte más grande del texto: los países (lista y análisis por país)
+    o la lista de áreas. El resto del texto (filtros, métricas generales y estadísticas) va en todos
+    los bloques, así que los bloques reparten la misma información que el texto completo.
 
-        # Ordenar meses cronológicamente
-        month_columns_sorted = sort_months_chronologically(month_columns)
+    Returns:
+        dict: Dimensión de los bloques, textos de los bloques y encabezado de la consulta final
+    """
+    overview = metrics_context['overview']
+    dimension_counts = metrics_context['dimension_counts']
+    country_lines = build_country_lines(metrics_context)
+
+    # Segmentos repartibles: (valor, línea de análisis o None, caracteres que ocupa en el bloque)
+    country_segments = [(country, line, len(country) + len(line) + 3) for country, line in country_lines]
+    area_segments = [(area, None, len(area) + 2) for area in selected_areas]
+    if sum(segment[2] for segment in area_segments) > sum(segment[2] for segment in country_segments):
+        dimension, segments, dimension_label = 'AREA', area_segments, 'ÁREA'
+    else:
+        dimension, segments, dimension_label = 'PAIS', country_segments, 'PAÍS'
+
+    common_lines = [
+        "FILTROS APLICADOS:",
+        f"- Tipo de filtro temporal: {filter_type}",
+        f"- Meses seleccionados ({len(selected_months)}): {', '.join(selected_months)}"
+    ]
+    if dimension == 'PAIS':
+        common_lines += [
+            f"- Países seleccionados ({len(selected_countries)}): ver cada bloque",
+            f"- Áreas seleccionadas ({len(selected_areas)}): {', '.join(selected_areas)}"
+        ]
+    else:
+        common_lines += [
+            f"- Países seleccionados ({len(selected_countries)}): {', '.join(selected_countries)}",
+            f"- Áreas seleccionadas ({len(selected_areas)}): ver cada bloque"
+        ]
+    common_lines.append("")
+    common_lines += build_overview_lines(overview, selected_months)
+    if dimension == 'AREA':
+        common_lines += ["", "ANÁLISIS POR PAÍS:"]
+        common_lines.extend(line for _, line in country_lines)
+    common_lines += [
+        "",
+        "ESTADÍSTICAS ADICIONALES:",
+        f"- Total de registros analizados: {overview['records']}",
+        f"- Usuarios únicos: {overview['eligible_users']}",
+        f"- Países únicos: {dimension_counts['PAIS']}",
+        f"- Áreas únicas: {dimension_counts['AREA']}",
+        f"- Cargos únicos: {dimension_counts['CARGO']}",
+        f"- Meses analizados: {len(selected_months)}"
+    ]
+    common_text = "\n".join(common_lines)
+
+    # Repartir los segmentos en la menor cantidad de bloques que entra en el presupuesto, con bloques
+    # de tamaño parecido (el bloque más grande marca la latencia de la etapa). Si el texto común ocupa
+    # casi todo el presupuesto, los bloques lo superan antes que dividirse en un bloque por valor
+    segment_budget = max(budget_chars - len(common_text) - LLM_CHUNK_TITLE_CHARS, budget_chars // 4, 1)
+    total_segment_chars = sum(segment_chars for _, _, segment_chars in segments)
+    group_count = max(-(-total_segment_chars // segment_budget), 1)
+    group_target = total_segment_chars / group_count
+    groups = [[] for _ in range(group_count)]
+    accumulated_chars = 0
+    for value, line, segment_chars in segments:
+        groups[min(int(accumulated_chars / group_target), group_count - 1)].append((value, line))
+        accumulated_chars += segment_chars
+
+    chunks = []
+    for index, group in enumerate(groups, start=1):
+        lines = [
+            f"=== DASHBOARD DE ANÁLISIS SAI - BLOQUE {index} DE {group_count} POR {dimension_label} ===",
+            "",
+            common_text,
+            "",
+            f"{'PAÍSES' if dimension == 'PAIS' else 'ÁREAS'} DE ESTE BLOQUE ({len(group)}): {', '.join(value for value, _ in group)}"
+        ]
+        if dimension == 'PAIS':
+            lines += ["", "ANÁLISIS POR PAÍS:"]
+            lines.extend(line for _, line in group)
+        lines.append("")
+        chunks.append("\n".join(lines))
 
-        # Convertir datos a formato long para mejor análisis
-        basic_columns = ['NOMBRE', 'PAIS', 'CARGO', 'AREA']
-        df_melted = pd.melt(
-            df_merged,
-            id_vars=basic_columns,
-            value_vars=month_columns,
-            var_name='Mes',
-            value_name='usos_ia'
+    reduce_header = "\n".join([
+        "=== RESUMEN EJECUTIVO - DASHBOARD DE ANÁLISIS SAI ===",
+        "",
+        common_text,
+        "",
+        f"RESULTADOS PARCIALES POR {dimension_label} ({group_count} BLOQUES):"
+    ])
+
+    return {
+        'dimension': dimension,
+        'chunks': chunks,
+        'reduce_header': reduce_header
+    }
+
+def prepare_llm_payload(metrics_context, selected_months, selected_countries, selected_areas, filter_type):
+    """
+    Texto para el LLM de la selección (ver generate_summary_text) y, si supera LLM_PAYLOAD_BUDGET_CHARS,
+    sus bloques para map-reduce (memoizados por estado de filtros y presupuesto)
+
+    Returns:
+        dict: Texto completo ('data'), bloques ('chunks', None si entra en el presupuesto), dimensión de
+              los bloques y encabezado de la consulta final
+    """
+    data = generate_summary_text(metrics_context, selected_months, selected_countries, selected_areas, filter_type)
+    if LLM_PAYLOAD_BUDGET_CHARS <= 0 or len(data) <= LLM_PAYLOAD_BUDGET_CHARS:
+        return {'data': data, 'chunks': None, 'dimension': None, 'reduce_header': None}
+
+    summary_chunks = get_view_result(metrics_context, 'summary_chunks', dict)
+    chunk_state = (filter_type, tuple(selected_months), tuple(selected_countries), tuple(selected_areas), LLM_PAYLOAD_BUDGET_CHARS)
+    if chunk_state not in summary_chunks:
+        summary_chunks[chunk_state] = build_summary_chunks(
+            metrics_context, selected_months, selected_countries, selected_areas, filter_type, LLM_PAYLOAD_BUDGET_CHARS
         )
 
-        # Limpiar datos nulos en usos de IA
-        df_melted['usos_ia'] = pd.to_numeric(df_melted['usos_ia'], errors='coerce').fillna(0)
-        
-        return df_merged, df_melted, month_columns_sorted
-        
-    except Exception as e:
-        st.error(f"❌ Error al procesar los archivos: {str(e)}")
-        st.info("💡 Verifica que los archivos tengan el formato correcto y las columnas requeridas")
-        return None, None, None
+    # Un solo bloque no reduce el texto de ninguna consulta: se envía el texto completo como siempre
+    if len(summary_chunks[chunk_state]['chunks']) == 1:
+        return {'data': data, 'chunks': None, 'dimension': None, 'reduce_header': None}
+
+    return dict(summary_chunks[chunk_state], data=data)
+
+def build_llm_stage_metrics(stage, payload_texts, stage_results, stage_seconds):
+    """
+    Métricas de una etapa del map-reduce: consultas, tamaño del texto enviado, latencia y aciertos de caché
+    """
+    payload_bytes = [len(text.encode('utf-8')) for text in payload_texts]
+    stage_metrics = {
+        'stage': stage,
+        'calls': len(payload_texts),
+        'payload_bytes': sum(payload_bytes),
+        'max_payload_bytes': max(payload_bytes),
+        'seconds': stage_seconds,
+        'cached_calls': sum(llm_result['cached'] for llm_result in stage_results)
+    }
+    LLM_LOGGER.info(
+        "Etapa %s: %d consultas, %.1f KB (máx %.1f KB por consulta), %.2f s, %d desde caché",
+        stage, stage_metrics['calls'], stage_metrics['payload_bytes'] / 1024,
+        stage_metrics['max_payload_bytes'] / 1024, stage_seconds, stage_metrics['cached_calls']
+    )
+
+    return stage_metrics
+
+def execute_llm_map_reduce(template_id, payload, api_key, pregunta=None, use_cache=True, cancel_event=None, on_chunk=None):
+    """
+    Ejecuta la plantilla sobre cada bloque del texto en paralelo (map, hasta LLM_MAX_CONCURRENCY_PER_SERVER
+    consultas a la vez) y combina los resultados parciales en una consulta final (reduce). Cada consulta
+    pasa por la caché de respuestas y por las consultas compartidas.
+
+    Args:
+        template_id: Id de la plantilla del servicio (la misma para las dos etapas)
+        payload: Texto preparado con bloques (ver prepare_llm_payload)
+        api_key: Clave de API para el servicio
+        pregunta: Pregunta del usuario (None para el resumen ejecutivo)
+        use_cache: False para ignorar las respuestas cacheadas
+        cancel_event: threading.Event opcional para cancelar la consulta
+        on_chunk: Función opcional que recibe los fragmentos de texto de la consulta final
+
+    Returns:
+        dict: Resultado de la consulta final (ver execute_llm_template) con las métricas de cada etapa
+              en 'stages'
+    """
+    start_time = time.perf_counter()
+    extra_inputs = {} if pregunta is None else {"pregunta": pregunta}
+    chunks = payload['chunks']
+
+    with ThreadPoolExecutor(max_workers=min(len(chunks), LLM_MAX_CONCURRENCY_PER_SERVER), thread_name_prefix='sai-llm-map') as map_executor:
+        map_results = list(map_executor.map(
+            lambda chunk: execute_llm_template(template_id, {"data": chunk, **extra_inputs}, api_key, use_cache, cancel_event),
+            chunks
+        ))
+    map_seconds = time.perf_counter() - start_time
+    stages = [build_llm_stage_metrics('map', chunks, map_results, map_seconds)]
+
+    # Si falla un bloque no se hace la consulta final
+    for map_result in map_results:
+        if map_result['text'].startswith("Error"):
+            return dict(map_result, seconds=time.perf_counter() - start_time, stages=stages)
+
+    reduce_text = payload['reduce_header'] + "\n\n" + "\n\n".join(
+        f"--- BLOQUE {index} DE {len(chunks)} ---\n{map_result['text']}"
+        for index, map_result in enumerate(map_results, start=1)
+    )
+    reduce_start_time = time.perf_counter()
+    reduce_result = execute_llm_template(template_id, {"data": reduce_text, **extra_inputs}, api_key, use_cache, cancel_event, on_chunk)
+    stages.append(build_llm_stage_metrics('reduce', [reduce_text], [reduce_result], time.perf_counter() - reduce_start_time))
+
+    all_cached = reduce_result['cached'] and all(map_result['cached'] for map_result in map_results)
+    first_chunk_seconds = None
+    if reduce_result['first_chunk_seconds'] is not None:
+        first_chunk_seconds = reduce_start_time - start_time + reduce_result['first_chunk_seconds']
+
+    return {
+        'text': reduce_result['text'],
+        'cached': all_cached,
+        'coalesced': reduce_result['coalesced'],
+        # Desde la caché: duración de las consultas originales (el bloque más lento más la consulta final)
+        'seconds': max(map_result['seconds'] for map_result in map_results) + reduce_result['seconds']
+                   if all_cached else time.perf_counter() - start_time,
+        'age_seconds': max(map_result['age_seconds'] for map_result in map_results + [reduce_result]) if all_cached else 0.0,
+        'first_chunk_seconds': first_chunk_seconds,
+        'stages': stages
+    }
+
+def generate_llm_payload_response(payload, api_key, pregunta=None, use_cache=True, cancel_event=None, on_chunk=None):
+    """
+    Resumen ejecutivo (o respuesta a la pregunta) del texto preparado con prepare_llm_payload: en una sola
+    consulta si entra en el presupuesto, o por bloques con map-reduce si no
+
+    Returns:
+        dict: Resultado de la consulta (ver execute_llm_template y execute_llm_map_reduce)
+    """
+    if payload['chunks'] is None:
+        if pregunta is None:
+            return generate_llm_summary(payload['data'], api_key, use_cache, cancel_event, on_chunk)
+        return generate_llm_question_response(payload['data'], pregunta, api_key, use_cache, cancel_event, on_chunk)
+
+    template_id = LLM_SUMMARY_TEMPLATE_ID if pregunta is None else LLM_QUESTION_TEMPLATE_ID
+    return execute_llm_map_reduce(template_id, payload, api_key, pregunta, use_cache, cancel_event, on_chunk)
+
+# ==========================================
+# FUNCIONES: RESUMEN EJECUTIVO LOCAL (RESPALDO SIN LLM)
+# ==========================================
+
+# OPTIMIZACIÓN: Si el servicio tarda más que este plazo en empezar a responder (o falla), la pestaña
+# muestra al instante un resumen ejecutivo armado con reglas a partir de los mismos agregados del texto
+# para el LLM; la respuesta del LLM lo reemplaza si llega después. SAI_LLM_SUMMARY_DEADLINE=0 lo desactiva.
+LLM_SUMMARY_DEADLINE_SECONDS = float(os.environ.get('SAI_LLM_SUMMARY_DEADLINE', '10'))
+# Países y áreas que se nombran en cada extremo del ranking
+LOCAL_SUMMARY_TOP_N = 3
+# Pendiente (puntos de % de adopción por mes) por debajo de la cual la tendencia se considera estable
+LOCAL_SUMMARY_STABLE_SLOPE = 0.5
+
+def build_local_ranking_lines(statistics):
+    """
+    Líneas con los valores (países o áreas) de mayor y menor % de adopción; a igual %, primero los de
+    más usuarios
+    """
+    ranked = statistics.sort_values(['Porcentaje_Adopcion', 'Total_Usuarios'], ascending=[False, False], kind='stable')
+    rows = list(zip(
+        ranked['valor'].tolist(),
+        ranked['Porcentaje_Adopcion'].tolist(),
+        ranked['Usuarios_Activos'].tolist(),
+        ranked['Total_Usuarios'].tolist()
+    ))
+    describe = lambda row: f"{row[0]} ({row[1]:.1f}%, {row[2]} de {row[3]} usuarios)"
+
+    if len(rows) <= 2 * LOCAL_SUMMARY_TOP_N:
+        return [f"- Ranking de adopción: {', '.join(describe(row) for row in rows)}."]
+
+    return [
+        f"- Mayor adopción: {', '.join(describe(row) for row in rows[:LOCAL_SUMMARY_TOP_N])}.",
+        f"- Menor adopción: {', '.join(describe(row) for row in rows[:-LOCAL_SUMMARY_TOP_N - 1:-1])}."
+    ]
+
+def build_local_executive_summary(metrics_context, selected_months, selected_countries, selected_areas, filter_type):
+    """
+    Arma con reglas un resumen ejecutivo en Markdown desde los agregados del contexto de métricas:
+    panorama general, tendencia (la misma recta de create_adoption_trend), variaciones mes a mes y
+    países y áreas con mayor y menor adopción
+    """
+    overview = metrics_context['overview']
+    monthly_adoption = metrics_context['monthly_adoption']
+    months = monthly_adoption['series']['Mes'].tolist()
+    adoption = monthly_adoption['series']['Porcentaje_Adopcion'].to_numpy(dtype=float)
+
+    lines = [
+        f"**Panorama general** ({filter_type}: {len(selected_months)} meses, {len(selected_countries)} países, "
+        f"{len(selected_areas)} áreas)",
+        f"- {overview['eligible_users']} profesionales elegibles; {overview['active_users']} usaron SAI al menos "
+        f"una vez ({overview['cumulative_adoption_rate']:.1f}% de adopción acumulada).",
+        f"- Adopción mensual promedio: {overview['average_adoption_rate']:.1f}%.",
+        "",
+        "**Tendencia**"
+    ]
+
+    if monthly_adoption['trend'] is None:
+        lines.append(f"- Un solo mes seleccionado ({months[0]}: {adoption[0]:.1f}% de adopción), sin tendencia.")
+    else:
+        slope = monthly_adoption['trend'][0]
+        if abs(slope) < LOCAL_SUMMARY_STABLE_SLOPE:
+            direction = "estable"
+        else:
+            direction = "al alza" if slope > 0 else "a la baja"
+        lines.append(
+            f"- La adopción mensual está {direction}: {slope:+.1f} puntos por mes "
+            f"(de {adoption[0]:.1f}% en {months[0]} a {adoption[-1]:.1f}% en {months[-1]})."
+        )
+
+        # Variaciones mes a mes en orden cronológico
+        deltas = np.diff(adoption)
+        lines.append(f"- Último cambio mes a mes ({months[-2]} → {months[-1]}): {deltas[-1]:+.1f} puntos.")
+        if len(deltas) > 1:
+            rise = int(np.argmax(deltas))
+            drop = int(np.argmin(deltas))
+            if deltas[rise] > 0:
+                lines.append(f"- Mayor alza: {months[rise]} → {months[rise + 1]} ({deltas[rise]:+.1f} puntos).")
+            if deltas[drop] < 0:
+                lines.append(f"- Mayor caída: {months[drop]} → {months[drop + 1]} ({deltas[drop]:+.1f} puntos).")
+
+    lines += ["", "**Países**"]
+    lines += build_local_ranking_lines(metrics_context['country_statistics'])
+    lines += ["", "**Áreas**"]
+    lines += build_local_ranking_lines(metrics_context['area_statistics'])
+
+    return "\n".join(lines)
+
+def generate_local_executive_summary(metrics_context, selected_months, selected_countries, selected_areas, filter_type):
+    """
+    Resumen ejecutivo local (sin LLM) de la selección, memoizado en la caché de resultados de la
+    selección por estado de filtros (como generate_summary_text)
+
+    Returns:
+        str: Resumen en Markdown (ver build_local_executive_summary)
+    """
+    local_summaries = get_view_result(metrics_context, 'local_summaries', dict)
+    filter_state = (filter_type, tuple(selected_months), tuple(selected_countries), tuple(selected_areas))
+
+    if filter_state not in local_summaries:
+        local_summaries[filter_state] = build_local_executive_summary(
+            metrics_context, selected_months, selected_countries, selected_areas, filter_type
+        )
+
+    return local_summaries[filter_state]
 
 # ==========================================
-# FUNCIONES EXISTENTES (SIN CAMBIOS)
+# FUNCIONES: LLAMADAS A PLANTILLAS DEL LLM
 # ==========================================
 
+# Plantillas del servicio SAI
+LLM_SUMMARY_TEMPLATE_ID = "6892acca9315b2d72e0e9ab4"
+LLM_QUESTION_TEMPLATE_ID = "68942f6f8c7cd1b38cbd12e6"
+# Usar un endpoint diferente para insights (asumiendo que existe)
+LLM_INSIGHTS_TEMPLATE_ID = "6892acca9315b2d72e0e9ab4"
+
+def execute_llm_template(template_id, inputs, api_key, use_cache=True, cancel_event=None, on_chunk=None):
+    """
+    Ejecuta una plantilla del servicio de LLM, reutilizando la respuesta cacheada si existe
+
+    Args:
+        template_id: Id de la plantilla del servicio
+        inputs: Variables de la plantilla ('data' y opcionalmente 'pregunta')
+        api_key: Clave de API para el servicio
+        use_cache: False para ignorar la caché (la respuesta nueva igual se guarda)
+        cancel_event: threading.Event opcional para cancelar la consulta (ver post_llm_template)
+        on_chunk: Función opcional que recibe cada fragmento de texto a medida que llega
+
+    Returns:
+        dict: Texto de la respuesta (o mensaje de error), si vino de la caché o de una consulta idéntica
+              en curso, duración de la llamada original en segundos, antigüedad de la respuesta
+              cacheada y segundos hasta el primer fragmento de texto (None si no hubo)
+    """
+    cache_key = compute_llm_cache_key(template_id, inputs['data'], inputs.get('pregunta'))
+    if USE_LLM_RESPONSE_CACHE:
+        if use_cache:
+            entry = read_llm_cache_entry(cache_key)
+            if entry is not None:
+                record_llm_cache_lookup(template_id, True, entry['seconds'])
+                return {
+                    'text': entry['response'],
+                    'cached': True,
+                    'coalesced': False,
+                    'seconds': entry['seconds'],
+                    'age_seconds': time.time() - entry['created_at'],
+                    'first_chunk_seconds': None
+                }
+            record_llm_cache_lookup(template_id, False)
+
+    if not USE_LLM_SINGLE_FLIGHT:
+        return request_llm_template(template_id, inputs, api_key, cache_key, cancel_event, on_chunk)
+
+    return run_llm_single_flight(
+        cache_key,
+        template_id,
+        lambda flight_on_chunk: request_llm_template(template_id, inputs, api_key, cache_key, cancel_event, flight_on_chunk),
+        cancel_event,
+        on_chunk
+    )
+
+def request_llm_template(template_id, inputs, api_key, cache_key, cancel_event=None, on_chunk=None):
+    """
+    Hace la consulta al servicio (con un turno del servidor, ver llm_server_slot) y guarda la respuesta
+    correcta en la caché
+
+    Args:
+        template_id: Id de la plantilla del servicio
+        inputs: Variables de la plantilla
+        api_key: Clave de API para el servicio
+        cache_key: Clave de la respuesta en la caché
+        cancel_event: threading.Event opcional para cancelar la consulta
+        on_chunk: Función opcional que recibe cada fragmento de texto a medida que llega
+
+    Returns:
+        dict: Resultado de la consulta (ver execute_llm_template)
+    """
+    start_time = time.perf_counter()
+    first_chunk_seconds = None
+    try:
+        with llm_server_slot(cancel_event):
+            # Un único plazo para el POST (reintentos incluidos) y la lectura del stream, contado desde que
+            # se obtiene el turno: la espera por el turno no lo consume
+            deadline = time.monotonic() + LLM_CALL_DEADLINE_SECONDS
+            response = post_llm_template(
+                template_id, inputs, api_key, LLM_CALL_DEADLINE_SECONDS, cancel_event, USE_LLM_STREAMING, deadline
+            )
+
+            with response:
+                if response.status_code != 200:
+                    response_text = f"Error en la API: Código de estado {response.status_code}"
+                elif USE_LLM_STREAMING:
+                    # El texto se arma una sola vez al final; on_chunk recibe cada fragmento al llegar
+                    text_chunks = []
+                    for text_chunk in iter_llm_response_chunks(response, cancel_event, deadline, LLM_CALL_DEADLINE_SECONDS):
+                        if first_chunk_seconds is None:
+                            first_chunk_seconds = time.perf_counter() - start_time
+                        text_chunks.append(text_chunk)
+                        if on_chunk is not None:
+                            on_chunk(text_chunk)
+                    response_text = ''.join(text_chunks)
+                else:
+                    response_text = response.text
+
+    except Exception as e:
+        response_text = f"Error al conectar con el LLM: {str(e)}"
+
+    elapsed_seconds = time.perf_counter() - start_time
+
+    # Solo se cachean las respuestas correctas
+    if USE_LLM_RESPONSE_CACHE and not response_text.startswith("Error"):
+        write_llm_cache_entry(cache_key, {
+            'template_id': template_id,
+            'created_at': time.time(),
+            'seconds': elapsed_seconds,
+            'response': response_text
+        })
+
+    if first_chunk_seconds is not None:
+        LLM_LOGGER.info(
+            "Plantilla %s: primer fragmento en %.2f s, respuesta completa en %.2f s",
+            template_id, first_chunk_seconds, elapsed_seconds
+        )
+
+    return {
+        'text': response_text,
+        'cached': False,
+        'coalesced': False,
+        'seconds': elapsed_seconds,
+        'age_seconds': 0.0,
+        'first_chunk_seconds': first_chunk_seconds
+    }
+
 # FUNCIÓN: Llamada al LLM para generar resumen ejecutivo
-def generate_llm_summary(data_text, api_key):
+def generate_llm_summary(data_text, api_key, use_cache=True, cancel_event=None, on_chunk=None):
     """
     Genera un resumen ejecutivo usando el LLM a través de la API proporcionada
     
     Args:
         data_text: Texto plano con toda la información visible
         api_key: Clave de API para el servicio
+        use_cache: False para ignorar la respuesta cacheada
+        cancel_event: threading.Event opcional para cancelar la consulta
+        on_chunk: Función opcional que recibe cada fragmento de texto a medida que llega
     
     Returns:
-        str: Resumen generado por el LLM o mensaje de error
+        dict: Resumen generado por el LLM o mensaje de error (ver execute_llm_template)
     """
-    try:
-        url = "https://sai-library.saiapplications.com"
-        headers = {"X-Api-Key": api_key}
-        data = {
-            "inputs": {
-                "data": data_text,
-            }
-        }
-        
-        response = requests.post(f"{url}/api/templates/6892acca9315b2d72e0e9ab4/execute", json=data, headers=headers)
-        
-        if response.status_code == 200:
-            return response.text
-        else:
-            return f"Error en la API: Código de estado {response.status_code}"
-            
-    except Exception as e:
-        return f"Error al conectar con el LLM: {str(e)}"
+    return execute_llm_template(LLM_SUMMARY_TEMPLATE_ID, {"data": data_text}, api_key, use_cache, cancel_event, on_chunk)
 
 # FUNCIÓN NUEVA: Llamada al LLM para responder preguntas específicas del usuario
-def generate_llm_question_response(data_text, pregunta, api_key):
+def generate_llm_question_response(data_text, pregunta, api_key, use_cache=True, cancel_event=None, on_chunk=None):
     """
     Genera respuesta a pregunta específica del usuario usando el LLM a través de la API proporcionada
     
@@ -202,69 +3481,122 @@ def generate_llm_question_response(data_text, pregunta, api_key):
         data_text: Texto plano con toda la información visible (variable 'data')
         pregunta: Pregunta específica del usuario (variable 'pregunta')
         api_key: Clave de API para el servicio
+        use_cache: False para ignorar la respuesta cacheada
+        cancel_event: threading.Event opcional para cancelar la consulta
+        on_chunk: Función opcional que recibe cada fragmento de texto a medida que llega
     
     Returns:
-        str: Respuesta generada por el LLM o mensaje de error
+        dict: Respuesta generada por el LLM o mensaje de error (ver execute_llm_template)
     """
-    try:
-        url = "https://sai-library.saiapplications.com"
-        headers = {"X-Api-Key": api_key}
-        data = {
-            "inputs": {
-                "data": data_text,
-                "pregunta": pregunta
-            }
-        }
-        
-        response = requests.post(f"{url}/api/templates/68942f6f8c7cd1b38cbd12e6/execute", json=data, headers=headers)
-        
-        if response.status_code == 200:
-            return response.text
-        else:
-            return f"Error en la API: Código de estado {response.status_code}"
-            
-    except Exception as e:
-        return f"Error al conectar con el LLM: {str(e)}"
+    return execute_llm_template(LLM_QUESTION_TEMPLATE_ID, {"data": data_text, "pregunta": pregunta}, api_key, use_cache, cancel_event, on_chunk)
 
 # FUNCIÓN: Llamada al LLM para generar insights del dashboard
-def generate_llm_insights(data_text, api_key):
+def generate_llm_insights(data_text, api_key, use_cache=True, cancel_event=None, on_chunk=None):
     """
     Genera insights del dashboard usando el LLM a través de la API proporcionada
     
     Args:
         data_text: Texto plano con toda la información visible
         api_key: Clave de API para el servicio
+        use_cache: False para ignorar la respuesta cacheada
+        cancel_event: threading.Event opcional para cancelar la consulta
+        on_chunk: Función opcional que recibe cada fragmento de texto a medida que llega
     
     Returns:
-        str: Insights generados por el LLM o mensaje de error
+        dict: Insights generados por el LLM o mensaje de error (ver execute_llm_template)
     """
-    try:
-        url = "https://sai-library.saiapplications.com"
-        headers = {"X-Api-Key": api_key}
-        data = {
-            "inputs": {
-                "data": data_text,
-            }
-        }
-        
-        # Usar un endpoint diferente para insights (asumiendo que existe)
-        response = requests.post(f"{url}/api/templates/6892acca9315b2d72e0e9ab4/execute", json=data, headers=headers)
-        
-        if response.status_code == 200:
-            return response.text
-        else:
-            return f"Error en la API: Código de estado {response.status_code}"
-            
-    except Exception as e:
-        return f"Error al conectar con el LLM: {str(e)}"
+    return execute_llm_template(LLM_INSIGHTS_TEMPLATE_ID, {"data": data_text}, api_key, use_cache, cancel_event, on_chunk)
+
+# ==========================================
+# FUNCIONES: TEXTO PARA EL LLM, FILTROS Y GRÁFICOS DEL DASHBOARD
+# ==========================================
+
+# FUNCIÓN: Generar texto plano con toda la información visible
+def build_overview_lines(overview, selected_months):
+    """
+    Líneas de métricas principales y de adopción por mes (en el orden de la selección) del texto para el LLM
+    """
+    monthly_total = np.array([overview['monthly_total'].get(month, 0) for month in selected_months], dtype=np.int64)
+    monthly_active = np.array([overview['monthly_active'].get(month, 0) for month in selected_months], dtype=np.int64)
+    monthly_adoption = np.divide(
+        monthly_active * 100, monthly_total,
+        out=np.zeros(len(selected_months)), where=monthly_total > 0
+    )
+
+    lines = [
+        "MÉTRICAS PRINCIPALES:",
+        f"- Total Profesionales Elegibles: {overview['eligible_users']}",
+        f"- Total Usuarios Activos: {overview['active_users']}",
+        f"- % Acumulado Adopción SAI: {overview['cumulative_adoption_rate']:.1f}%",
+        f"- % Promedio Adopción SAI: {overview['average_adoption_rate']:.1f}%",
+        "",
+        "ANÁLISIS DE ADOPCIÓN POR MES:"
+    ]
+    lines.extend(
+        f"- {month}: {total_users} usuarios totales, {users_with_usage} activos, "
+        f"{total_users - users_with_usage} inactivos, {adoption_percentage:.1f}% adopción"
+        for month, total_users, users_with_usage, adoption_percentage
+        in zip(selected_months, monthly_total.tolist(), monthly_active.tolist(), monthly_adoption.tolist())
+    )
+
+    return lines
+
+def build_summary_text(metrics_context, selected_months, selected_countries, selected_areas, filter_type):
+    """
+    OPTIMIZACIÓN: Arma el texto para el LLM a partir de los agregados del contexto de métricas: cada
+    sección se genera desde los arreglos de los agregados (sin iterrows ni filtros por país o mes) y el
+    texto se une una sola vez al final
+    """
+    overview = metrics_context['overview']
+    dimension_counts = metrics_context['dimension_counts']
 
-# FUNCIÓN: Generar texto plano con toda la información visible
-def generate_summary_text(filtered_data, selected_months, selected_countries, selected_areas, filter_type):
+    # Países en orden alfabético, como groupby
+    country_adoption = metrics_context['country_statistics'].sort_values('valor', kind='stable')
+
+    lines = [
+        "=== RESUMEN EJECUTIVO - DASHBOARD DE ANÁLISIS SAI ===",
+        "",
+        "FILTROS APLICADOS:",
+        f"- Tipo de filtro temporal: {filter_type}",
+        f"- Meses seleccionados ({len(selected_months)}): {', '.join(selected_months)}",
+        f"- Países seleccionados ({len(selected_countries)}): {', '.join(selected_countries)}",
+        f"- Áreas seleccionadas ({len(selected_areas)}): {', '.join(selected_areas)}",
+        ""
+    ]
+    lines += build_overview_lines(overview, selected_months)
+    lines += ["", "ANÁLISIS POR PAÍS:"]
+    lines.extend(
+        f"- {country}: {total_users} usuarios, {adoption_percentage:.1f}% adopción"
+        for country, total_users, adoption_percentage in zip(
+            country_adoption['valor'].tolist(),
+            country_adoption['Total_Usuarios'].tolist(),
+            country_adoption['Porcentaje_Adopcion'].tolist()
+        )
+    )
+    lines += [
+        "",
+        "ESTADÍSTICAS ADICIONALES:",
+        f"- Total de registros analizados: {overview['records']}",
+        f"- Usuarios únicos: {overview['eligible_users']}",
+        f"- Países únicos: {dimension_counts['PAIS']}",
+        f"- Áreas únicas: {dimension_counts['AREA']}",
+        f"- Cargos únicos: {dimension_counts['CARGO']}",
+        f"- Meses analizados: {len(selected_months)}",
+        ""
+    ]
+
+    return "\n".join(lines)
+
+def generate_summary_text(metrics_context, selected_months, selected_countries, selected_areas, filter_type):
     """
     Genera un texto plano con toda la información visible basada en los filtros seleccionados
+
+    OPTIMIZACIÓN: El texto se memoiza en la caché de resultados de la selección, por estado de filtros
+    (el orden de los meses, países y áreas y el tipo de filtro aparecen en el texto), así que volver a
+    pedir un resumen o un insight sobre la misma selección no vuelve a armarlo
     
     Args:
-        filtered_data: DataFrame con datos filtrados
+        metrics_context: Contexto de métricas de la selección (ver build_metrics_context)
         selected_months: Lista de meses seleccionados
         selected_countries: Lista de países seleccionados
         selected_areas: Lista de áreas seleccionadas
@@ -273,95 +3605,15 @@ def generate_summary_text(filtered_data, selected_months, selected_countries, se
     Returns:
         str: Texto plano con toda la información para el LLM
     """
-    
-    # Encabezado del resumen
-    summary_text = "=== RESUMEN EJECUTIVO - DASHBOARD DE ANÁLISIS SAI ===\n\n"
-    
-    # Información de filtros aplicados
-    summary_text += "FILTROS APLICADOS:\n"
-    summary_text += f"- Tipo de filtro temporal: {filter_type}\n"
-    summary_text += f"- Meses seleccionados ({len(selected_months)}): {', '.join(selected_months)}\n"
-    summary_text += f"- Países seleccionados ({len(selected_countries)}): {', '.join(selected_countries)}\n"
-    summary_text += f"- Áreas seleccionadas ({len(selected_areas)}): {', '.join(selected_areas)}\n\n"
-    
-    # Métricas principales
-    summary_text += "MÉTRICAS PRINCIPALES:\n"
-    
-    # Total Profesionales Elegibles
-    total_eligible_professionals = filtered_data['NOMBRE'].nunique()
-    summary_text += f"- Total Profesionales Elegibles: {total_eligible_professionals}\n"
-    
-    # Total de Usuarios Activos
-    active_users = filtered_data[filtered_data['usos_ia'] > 0]['NOMBRE'].nunique()
-    summary_text += f"- Total Usuarios Activos: {active_users}\n"
-    
-    # % Acumulado Adopción SAI
-    users_with_usage = filtered_data[filtered_data['usos_ia'] > 0]['NOMBRE'].nunique()
-    total_unique_users = filtered_data['NOMBRE'].nunique()
-    if total_unique_users > 0:
-        cumulative_adoption_rate = (users_with_usage / total_unique_users) * 100
-    else:
-        cumulative_adoption_rate = 0
-    summary_text += f"- % Acumulado Adopción SAI: {cumulative_adoption_rate:.1f}%\n"
-    
-    # % Promedio Adopción SAI
-    monthly_adoption_rates = []
-    for month in selected_months:
-        month_data = filtered_data[filtered_data['Mes'] == month]
-        total_users_month = month_data['NOMBRE'].nunique()
-        active_users_month = month_data[month_data['usos_ia'] > 0]['NOMBRE'].nunique()
-        if total_users_month > 0:
-            monthly_rate = (active_users_month / total_users_month) * 100
-            monthly_adoption_rates.append(monthly_rate)
-    
-    if monthly_adoption_rates:
-        average_adoption_rate = sum(monthly_adoption_rates) / len(monthly_adoption_rates)
-    else:
-        average_adoption_rate = 0
-    summary_text += f"- % Promedio Adopción SAI: {average_adoption_rate:.1f}%\n\n"
-    
-    # Análisis de adopción por mes
-    summary_text += "ANÁLISIS DE ADOPCIÓN POR MES:\n"
-    for month in selected_months:
-        month_data = filtered_data[filtered_data['Mes'] == month]
-        total_users = month_data['NOMBRE'].nunique()
-        users_with_usage = month_data[month_data['usos_ia'] > 0]['NOMBRE'].nunique()
-        users_without_usage = total_users - users_with_usage
-        adoption_percentage = (users_with_usage / total_users) * 100 if total_users > 0 else 0
-        
-        summary_text += f"- {month}: {total_users} usuarios totales, {users_with_usage} activos, {users_without_usage} inactivos, {adoption_percentage:.1f}% adopción\n"
-    
-    summary_text += "\n"
-    
-    # Análisis por país
-    summary_text += "ANÁLISIS POR PAÍS:\n"
-    country_data = filtered_data.groupby('PAIS').agg({
-        'NOMBRE': 'nunique'
-    }).reset_index()
-    
-    for _, row in country_data.iterrows():
-        country = row['PAIS']
-        users = row['NOMBRE']
-        
-        # Calcular adopción por país
-        country_filtered = filtered_data[filtered_data['PAIS'] == country]
-        active_users_country = country_filtered[country_filtered['usos_ia'] > 0]['NOMBRE'].nunique()
-        adoption_rate = (active_users_country / users) * 100 if users > 0 else 0
-        
-        summary_text += f"- {country}: {users} usuarios, {adoption_rate:.1f}% adopción\n"
-    
-    summary_text += "\n"
-    
-    # Estadísticas adicionales
-    summary_text += "ESTADÍSTICAS ADICIONALES:\n"
-    summary_text += f"- Total de registros analizados: {len(filtered_data)}\n"
-    summary_text += f"- Usuarios únicos: {filtered_data['NOMBRE'].nunique()}\n"
-    summary_text += f"- Países únicos: {filtered_data['PAIS'].nunique()}\n"
-    summary_text += f"- Áreas únicas: {filtered_data['AREA'].nunique()}\n"
-    summary_text += f"- Cargos únicos: {filtered_data['CARGO'].nunique()}\n"
-    summary_text += f"- Meses analizados: {len(selected_months)}\n"
-    
-    return summary_text
+    summary_texts = get_view_result(metrics_context, 'summary_texts', dict)
+    filter_state = (filter_type, tuple(selected_months), tuple(selected_countries), tuple(selected_areas))
+
+    if filter_state not in summary_texts:
+        summary_texts[filter_state] = build_summary_text(
+            metrics_context, selected_months, selected_countries, selected_areas, filter_type
+        )
+
+    return summary_texts[filter_state]
 
 # FUNCIÓN: Validar condiciones para mostrar gráficos
 def validate_chart_conditions(selected_months, selected_countries, selected_areas):
@@ -683,7 +3935,8 @@ def create_multiple_filters(df_melted):
     
     # Filtro múltiple por países
     st.sidebar.write("🌍 **Seleccionar Países:**")
-    countries = sorted([str(x) for x in df_melted['PAIS'].dropna().unique()])
+    # OPTIMIZACIÓN: Valores desde las categorías (ver compact_melted_dtypes), sin recorrer las filas
+    countries = sorted([str(x) for x in df_melted['PAIS'].cat.categories])
     
     # Checkbox para seleccionar todos los países
     select_all_countries = st.sidebar.checkbox("Seleccionar todos los países", value=True)
@@ -700,7 +3953,7 @@ def create_multiple_filters(df_melted):
     
     # MODIFICADO: Filtrar áreas para excluir "Operaciones"
     st.sidebar.write("🏢 **Seleccionar Áreas:**")
-    all_areas = sorted([str(x) for x in df_melted['AREA'].dropna().unique()])
+    all_areas = sorted([str(x) for x in df_melted['AREA'].cat.categories])
     # Excluir "Operaciones" de las áreas disponibles
     areas = [area for area in all_areas if area.lower() != 'operaciones']
     
@@ -724,84 +3977,44 @@ def create_multiple_filters(df_melted):
     return selected_countries, selected_areas
 
 # FUNCIÓN: Crear métricas principales en 2 filas con métricas de adopción
-def create_metrics(df_melted, filtered_data, selected_months):
+def create_metrics(metrics_context):
     """
     Calcula y muestra métricas principales del dashboard organizadas en 2 filas de 2 columnas cada una
     Solo incluye métricas relacionadas con adopción
+
+    OPTIMIZACIÓN: Las métricas se leen del contexto de métricas (ver compute_adoption_overview)
     """
+    overview = metrics_context['overview']
+
     # PRIMERA FILA - 2 métricas principales
     col1, col2 = st.columns(2)
 
     with col1:
         # Total Profesionales Elegibles
-        total_eligible_professionals = filtered_data['NOMBRE'].nunique()
-        st.metric("👥 Total Profesionales Elegibles", total_eligible_professionals)
+        st.metric("👥 Total Profesionales Elegibles", overview['eligible_users'])
 
     with col2:
         # Total de Usuarios Activos (usuarios con al menos 1 uso de IA)
-        active_users = filtered_data[filtered_data['usos_ia'] > 0]['NOMBRE'].nunique()
-        st.metric("🚀 Total Usuarios Activos", active_users)
+        st.metric("🚀 Total Usuarios Activos", overview['active_users'])
 
     # SEGUNDA FILA - 2 métricas de adopción
     col3, col4 = st.columns(2)
 
     with col3:
         # % Acumulado Adopción SAI
-        users_with_usage = filtered_data[filtered_data['usos_ia'] > 0]['NOMBRE'].nunique()
-        total_unique_users = filtered_data['NOMBRE'].nunique()
-        
-        if total_unique_users > 0:
-            cumulative_adoption_rate = (users_with_usage / total_unique_users) * 100
-        else:
-            cumulative_adoption_rate = 0
-            
-        st.metric("🎯 % Acumulado Adopción SAI", f"{cumulative_adoption_rate:.1f}%")
+        st.metric("🎯 % Acumulado Adopción SAI", f"{overview['cumulative_adoption_rate']:.1f}%")
 
     with col4:
-        # % Promedio Adopción SAI
-        # Calcula el promedio de adopción por mes seleccionado
-        monthly_adoption_rates = []
-        
-        for month in selected_months:
-            month_data = filtered_data[filtered_data['Mes'] == month]
-            total_users_month = month_data['NOMBRE'].nunique()
-            active_users_month = month_data[month_data['usos_ia'] > 0]['NOMBRE'].nunique()
-            
-            if total_users_month > 0:
-                monthly_rate = (active_users_month / total_users_month) * 100
-                monthly_adoption_rates.append(monthly_rate)
-        
-        # Calcular promedio de adopción mensual
-        if monthly_adoption_rates:
-            average_adoption_rate = sum(monthly_adoption_rates) / len(monthly_adoption_rates)
-        else:
-            average_adoption_rate = 0
-            
-        st.metric("📊 % Promedio Adopción SAI", f"{average_adoption_rate:.1f}%")
+        # % Promedio Adopción SAI (promedio de la adopción de cada mes seleccionado)
+        st.metric("📊 % Promedio Adopción SAI", f"{overview['average_adoption_rate']:.1f}%")
 
 # FUNCIÓN: Gráfico de adopción SAI vs País con ejes fijos de 0 a 100%
-def create_adoption_by_country(filtered_data):
+def create_adoption_by_country(metrics_context):
     """
     Crea gráfico de % de adopción de SAI por país con ejes fijos de 0 a 100%
     """
-    # Calcular adopción por país
-    country_adoption = []
-    
-    for country in filtered_data['PAIS'].unique():
-        country_data = filtered_data[filtered_data['PAIS'] == country]
-        total_users = country_data['NOMBRE'].nunique()
-        active_users = country_data[country_data['usos_ia'] > 0]['NOMBRE'].nunique()
-        
-        adoption_rate = (active_users / total_users) * 100 if total_users > 0 else 0
-        
-        country_adoption.append({
-            'País': country,
-            'Total_Usuarios': total_users,
-            'Usuarios_Activos': active_users,
-            'Porcentaje_Adopcion': adoption_rate
-        })
-    
-    adoption_df = pd.DataFrame(country_adoption)
+    # Adopción por país (OPTIMIZACIÓN: desde el contexto de métricas)
+    adoption_df = metrics_context['country_statistics'].rename(columns={'valor': 'País'})
     adoption_df = adoption_df.sort_values('Porcentaje_Adopcion', ascending=False)
     
     # Crear gráfico de barras
@@ -833,35 +4046,15 @@ def create_adoption_by_country(filtered_data):
     return fig
 
 # FUNCIÓN: Mapa de calor de adopción SAI por País y Área - OPTIMIZADA CON COLORES ROJO-VERDE
-def create_adoption_heatmap(filtered_data):
+def create_adoption_heatmap(metrics_context):
     """
     Crea mapa de calor de % de adopción de SAI por País y Área
     OPTIMIZADO: Colores rojos para valores bajos y verdes para valores altos
     """
-    # Calcular adopción por país y área
-    adoption_data = []
+    # Adopción por país y área (OPTIMIZACIÓN: agregación por celda del cubo del contexto de métricas)
+    cell_adoption = metrics_context['cell_adoption']
     
-    for country in filtered_data['PAIS'].unique():
-        for area in filtered_data['AREA'].unique():
-            subset = filtered_data[
-                (filtered_data['PAIS'] == country) & 
-                (filtered_data['AREA'] == area)
-            ]
-            
-            if len(subset) > 0:
-                total_users = subset['NOMBRE'].nunique()
-                active_users = subset[subset['usos_ia'] > 0]['NOMBRE'].nunique()
-                adoption_rate = (active_users / total_users) * 100 if total_users > 0 else 0
-                
-                adoption_data.append({
-                    'País': country,
-                    'Área': area,
-                    'Porcentaje_Adopcion': adoption_rate,
-                    'Total_Usuarios': total_users,
-                    'Usuarios_Activos': active_users
-                })
-    
-    if not adoption_data:
+    if not cell_adoption['countries']:
         # Si no hay datos, crear gráfico vacío
         fig = go.Figure()
         fig.add_annotation(
@@ -873,10 +4066,12 @@ def create_adoption_heatmap(filtered_data):
         fig.update_layout(title='🔥 Mapa de Calor: % Adopción SAI por País y Área')
         return fig
     
-    adoption_df = pd.DataFrame(adoption_data)
-    
-    # Crear matriz pivot para el heatmap
-    heatmap_data = adoption_df.pivot(index='Área', columns='País', values='Porcentaje_Adopcion')
+    # Matriz área × país para el heatmap
+    heatmap_data = pd.DataFrame(
+        cell_adoption['adoption'],
+        index=pd.Index(cell_adoption['areas'], name='Área'),
+        columns=pd.Index(cell_adoption['countries'], name='País')
+    )
     
     # OPTIMIZACIÓN PRINCIPAL: Cambiar escala de colores a rojo-verde
     # Rojo para valores bajos, verde para valores altos
@@ -907,31 +4102,13 @@ def create_adoption_heatmap(filtered_data):
     return fig
 
 # FUNCIÓN: Gráfico de % Adopción vs Tiempo
-def create_adoption_trend(filtered_data, selected_months):
+def create_adoption_trend(metrics_context):
     """
     Crea gráfico de tendencia de % de adopción a lo largo del tiempo
     """
-    # Ordenar los meses seleccionados cronológicamente
-    selected_months_sorted = sort_months_chronologically(selected_months)
-    
-    # Calcular % de adopción para cada mes
-    adoption_data = []
-    
-    for month in selected_months_sorted:
-        month_data = filtered_data[filtered_data['Mes'] == month]
-        total_users = month_data['NOMBRE'].nunique()
-        users_with_usage = month_data[month_data['usos_ia'] > 0]['NOMBRE'].nunique()
-        
-        adoption_percentage = (users_with_usage / total_users) * 100 if total_users > 0 else 0
-        
-        adoption_data.append({
-            'Mes': month,
-            'Porcentaje_Adopcion': adoption_percentage,
-            'Usuarios_Activos': users_with_usage,
-            'Total_Usuarios': total_users
-        })
-    
-    adoption_df = pd.DataFrame(adoption_data)
+    # Serie mensual en orden cronológico con su tendencia (OPTIMIZACIÓN: del contexto de métricas)
+    monthly_adoption = metrics_context['monthly_adoption']
+    adoption_df = monthly_adoption['series']
     
     # Crear gráfico de línea con marcadores
     fig = go.Figure()
@@ -951,15 +4128,10 @@ def create_adoption_trend(filtered_data, selected_months):
     ))
     
     # Añadir línea de tendencia si hay más de un punto
-    if len(adoption_df) > 1:
-        x_numeric = list(range(len(adoption_df)))
-        y_values = adoption_df['Porcentaje_Adopcion'].values
-        z = np.polyfit(x_numeric, y_values, 1)
-        p = np.poly1d(z)
-        
+    if monthly_adoption['trend'] is not None:
         fig.add_trace(go.Scatter(
             x=adoption_df['Mes'],
-            y=p(x_numeric),
+            y=adoption_df['Tendencia'],
             mode='lines',
             name='Tendencia',
             line=dict(color='red', width=2, dash='dash'),
@@ -986,7 +4158,7 @@ def create_top_5_users_by_usage(filtered_data):
     Crea tabla de ranking con los top 5 usuarios por uso total de SAI
     """
     # Calcular uso total por usuario
-    user_usage = filtered_data.groupby(['NOMBRE', 'PAIS', 'AREA', 'CARGO']).agg({
+    user_usage = filtered_data.groupby(['NOMBRE', 'PAIS', 'AREA', 'CARGO'], observed=True).agg({
         'usos_ia': 'sum'
     }).reset_index()
     
@@ -1007,53 +4179,36 @@ def create_top_5_users_by_usage(filtered_data):
     
     return user_usage
 
-def create_top_5_countries_by_usage(filtered_data):
+def create_top_5_countries_by_usage(metrics_context):
     """
     Crea tabla de ranking con los top 5 países por uso total de SAI
     """
-    # Calcular uso total por país
-    country_usage = filtered_data.groupby('PAIS').agg({
-        'usos_ia': 'sum',
-        'NOMBRE': 'nunique'
-    }).reset_index()
+    # Uso total por país (OPTIMIZACIÓN: de las estadísticas por país de la selección, en orden alfabético)
+    country_usage = metrics_context['country_statistics'].sort_values('valor', kind='stable')
+    country_usage = country_usage[['valor', 'Total_Usos', 'Total_Usuarios']]
     
     # Ordenar por uso total de mayor a menor y tomar top 5
-    country_usage = country_usage.sort_values('usos_ia', ascending=False).head(5)
+    country_usage = country_usage.sort_values('Total_Usos', ascending=False).head(5)
     
     # Agregar columna de posición
     country_usage.insert(0, 'Posición', range(1, len(country_usage) + 1))
     
     # Renombrar columnas para mejor presentación
     country_usage = country_usage.rename(columns={
-        'PAIS': 'País',
-        'usos_ia': 'Total Usos SAI',
-        'NOMBRE': 'Total Usuarios'
+        'valor': 'País',
+        'Total_Usos': 'Total Usos SAI',
+        'Total_Usuarios': 'Total Usuarios'
     })
     
     return country_usage
 
-def create_top_5_countries_by_adoption(filtered_data):
+def create_top_5_countries_by_adoption(metrics_context):
     """
     Crea tabla de ranking con los top 5 países por porcentaje de adopción de SAI
     """
-    # Calcular adopción por país
-    country_adoption = []
-    
-    for country in filtered_data['PAIS'].unique():
-        country_data = filtered_data[filtered_data['PAIS'] == country]
-        total_users = country_data['NOMBRE'].nunique()
-        active_users = country_data[country_data['usos_ia'] > 0]['NOMBRE'].nunique()
-        
-        adoption_rate = (active_users / total_users) * 100 if total_users > 0 else 0
-        
-        country_adoption.append({
-            'País': country,
-            'Total_Usuarios': total_users,
-            'Usuarios_Activos': active_users,
-            'Porcentaje_Adopcion': adoption_rate
-        })
-    
-    adoption_df = pd.DataFrame(country_adoption)
+    # Adopción por país (OPTIMIZACIÓN: de las estadísticas por país de la selección)
+    adoption_df = metrics_context['country_statistics']
+    adoption_df = adoption_df[['valor', 'Total_Usuarios', 'Usuarios_Activos', 'Porcentaje_Adopcion']]
     
     # Ordenar por porcentaje de adopción de mayor a menor y tomar top 5
     adoption_df = adoption_df.sort_values('Porcentaje_Adopcion', ascending=False).head(5)
@@ -1063,6 +4218,7 @@ def create_top_5_countries_by_adoption(filtered_data):
     
     # Renombrar columnas para mejor presentación
     adoption_df = adoption_df.rename(columns={
+        'valor': 'País',
         'Total_Usuarios': 'Total Usuarios',
         'Usuarios_Activos': 'Usuarios Activos',
         'Porcentaje_Adopcion': '% Adopción'
@@ -1073,7 +4229,7 @@ def create_top_5_countries_by_adoption(filtered_data):
     
     return adoption_df
 
-def show_rankings_section(filtered_data):
+def show_rankings_section(metrics_context):
     """
     Muestra la sección de rankings con 3 tablas: Top 5 Usuarios, Top 5 Países por Uso y Top 5 Países por Adopción
     """
@@ -1081,9 +4237,10 @@ def show_rankings_section(filtered_data):
     st.markdown("Análisis de los mejores performers durante el período seleccionado.")
     
     # Crear las tres tablas de ranking
-    top_5_users = create_top_5_users_by_usage(filtered_data)
-    top_5_countries_usage = create_top_5_countries_by_usage(filtered_data)
-    top_5_countries_adoption = create_top_5_countries_by_adoption(filtered_data)
+    # OPTIMIZACIÓN: Las tablas se guardan en la caché de resultados de la selección
+    top_5_users = metrics_context['top_5_users']
+    top_5_countries_usage = get_view_result(metrics_context, 'top_5_countries_usage', lambda: create_top_5_countries_by_usage(metrics_context))
+    top_5_countries_adoption = get_view_result(metrics_context, 'top_5_countries_adoption', lambda: create_top_5_countries_by_adoption(metrics_context))
     
     # Organizar en 3 columnas para mostrar las tablas lado a lado
     col1, col2, col3 = st.columns(3)
@@ -1249,89 +4406,52 @@ def show_no_filters_warning():
 # FUNCIONES OPTIMIZADAS PARA ESTADÍSTICAS DETALLADAS
 # ==========================================
 
-def create_detailed_country_statistics(filtered_data):
+def create_detailed_statistics(statistics, label):
     """
-    Crea estadísticas detalladas por país con todas las métricas solicitadas
+    Crea estadísticas detalladas por valor de una dimensión (PAIS o AREA) con todas las métricas solicitadas
+    
+    OPTIMIZACIÓN: Se leen de las estadísticas por dimensión de la selección (ver
+    compute_dimension_statistics) en lugar de recorrer la tabla filtrada una vez por valor
     
     Returns:
-        pd.DataFrame: DataFrame con estadísticas completas por país
+        pd.DataFrame: DataFrame con estadísticas completas por valor, ordenado por adopción
     """
-    country_stats = []
     
-    for country in filtered_data['PAIS'].unique():
-        country_data = filtered_data[filtered_data['PAIS'] == country]
-        
-        # Métricas básicas
-        total_professionals = country_data['NOMBRE'].nunique()
-        active_users = country_data[country_data['usos_ia'] > 0]['NOMBRE'].nunique()
-        adoption_rate = (active_users / total_professionals) * 100 if total_professionals > 0 else 0
-        
-        # Métricas de uso
-        total_usage = country_data['usos_ia'].sum()
-        avg_usage_per_user = total_usage / total_professionals if total_professionals > 0 else 0
-        
-        # Calcular desviación estándar por usuario
-        user_usage_totals = country_data.groupby('NOMBRE')['usos_ia'].sum()
-        std_deviation = user_usage_totals.std() if len(user_usage_totals) > 1 else 0
-        
-        country_stats.append({
-            'País': country,
-            'Total Profesionales Elegibles': total_professionals,
-            'Usuarios Activos': active_users,
-            '% de Adopción': round(adoption_rate, 1),
-            'Cantidad de Usos': int(total_usage),
-            'Uso Promedio por Usuario': round(avg_usage_per_user, 2),
-            'Desviación Estándar': round(std_deviation, 2)
-        })
+    # Todo valor presente tiene al menos un profesional elegible
+    stats_df = pd.DataFrame({
+        label: statistics['valor'],
+        'Total Profesionales Elegibles': statistics['Total_Usuarios'],
+        'Usuarios Activos': statistics['Usuarios_Activos'],
+        '% de Adopción': statistics['Porcentaje_Adopcion'].round(1),
+        'Cantidad de Usos': statistics['Total_Usos'],
+        'Uso Promedio por Usuario': (statistics['Total_Usos'] / statistics['Total_Usuarios']).round(2),
+        'Desviación Estándar': statistics['Desviacion_Estandar'].round(2)
+    })
     
-    # Convertir a DataFrame y ordenar por adopción
-    stats_df = pd.DataFrame(country_stats)
+    # Ordenar por adopción
     stats_df = stats_df.sort_values('% de Adopción', ascending=False)
     
     return stats_df
 
-def create_detailed_area_statistics(filtered_data):
+def create_detailed_country_statistics(metrics_context):
+    """
+    Crea estadísticas detalladas por país con todas las métricas solicitadas
+    
+    Returns:
+        pd.DataFrame: DataFrame con estadísticas completas por país
+    """
+    return create_detailed_statistics(metrics_context['country_statistics'], 'País')
+
+def create_detailed_area_statistics(metrics_context):
     """
     Crea estadísticas detalladas por área con todas las métricas solicitadas
     
     Returns:
         pd.DataFrame: DataFrame con estadísticas completas por área
     """
-    area_stats = []
-    
-    for area in filtered_data['AREA'].unique():
-        area_data = filtered_data[filtered_data['AREA'] == area]
-        
-        # Métricas básicas
-        total_professionals = area_data['NOMBRE'].nunique()
-        active_users = area_data[area_data['usos_ia'] > 0]['NOMBRE'].nunique()
-        adoption_rate = (active_users / total_professionals) * 100 if total_professionals > 0 else 0
-        
-        # Métricas de uso
-        total_usage = area_data['usos_ia'].sum()
-        avg_usage_per_user = total_usage / total_professionals if total_professionals > 0 else 0
-        
-        # Calcular desviación estándar por usuario
-        user_usage_totals = area_data.groupby('NOMBRE')['usos_ia'].sum()
-        std_deviation = user_usage_totals.std() if len(user_usage_totals) > 1 else 0
-        
-        area_stats.append({
-            'Área': area,
-            'Total Profesionales Elegibles': total_professionals,
-            'Usuarios Activos': active_users,
-            '% de Adopción': round(adoption_rate, 1),
-            'Cantidad de Usos': int(total_usage),
-            'Uso Promedio por Usuario': round(avg_usage_per_user, 2),
-            'Desviación Estándar': round(std_deviation, 2)
-        })
-    
-    # Convertir a DataFrame y ordenar por adopción
-    stats_df = pd.DataFrame(area_stats)
-    stats_df = stats_df.sort_values('% de Adopción', ascending=False)
-    
-    return stats_df
+    return create_detailed_statistics(metrics_context['area_statistics'], 'Área')
 
-def show_detailed_statistics_section(filtered_data):
+def show_detailed_statistics_section(metrics_context):
     """
     Muestra la sección de estadísticas detalladas con tablas optimizadas por país y área
     """
@@ -1339,8 +4459,9 @@ def show_detailed_statistics_section(filtered_data):
     st.markdown("Análisis estadístico completo con métricas avanzadas de adopción y uso.")
     
     # Crear las estadísticas detalladas
-    country_stats = create_detailed_country_statistics(filtered_data)
-    area_stats = create_detailed_area_statistics(filtered_data)
+    # OPTIMIZACIÓN: Las tablas se guardan en la caché de resultados de la selección
+    country_stats = get_view_result(metrics_context, 'detailed_country_statistics', lambda: create_detailed_country_statistics(metrics_context))
+    area_stats = get_view_result(metrics_context, 'detailed_area_statistics', lambda: create_detailed_area_statistics(metrics_context))
     
     # TABLA 1: Estadísticas por País
     st.markdown("#### 🌍 **Estadísticas Detalladas por País**")
@@ -1522,17 +4643,132 @@ def show_detailed_statistics_section(filtered_data):
                 help="Porcentaje promedio de adopción entre todas las áreas"
             )
 
+# ==========================================
+# FUNCIONES: FRAGMENTOS CON RERUN PARCIAL
+# ==========================================
+
+# OPTIMIZACIÓN: Filtros, dashboard, resumen ejecutivo e insights son fragmentos (st.fragment): interactuar
+# con un widget de un fragmento vuelve a ejecutar solo ese fragmento y solo se reenvían sus elementos
+FRAGMENT_TIMINGS_KEY = 'fragment_timings'
+
+def record_fragment_timing(name, start_time):
+    """
+    Registra en session_state la duración de una ejecución de un fragmento (o de la aplicación completa)
+
+    Returns:
+        dict: Ejecuciones, duración de la última y duración acumulada (ms) de ese fragmento
+    """
+    timings = st.session_state.setdefault(FRAGMENT_TIMINGS_KEY, {})
+    timing = timings.setdefault(name, {'runs': 0, 'last_ms': 0.0, 'total_ms': 0.0})
+    timing['runs'] += 1
+    timing['last_ms'] = (time.perf_counter() - start_time) * 1000
+    timing['total_ms'] += timing['last_ms']
+
+    return timing
+
+def timed_fragment(name, in_sidebar=False):
+    """
+    Decorador que convierte una función de visualización en un fragmento y registra cuánto tarda cada
+    ejecución. En modo operador lo muestra además al final del fragmento (en el sidebar si el fragmento
+    escribe ahí), porque el resumen del sidebar solo se actualiza en las ejecuciones completas
+    """
+    def decorator(render):
+        @st.fragment
+        @functools.wraps(render)
+        def fragment(*args, **kwargs):
+            start_time = time.perf_counter()
+            result = render(*args, **kwargs)
+            timing = record_fragment_timing(name, start_time)
+            if OPERATOR_MODE:
+                (st.sidebar if in_sidebar else st).caption(
+                    f"⏱️ {name}: {timing['last_ms']:.1f} ms (ejecución #{timing['runs']})"
+                )
+            return result
+
+        return fragment
+
+    return decorator
+
+def show_fragment_timings():
+    """
+    Muestra en el sidebar la duración de cada fragmento y de la aplicación completa (para operadores).
+    Se actualiza en cada ejecución completa; cada fragmento muestra además su propio tiempo al rerun
+    """
+    timings = st.session_state.get(FRAGMENT_TIMINGS_KEY, {})
+
+    with st.sidebar.expander("⏱️ Tiempos por fragmento"):
+        for name, timing in timings.items():
+            st.caption(
+                f"- {name}: última {timing['last_ms']:.1f} ms | promedio "
+                f"{timing['total_ms'] / timing['runs']:.1f} ms | ejecuciones: {timing['runs']}"
+            )
+
+@timed_fragment("Filtros", in_sidebar=True)
+def show_analysis_filters(month_columns_sorted, df_melted):
+    """
+    Fragmento de los filtros del sidebar. Un cambio en los widgets vuelve a ejecutar solo los filtros;
+    la aplicación completa se vuelve a ejecutar únicamente si cambia la selección resultante
+
+    Returns:
+        dict: Selección de filtros (months, filter_type, countries, areas)
+    """
+    # Filtros temporales dinámicos
+    selected_months, filter_type = create_dynamic_filters(month_columns_sorted)
+
+    # Separador visual
+    st.sidebar.markdown("---")
+
+    # Filtros múltiples
+    selected_countries, selected_areas = create_multiple_filters(df_melted)
+
+    filter_selection = {
+        'months': selected_months,
+        'filter_type': filter_type,
+        'countries': selected_countries,
+        'areas': selected_areas
+    }
+
+    # La última selección aplicada es la de la ejecución anterior de este fragmento
+    previous_selection = st.session_state.get('filter_selection')
+    st.session_state.filter_selection = filter_selection
+    if previous_selection is not None and previous_selection != filter_selection:
+        st.rerun(scope="app")
+
+    return filter_selection
+
 # ==========================================
 # FUNCIONES PARA LAS NUEVAS PESTAÑAS
 # ==========================================
 
-def show_dashboard_tab(filtered_data, selected_months, selected_countries, selected_areas, chart_conditions):
+# OPTIMIZACIÓN: Navegación diferida, solo se construye (y se envía al navegador) la pestaña activa
+LAZY_TAB_RENDERING = True
+
+def create_lazy_tabs(labels, key):
+    """
+    Crea pestañas que, con LAZY_TAB_RENDERING, vuelven a ejecutar el script al cambiar de pestaña para
+    construir solo el contenido de la pestaña activa (las demás se construyen cuando se abren)
+    """
+    if LAZY_TAB_RENDERING:
+        return st.tabs(labels, key=key, on_change='rerun')
+
+    return st.tabs(labels)
+
+def is_tab_active(tab):
+    """
+    Indica si hay que construir el contenido de una pestaña: la pestaña activa, o todas si la navegación
+    diferida está desactivada (en ese caso .open es None)
+    """
+    return tab.open is not False
+
+@timed_fragment("Dashboard")
+def show_dashboard_tab(filtered_data, metrics_context, selected_months, selected_countries, selected_areas, chart_conditions):
     """
-    Muestra el contenido de la pestaña Dashboard
+    Muestra el contenido de la pestaña Dashboard (fragmento: cambiar de sub-pestaña vuelve a ejecutar
+    solo el dashboard, con el contexto de métricas de la última ejecución completa)
     """
     # SECCIÓN: Métricas principales
     st.header("📊 Métricas Principales")
-    create_metrics(None, filtered_data, selected_months)
+    create_metrics(metrics_context)
     st.markdown("---")
 
     # SECCIÓN: Análisis de Adopción SAI
@@ -1544,7 +4780,7 @@ def show_dashboard_tab(filtered_data, selected_months, selected_countries, selec
         description = generate_chart_description('trend', selected_months, selected_countries, selected_areas)
         st.markdown(f"*{description}*")
         
-        fig_adoption_trend = create_adoption_trend(filtered_data, selected_months)
+        fig_adoption_trend = get_view_result(metrics_context, 'fig_adoption_trend', lambda: create_adoption_trend(metrics_context))
         st.plotly_chart(fig_adoption_trend, use_container_width=True)
     else:
         show_chart_requirement_message("adoption_trend", "multiple_months")
@@ -1556,7 +4792,7 @@ def show_dashboard_tab(filtered_data, selected_months, selected_countries, selec
         description = generate_chart_description('country', selected_months, selected_countries, selected_areas)
         st.markdown(f"*{description}*")
         
-        fig_adoption_country = create_adoption_by_country(filtered_data)
+        fig_adoption_country = get_view_result(metrics_context, 'fig_adoption_country', lambda: create_adoption_by_country(metrics_context))
         st.plotly_chart(fig_adoption_country, use_container_width=True)
     else:
         show_chart_requirement_message("adoption_by_country", "multiple_countries")
@@ -1568,7 +4804,7 @@ def show_dashboard_tab(filtered_data, selected_months, selected_countries, selec
         description = generate_chart_description('heatmap', selected_months, selected_countries, selected_areas)
         st.markdown(f"*{description}*")
         
-        fig_adoption_heatmap = create_adoption_heatmap(filtered_data)
+        fig_adoption_heatmap = get_view_result(metrics_context, 'fig_adoption_heatmap', lambda: create_adoption_heatmap(metrics_context))
         st.plotly_chart(fig_adoption_heatmap, use_container_width=True)
     else:
         show_chart_requirement_message("adoption_heatmap", "multiple_dimensions")
@@ -1578,34 +4814,45 @@ def show_dashboard_tab(filtered_data, selected_months, selected_countries, selec
     st.header("📋 Análisis Detallado Adicional")
 
     # Sub-pestañas dentro del dashboard
-    sub_tab1, sub_tab2, sub_tab3 = st.tabs([
+    sub_tab1, sub_tab2, sub_tab3 = create_lazy_tabs([
         "🏆 Rankings",
         "📄 Datos Filtrados", 
         "📈 Resumen Estadístico"
-    ])
+    ], key="dashboard_sub_tabs")
 
     with sub_tab1:
-        show_rankings_section(filtered_data)
+        if is_tab_active(sub_tab1):
+            show_rankings_section(metrics_context)
 
     with sub_tab2:
-        st.subheader("📄 Datos Filtrados Completos")
-        st.dataframe(filtered_data, use_container_width=True)
-
-        # Botón de descarga
-        csv = filtered_data.to_csv(index=False)
-        st.download_button(
-            label="📥 Descargar datos filtrados completos",
-            data=csv,
-            file_name='datos_filtrados_adopcion_completos.csv',
-            mime='text/csv'
-        )
+        if is_tab_active(sub_tab2):
+            show_filtered_data_section(filtered_data, metrics_context)
 
     with sub_tab3:
-        show_detailed_statistics_section(filtered_data)
+        if is_tab_active(sub_tab3):
+            show_detailed_statistics_section(metrics_context)
 
-def show_executive_summary_tab(filtered_data, selected_months, selected_countries, selected_areas, filter_type):
+def show_filtered_data_section(filtered_data, metrics_context):
     """
-    Muestra el contenido de la pestaña Resumen Ejecutivo usando IA
+    Muestra la tabla de datos filtrados completa con su botón de descarga
+    """
+    st.subheader("📄 Datos Filtrados Completos")
+    st.dataframe(filtered_data, use_container_width=True)
+
+    # Botón de descarga
+    csv = get_view_result(metrics_context, 'csv_filtered_data', lambda: filtered_data.to_csv(index=False))
+    st.download_button(
+        label="📥 Descargar datos filtrados completos",
+        data=csv,
+        file_name='datos_filtrados_adopcion_completos.csv',
+        mime='text/csv'
+    )
+
+@timed_fragment("Resumen Ejecutivo IA")
+def show_executive_summary_tab(metrics_context, selected_months, selected_countries, selected_areas, filter_type):
+    """
+    Muestra el contenido de la pestaña Resumen Ejecutivo usando IA (fragmento: escribir la API Key o
+    generar el resumen no vuelve a ejecutar el dashboard ni los filtros)
     """
     st.header("🤖 Resumen Ejecutivo con IA")
     st.markdown("Genera un resumen ejecutivo inteligente de todos los datos visibles usando inteligencia artificial.")
@@ -1631,12 +4878,19 @@ def show_executive_summary_tab(filtered_data, selected_months, selected_countrie
     
     with col2:
         st.markdown("<br>", unsafe_allow_html=True)  # Espaciado
+        job = get_latest_llm_job('resumen_ejecutivo')
         generate_summary = st.button(
             "🚀 Generar Resumen Ejecutivo",
             type="primary",
-            disabled=not api_key,
+            disabled=not api_key or is_llm_job_pending(job),
             help="Genera un resumen ejecutivo inteligente de todos los datos visibles"
         )
+        # OPTIMIZACIÓN: Las respuestas se reutilizan de la caché salvo que se fuerce una nueva consulta
+        force_refresh = st.checkbox(
+            "🔁 Forzar nueva consulta",
+            key="executive_force_refresh",
+            help="Ignora la respuesta guardada en caché para estos datos y vuelve a llamar al LLM"
+        )
     
     # Mostrar información sobre qué datos se incluirán
     with st.expander("ℹ️ ¿Qué información se incluye en el resumen ejecutivo?"):
@@ -1658,77 +4912,142 @@ def show_executive_summary_tab(filtered_data, selected_months, selected_countrie
         - Países y áreas incluidos
         """)
     
-    # Generar resumen si se presiona el botón
+    # Enviar la consulta al pool si se presiona el botón (no bloquea la sesión)
     if generate_summary:
         if not api_key:
             st.error("⚠️ Por favor, ingresa tu API Key para continuar.")
             return
         
-        # Mostrar indicador de carga
-        with st.spinner("🤖 Generando resumen ejecutivo... Esto puede tomar unos momentos."):
-            # Generar texto con toda la información
-            summary_input_text = generate_summary_text(
-                filtered_data, 
-                selected_months, 
-                selected_countries, 
-                selected_areas, 
-                filter_type
-            )
-            
-            # Llamar al LLM
-            llm_response = generate_llm_summary(summary_input_text, api_key)
-        
-        # Mostrar resultado
-        st.subheader("📋 Resumen Ejecutivo Generado")
+        # Generar texto con toda la información (por bloques si supera el presupuesto)
+        payload = prepare_llm_payload(
+            metrics_context, 
+            selected_months, 
+            selected_countries, 
+            selected_areas, 
+            filter_type
+        )
         
-        # Verificar si hubo error
-        if llm_response.startswith("Error"):
-            st.error(f"❌ {llm_response}")
-            st.info("💡 Verifica que tu API Key sea correcta y que tengas conexión a internet.")
+        # Llamar al LLM en segundo plano, con el resumen local como respaldo si tarda o falla
+        use_cache = not force_refresh
+        job = submit_llm_job(
+            'resumen_ejecutivo',
+            lambda cancel_event, on_chunk: generate_llm_payload_response(payload, api_key, None, use_cache, cancel_event, on_chunk),
+            {
+                'data': payload['data'],
+                'local_summary': generate_local_executive_summary(
+                    metrics_context, selected_months, selected_countries, selected_areas, filter_type
+                )
+            }
+        )
+    
+    # Mostrar la última consulta de la sesión (en curso o terminada) si es de la selección actual
+    if job is not None:
+        data_text = generate_summary_text(metrics_context, selected_months, selected_countries, selected_areas, filter_type)
+        if LLM_SUMMARY_DEADLINE_SECONDS > 0:
+            show_llm_job_for_selection(
+                job, data_text, show_executive_summary_result, show_executive_summary_fallback, LLM_SUMMARY_DEADLINE_SECONDS
+            )
         else:
-            # Mostrar resumen exitoso
-            st.success("✅ Resumen ejecutivo generado exitosamente")
-            
-            # Mostrar el resumen en un contenedor estilizado
-            st.markdown("""
-            <div style="
-                background-color: #f8f9fa;
-                border-left: 4px solid #007bff;
-                padding: 1rem;
-                border-radius: 0.5rem;
-                margin: 1rem 0;
-            ">
-            """, unsafe_allow_html=True)
-            
-            st.markdown(llm_response)
-            
-            st.markdown("</div>", unsafe_allow_html=True)
-            
-            # Botón para descargar el resumen
+            show_llm_job_for_selection(job, data_text, show_executive_summary_result)
+
+def show_local_executive_summary(job):
+    """
+    Muestra el resumen ejecutivo local (sin LLM) de la selección de una consulta
+    """
+    st.markdown(job['details']['local_summary'])
+
+def show_executive_summary_fallback(job):
+    """
+    Respaldo mientras el LLM no responde: el resumen ejecutivo local, que se reemplaza por el del LLM
+    """
+    st.warning(
+        f"⏱️ El servicio de IA tarda más de {LLM_SUMMARY_DEADLINE_SECONDS:g} s. Mientras tanto se muestra un "
+        "resumen calculado localmente con reglas; se reemplazará por el del LLM cuando llegue."
+    )
+    show_local_executive_summary(job)
+
+def show_executive_summary_result(job):
+    """
+    Muestra el resumen ejecutivo de una consulta completada
+    """
+    llm_result = job['result']
+    llm_response = llm_result['text']
+    summary_input_text = job['details']['data']
+    
+    # Mostrar resultado
+    st.subheader("📋 Resumen Ejecutivo Generado")
+    show_llm_cache_notice(llm_result)
+    show_llm_response_timing(llm_result)
+    
+    # Verificar si hubo error
+    if llm_response.startswith("Error"):
+        st.error(f"❌ {llm_response}")
+        st.info("💡 Verifica que tu API Key sea correcta y que tengas conexión a internet.")
+        
+        # Respaldo: resumen calculado localmente con reglas sobre los mismos datos
+        if LLM_SUMMARY_DEADLINE_SECONDS > 0:
+            st.subheader("📋 Resumen Ejecutivo Local (sin IA)")
+            show_local_executive_summary(job)
             st.download_button(
-                label="📥 Descargar Resumen Ejecutivo",
-                data=llm_response,
-                file_name=f"resumen_ejecutivo_sai_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                label="📥 Descargar Resumen Local",
+                data=job['details']['local_summary'],
+                file_name=f"resumen_local_sai_{datetime.fromtimestamp(job['finished_at']).strftime('%Y%m%d_%H%M%S')}.txt",
                 mime="text/plain",
-                help="Descarga el resumen ejecutivo generado como archivo de texto"
+                help="Descarga el resumen calculado localmente como archivo de texto"
             )
+    else:
+        # Mostrar resumen exitoso
+        st.success("✅ Resumen ejecutivo generado exitosamente")
         
-        # Mostrar datos de entrada (opcional, en expander)
-        with st.expander("🔍 Ver datos de entrada enviados al LLM"):
-            st.text_area(
-                "Información enviada al LLM:",
-                value=summary_input_text,
-                height=300,
-                disabled=True
-            )
+        # Mostrar el resumen en un contenedor estilizado
+        st.markdown("""
+        <div style="
+            background-color: #f8f9fa;
+            border-left: 4px solid #007bff;
+            padding: 1rem;
+            border-radius: 0.5rem;
+            margin: 1rem 0;
+        ">
+        """, unsafe_allow_html=True)
+        
+        st.markdown(llm_response)
+        
+        st.markdown("</div>", unsafe_allow_html=True)
+        
+        # Botón para descargar el resumen
+        st.download_button(
+            label="📥 Descargar Resumen Ejecutivo",
+            data=llm_response,
+            file_name=f"resumen_ejecutivo_sai_{datetime.fromtimestamp(job['finished_at']).strftime('%Y%m%d_%H%M%S')}.txt",
+            mime="text/plain",
+            help="Descarga el resumen ejecutivo generado como archivo de texto"
+        )
+    
+    # Mostrar datos de entrada (opcional, en expander)
+    with st.expander("🔍 Ver datos de entrada enviados al LLM"):
+        st.text_area(
+            "Información enviada al LLM:",
+            value=summary_input_text,
+            height=300,
+            disabled=True
+        )
 
-def show_insights_tab(filtered_data, selected_months, selected_countries, selected_areas, filter_type):
+@timed_fragment("Insights IA")
+def show_insights_tab(metrics_context, selected_months, selected_countries, selected_areas, filter_type):
     """
     PESTAÑA OPTIMIZADA: Insights Dashboard con IA - Responde preguntas específicas del usuario
+    (fragmento: escribir la pregunta no vuelve a ejecutar el dashboard ni los filtros)
     """
     st.header("💡 Insights Dashboard con IA")
     st.markdown("Haz preguntas específicas sobre los datos del dashboard y obtén respuestas inteligentes usando IA.")
     
+    # OPTIMIZACIÓN: En modo lote se envían varias preguntas a la vez sobre los mismos datos
+    batch_mode = st.toggle(
+        "📚 Modo lote: varias preguntas a la vez",
+        key="insights_batch_mode",
+        help="Responde una lista de preguntas en paralelo sobre la misma selección de filtros"
+    )
+    
     # OPTIMIZACIÓN PRINCIPAL: Usar session_state para mantener la API Key y pregunta
     if 'insights_api_key' not in st.session_state:
         st.session_state.insights_api_key = ""
@@ -1752,12 +5071,40 @@ def show_insights_tab(filtered_data, selected_months, selected_countries, select
     
     with col2:
         st.markdown("<br>", unsafe_allow_html=True)  # Espaciado
-        generate_insights = st.button(
-            "🚀 Obtener Respuesta",
-            type="primary",
-            disabled=not api_key,
-            help="Genera respuesta inteligente a tu pregunta específica"
+        job = get_latest_llm_job('pregunta')
+        if batch_mode:
+            generate_insights = st.button(
+                "🚀 Responder Todas",
+                type="primary",
+                disabled=not api_key or is_llm_batch_pending(get_latest_llm_batch('preguntas')),
+                help="Genera las respuestas de todas las preguntas del lote"
+            )
+        else:
+            generate_insights = st.button(
+                "🚀 Obtener Respuesta",
+                type="primary",
+                disabled=not api_key or is_llm_job_pending(job),
+                help="Genera respuesta inteligente a tu pregunta específica"
+            )
+        # OPTIMIZACIÓN: Las respuestas se reutilizan de la caché salvo que se fuerce una nueva consulta
+        force_refresh = st.checkbox(
+            "🔁 Forzar nueva consulta",
+            key="insights_force_refresh",
+            help="Ignora la respuesta guardada en caché para esta pregunta y vuelve a llamar al LLM"
+        )
+    
+    if batch_mode:
+        show_insights_batch_section(
+            metrics_context,
+            selected_months,
+            selected_countries,
+            selected_areas,
+            filter_type,
+            api_key,
+            not force_refresh,
+            generate_insights
         )
+        return
     
     # Campo de pregunta del usuario con ejemplos en placeholder
     pregunta = st.text_area(
@@ -1795,7 +5142,7 @@ def show_insights_tab(filtered_data, selected_months, selected_countries, select
         - ¿Qué recomendaciones darías para mejorar la adopción?
         """)
     
-    # Generar respuesta si se presiona el botón
+    # Enviar la consulta al pool si se presiona el botón (no bloquea la sesión)
     if generate_insights:
         if not api_key:
             st.error("⚠️ Por favor, ingresa tu API Key para continuar.")
@@ -1805,89 +5152,272 @@ def show_insights_tab(filtered_data, selected_months, selected_countries, select
             st.error("⚠️ Por favor, escribe una pregunta para obtener una respuesta.")
             return
         
-        # Mostrar indicador de carga
-        with st.spinner("💡 Analizando datos y generando respuesta... Esto puede tomar unos momentos."):
-            # Generar texto con toda la información (variable 'data')
-            data = generate_summary_text(
-                filtered_data, 
-                selected_months, 
-                selected_countries, 
-                selected_areas, 
-                filter_type
-            )
-            
-            # Llamar al LLM con la pregunta específica
-            llm_response = generate_llm_question_response(data, pregunta, api_key)
+        # Generar texto con toda la información (variable 'data'; por bloques si supera el presupuesto)
+        payload = prepare_llm_payload(
+            metrics_context, 
+            selected_months, 
+            selected_countries, 
+            selected_areas, 
+            filter_type
+        )
         
-        # Mostrar resultado
-        st.subheader("💡 Respuesta Generada")
+        # Llamar al LLM con la pregunta específica en segundo plano
+        use_cache = not force_refresh
+        job = submit_llm_job(
+            'pregunta',
+            lambda cancel_event, on_chunk: generate_llm_payload_response(
+                payload, api_key, pregunta, use_cache, cancel_event, on_chunk
+            ),
+            {'data': payload['data'], 'pregunta': pregunta}
+        )
+    
+    # Mostrar la última consulta de la sesión (en curso o terminada) si es de la selección actual
+    if job is not None:
+        data_text = generate_summary_text(metrics_context, selected_months, selected_countries, selected_areas, filter_type)
+        show_llm_job_for_selection(job, data_text, show_insights_result)
+
+def show_insights_result(job):
+    """
+    Muestra la respuesta de una consulta completada junto con su pregunta
+    """
+    llm_result = job['result']
+    llm_response = llm_result['text']
+    data = job['details']['data']
+    pregunta = job['details']['pregunta']
+    
+    # Mostrar resultado
+    st.subheader("💡 Respuesta Generada")
+    show_llm_cache_notice(llm_result)
+    show_llm_response_timing(llm_result)
+    
+    # Mostrar la pregunta del usuario
+    st.markdown(f"**❓ Tu pregunta:** *{pregunta}*")
+    st.markdown("---")
+    
+    # Verificar si hubo error
+    if llm_response.startswith("Error"):
+        st.error(f"❌ {llm_response}")
+        st.info("💡 Verifica que tu API Key sea correcta y que tengas conexión a internet.")
+    else:
+        # Mostrar respuesta exitosa
+        st.success("✅ Respuesta generada exitosamente")
         
-        # Mostrar la pregunta del usuario
-        st.markdown(f"**❓ Tu pregunta:** *{pregunta}*")
-        st.markdown("---")
+        # Mostrar la respuesta en un contenedor estilizado
+        st.markdown("""
+        <div style="
+            background-color: #f0f8ff;
+            border-left: 4px solid #4CAF50;
+            padding: 1rem;
+            border-radius: 0.5rem;
+            margin: 1rem 0;
+        ">
+        """, unsafe_allow_html=True)
         
-        # Verificar si hubo error
-        if llm_response.startswith("Error"):
-            st.error(f"❌ {llm_response}")
-            st.info("💡 Verifica que tu API Key sea correcta y que tengas conexión a internet.")
-        else:
-            # Mostrar respuesta exitosa
-            st.success("✅ Respuesta generada exitosamente")
-            
-            # Mostrar la respuesta en un contenedor estilizado
-            st.markdown("""
-            <div style="
-                background-color: #f0f8ff;
-                border-left: 4px solid #4CAF50;
-                padding: 1rem;
-                border-radius: 0.5rem;
-                margin: 1rem 0;
-            ">
-            """, unsafe_allow_html=True)
-            
-            st.markdown(llm_response)
-            
-            st.markdown("</div>", unsafe_allow_html=True)
-            
-            # Botón para descargar la respuesta
-            download_content = f"PREGUNTA:\n{pregunta}\n\n" + "="*50 + f"\n\nRESPUESTA:\n{llm_response}"
-            st.download_button(
-                label="📥 Descargar Pregunta y Respuesta",
-                data=download_content,
-                file_name=f"pregunta_respuesta_sai_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                mime="text/plain",
-                help="Descarga la pregunta y respuesta generada como archivo de texto"
-            )
+        st.markdown(llm_response)
         
-        # Mostrar datos de entrada (opcional, en expander)
-        with st.expander("🔍 Ver datos enviados al LLM"):
-            st.text_area(
-                "Datos enviados al LLM (variable 'data'):",
-                value=data,
-                height=200,
-                disabled=True,
-                key="insights_data_text"
-            )
-            
-            st.text_input(
-                "Pregunta enviada al LLM (variable 'pregunta'):",
-                value=pregunta,
-                disabled=True,
-                key="insights_pregunta_text"
-            )
+        st.markdown("</div>", unsafe_allow_html=True)
+        
+        # Botón para descargar la respuesta
+        download_content = f"PREGUNTA:\n{pregunta}\n\n" + "="*50 + f"\n\nRESPUESTA:\n{llm_response}"
+        st.download_button(
+            label="📥 Descargar Pregunta y Respuesta",
+            data=download_content,
+            file_name=f"pregunta_respuesta_sai_{datetime.fromtimestamp(job['finished_at']).strftime('%Y%m%d_%H%M%S')}.txt",
+            mime="text/plain",
+            help="Descarga la pregunta y respuesta generada como archivo de texto"
+        )
+    
+    # Mostrar datos de entrada (opcional, en expander)
+    with st.expander("🔍 Ver datos enviados al LLM"):
+        st.text_area(
+            "Datos enviados al LLM (variable 'data'):",
+            value=data,
+            height=200,
+            disabled=True,
+            key=f"insights_data_text_{job['id']}"
+        )
+        
+        st.text_input(
+            "Pregunta enviada al LLM (variable 'pregunta'):",
+            value=pregunta,
+            disabled=True,
+            key=f"insights_pregunta_text_{job['id']}"
+        )
+
+def parse_batch_questions(questions_text):
+    """
+    Separa un texto en preguntas (una por línea), sin viñetas ni numeración y sin repetidas
+
+    Args:
+        questions_text: Texto pegado o contenido del archivo subido
+
+    Returns:
+        list: Preguntas en el orden en que aparecen
+    """
+    questions = []
+    seen_questions = set()
+
+    for line in questions_text.splitlines():
+        pregunta = re.sub(r'^\s*(?:[-*•]|\d+[.)])\s*', '', line).strip().strip('"').strip()
+        if not pregunta:
+            continue
+
+        normalized_pregunta = normalize_pregunta(pregunta)
+        if normalized_pregunta not in seen_questions:
+            seen_questions.add(normalized_pregunta)
+            questions.append(pregunta)
+
+    return questions
+
+def show_insights_batch_section(metrics_context, selected_months, selected_countries, selected_areas,
+                                filter_type, api_key, use_cache, generate_batch):
+    """
+    Modo lote de la pestaña de Insights: varias preguntas (pegadas o desde un archivo) sobre el mismo
+    texto de datos, que se arma una sola vez y se envía en paralelo con un límite configurable
+    """
+    questions_text = st.text_area(
+        "❓ **Escribe tus preguntas (una por línea):**",
+        placeholder="¿Cuánto creció la adopción SAI en Colombia los últimos meses?\n¿Qué país tiene mejor performance en adopción?",
+        height=180,
+        key="insights_batch_text"
+    )
+    
+    uploaded_file = st.file_uploader(
+        "📄 O sube un archivo .txt o .csv con una pregunta por línea",
+        type=['txt', 'csv'],
+        key="insights_batch_file"
+    )
+    if uploaded_file is not None:
+        questions_text += "\n" + uploaded_file.getvalue().decode('utf-8-sig', errors='replace')
+    
+    parallelism = st.slider(
+        "⚡ Preguntas en paralelo",
+        min_value=1,
+        max_value=LLM_MAX_CONCURRENCY_PER_SERVER,
+        value=min(LLM_BATCH_PARALLELISM, LLM_MAX_CONCURRENCY_PER_SERVER),
+        key="insights_batch_parallelism",
+        help="Consultas simultáneas al servicio SAI para este lote"
+    )
+    
+    questions = parse_batch_questions(questions_text)
+    st.caption(f"{len(questions)} preguntas detectadas (máximo {LLM_BATCH_MAX_QUESTIONS} por lote)")
+    
+    # Enviar el lote si se presiona el botón
+    if generate_batch:
+        if not questions:
+            st.error("⚠️ Por favor, escribe o sube al menos una pregunta.")
+            return
+        
+        if len(questions) > LLM_BATCH_MAX_QUESTIONS:
+            st.warning(f"⚠️ Se enviarán solo las primeras {LLM_BATCH_MAX_QUESTIONS} preguntas.")
+            questions = questions[:LLM_BATCH_MAX_QUESTIONS]
+        
+        # El texto de datos (y sus bloques, si supera el presupuesto) se arma una sola vez para todo el lote
+        payload = prepare_llm_payload(
+            metrics_context, 
+            selected_months, 
+            selected_countries, 
+            selected_areas, 
+            filter_type
+        )
+        
+        submit_llm_batch(
+            'preguntas',
+            [
+                (
+                    lambda cancel_event, on_chunk, pregunta=pregunta: generate_llm_payload_response(
+                        payload, api_key, pregunta, use_cache, cancel_event, on_chunk
+                    ),
+                    {'data': payload['data'], 'pregunta': pregunta}
+                )
+                for pregunta in questions
+            ],
+            parallelism
+        )
+    
+    # Mostrar el último lote de la sesión (en curso o terminado) si es de la selección actual
+    batch = get_latest_llm_batch('preguntas')
+    if batch is not None:
+        data_text = generate_summary_text(metrics_context, selected_months, selected_countries, selected_areas, filter_type)
+        show_llm_batch_for_selection(batch, data_text, show_insights_batch_answers)
+
+def show_insights_batch_answers(batch):
+    """
+    Muestra las respuestas de un lote a medida que terminan y, con el lote completo, la descarga conjunta
+    """
+    jobs = get_llm_batch_jobs(batch)
+    finished_jobs = [job for job in jobs if not is_llm_job_pending(job)]
+    
+    st.subheader("💡 Respuestas del Lote")
+    st.progress(
+        len(finished_jobs) / len(jobs),
+        text=f"{len(finished_jobs)} de {len(jobs)} preguntas respondidas ({batch['parallelism']} en paralelo)"
+    )
+    
+    for index, job in enumerate(jobs, start=1):
+        pregunta = job['details']['pregunta']
+        
+        if job['status'] == 'completado':
+            llm_response = job['result']['text']
+            icon = "❌" if llm_response.startswith("Error") else "✅"
+            with st.expander(f"{icon} {index}. {pregunta}"):
+                if llm_response.startswith("Error"):
+                    st.error(f"❌ {llm_response}")
+                else:
+                    st.markdown(llm_response)
+                show_llm_cache_notice(job['result'])
+                show_llm_response_timing(job['result'])
+        else:
+            st.caption(f"{LLM_JOB_STATUS_LABELS[job['status']]} · {index}. {pregunta}")
+    
+    if len(finished_jobs) < len(jobs):
+        return
+    
+    # Lote completo: tiempo total frente a la consulta más lenta y descarga conjunta
+    completed_jobs = [job for job in jobs if job['status'] == 'completado']
+    if completed_jobs:
+        wall_seconds = max(job['finished_at'] for job in completed_jobs) - batch['submitted_at']
+        call_seconds = [job['finished_at'] - job['started_at'] for job in completed_jobs]
+        st.caption(
+            f"⏱️ Lote completo en {wall_seconds:.1f} s · consulta más lenta: {max(call_seconds):.1f} s · "
+            f"suma de las consultas: {sum(call_seconds):.1f} s"
+        )
+    
+    download_content = ("\n\n" + "="*50 + "\n\n").join(
+        f"PREGUNTA {index}:\n{job['details']['pregunta']}\n\nRESPUESTA:\n"
+        f"{job['result']['text'] if job['status'] == 'completado' else 'Consulta cancelada'}"
+        for index, job in enumerate(jobs, start=1)
+    )
+    st.download_button(
+        label="📥 Descargar Todas las Preguntas y Respuestas",
+        data=download_content,
+        file_name=f"preguntas_respuestas_sai_{datetime.fromtimestamp(batch['submitted_at']).strftime('%Y%m%d_%H%M%S')}.txt",
+        mime="text/plain",
+        help="Descarga todas las preguntas del lote con sus respuestas en un archivo de texto"
+    )
 
 # ==========================================
 # FUNCIÓN PRINCIPAL OPTIMIZADA CON 3 PESTAÑAS
 # ==========================================
 
 def main():
+    run_start_time = time.perf_counter()
+
     # Título principal
     st.title("🤖 Dashboard de Análisis de Adopción SAI - Áreas internas")
     st.markdown("---")
 
+    # OPTIMIZACIÓN: Permitir forzar la reconstrucción del snapshot desde los archivos Excel
+    force_rebuild = st.sidebar.button(
+        "🔄 Reprocesar archivos Excel",
+        help="Ignora el snapshot guardado y vuelve a leer areas_personas.xlsx y uso_por_mes.xlsx"
+    )
+    if force_rebuild:
+        process_input_files.clear()
+
     # PROCESAMIENTO AUTOMÁTICO DE ARCHIVOS
     with st.spinner("🔄 Procesando archivos automáticamente..."):
-        df_original, df_melted, month_columns_sorted = process_input_files()
+        df_original, df_melted, month_columns_sorted, usage_engine, load_info = process_input_files(_force_rebuild=force_rebuild)
 
     if df_melted is not None:
         
@@ -1896,23 +5426,35 @@ def main():
         with col1:
             st.metric("📊 Registros Totales", len(df_melted))
         with col2:
-            st.metric("👥 Usuarios Únicos", df_melted['NOMBRE'].nunique())
+            st.metric("👥 Usuarios Únicos", usage_engine['n_names'])
         with col3:
             st.metric("📅 Meses Disponibles", len(month_columns_sorted))
         
+        # Mostrar origen de los datos y tiempo de carga
+        if load_info['source'] == 'snapshot':
+            st.caption(f"⚡ Datos cargados desde snapshot en {load_info['seconds']:.2f} s")
+        elif load_info['source'] == 'incremental':
+            months_updated = ', '.join(load_info['months_updated']) or 'ninguno'
+            st.caption(f"🔁 Actualización incremental de uso_por_mes.xlsx en {load_info['seconds']:.2f} s (meses procesados: {months_updated})")
+        else:
+            snapshot_status = "snapshot actualizado" if load_info['snapshot_saved'] else "no se pudo guardar el snapshot"
+            st.caption(f"📄 Datos procesados desde Excel en {load_info['seconds']:.2f} s ({snapshot_status})")
+        
+        # Métricas y revisión del cruce aproximado de nombres (solo operadores)
+        if OPERATOR_MODE:
+            show_fuzzy_match_review(load_info['fuzzy_stats'])
+        
         st.markdown("---")
         
         # FILTROS EN SIDEBAR
         st.sidebar.header("🔍 Filtros de Análisis")
 
-        # Filtros temporales dinámicos
-        selected_months, filter_type = create_dynamic_filters(month_columns_sorted)
-
-        # Separador visual
-        st.sidebar.markdown("---")
-
-        # Filtros múltiples
-        selected_countries, selected_areas = create_multiple_filters(df_melted)
+        # OPTIMIZACIÓN: Los filtros son un fragmento (ver show_analysis_filters)
+        filter_selection = show_analysis_filters(month_columns_sorted, df_melted)
+        selected_months = filter_selection['months']
+        filter_type = filter_selection['filter_type']
+        selected_countries = filter_selection['countries']
+        selected_areas = filter_selection['areas']
 
         # VALIDACIONES
         if not selected_months:
@@ -1926,11 +5468,20 @@ def main():
         # Validar condiciones para mostrar gráficos
         chart_conditions = validate_chart_conditions(selected_months, selected_countries, selected_areas)
 
-        # Aplicar filtros
-        filtered_data = df_melted.copy()
-        filtered_data = filtered_data[filtered_data['PAIS'].isin(selected_countries)]
-        filtered_data = filtered_data[filtered_data['AREA'].isin(selected_areas)]
-        filtered_data = filtered_data[filtered_data['Mes'].isin(selected_months)]
+        # Aplicar filtros (OPTIMIZACIÓN: intersección de bitmaps del índice invertido, sin copiar df_melted)
+        filtered_data = filter_rows_with_index(df_melted, usage_engine['filter_index'], {
+            'PAIS': selected_countries,
+            'AREA': selected_areas,
+            'Mes': selected_months
+        })
+
+        # OPTIMIZACIÓN: La misma selección sobre el motor matricial para las métricas de adopción
+        engine_view = create_engine_view(usage_engine, selected_months, selected_countries, selected_areas)
+
+        # OPTIMIZACIÓN: Contexto de métricas con todos los agregados de la selección, reutilizando los
+        # resultados ya calculados para la misma selección (en cualquier sesión)
+        selection_key = compute_selection_key(usage_engine['fingerprint'], selected_months, selected_countries, selected_areas)
+        metrics_context = build_metrics_context(engine_view, filtered_data, get_selection_results(selection_key))
 
         # Mostrar información del filtro aplicado
         st.info(f"📊 **Filtro temporal:** {filter_type} | **Meses:** {len(selected_months)} | **Países:** {len(selected_countries)} | **Áreas:** {len(selected_areas)}")
@@ -1939,23 +5490,39 @@ def main():
         # PESTAÑAS PRINCIPALES - OPTIMIZACIÓN PRINCIPAL
         # ==========================================
         
-        tab1, tab2, tab3 = st.tabs([
+        # OPTIMIZACIÓN: Solo se construye la pestaña activa (ver create_lazy_tabs), y cada pestaña es un
+        # fragmento que se vuelve a ejecutar por separado al interactuar con sus widgets
+        tab1, tab2, tab3 = create_lazy_tabs([
             "📊 Dashboard",
             "📋 Resumen Ejecutivo IA", 
             "💡 Insights Dashboard IA"
-        ])
+        ], key="main_tabs")
 
         # PESTAÑA 1: Dashboard completo
         with tab1:
-            show_dashboard_tab(filtered_data, selected_months, selected_countries, selected_areas, chart_conditions)
+            if is_tab_active(tab1):
+                show_dashboard_tab(filtered_data, metrics_context, selected_months, selected_countries, selected_areas, chart_conditions)
 
         # PESTAÑA 2: Resumen Ejecutivo con IA
         with tab2:
-            show_executive_summary_tab(filtered_data, selected_months, selected_countries, selected_areas, filter_type)
+            if is_tab_active(tab2):
+                show_executive_summary_tab(metrics_context, selected_months, selected_countries, selected_areas, filter_type)
 
         # PESTAÑA 3: Insights Dashboard con IA - OPTIMIZADA
         with tab3:
-            show_insights_tab(filtered_data, selected_months, selected_countries, selected_areas, filter_type)
+            if is_tab_active(tab3):
+                show_insights_tab(metrics_context, selected_months, selected_countries, selected_areas, filter_type)
+
+        # Registrar la memoria de los resultados de esta selección y, en modo operador, mostrar los
+        # diagnósticos de cachés, agregados, consultas IA y tiempos
+        update_result_cache_size(selection_key)
+        record_fragment_timing("Aplicación completa", run_start_time)
+        if OPERATOR_MODE:
+            show_result_cache_stats()
+            show_metrics_context_stats(metrics_context)
+            show_llm_cache_stats()
+            show_llm_job_stats()
+            show_fragment_timings()
 
     else:
         # Error al procesar archivos
@@ -0,0 +1,131 @@
+"""
+Pruebas del cliente HTTP del servicio SAI (post_llm_template y execute_llm_template) contra el servidor
+local de tools/sai_stub_server.py: conexiones reutilizables, reintentos con backoff, Retry-After,
+timeout de lectura, plazo total por llamada y servicio caído.
+
+Uso (desde la raíz del repositorio):
+    python tools/check_llm_client.py
+
+Termina con código 1 si alguna comprobación falla.
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sai_stub_server
+from sai_stub_server import STATE, reset_state
+
+def main():
+    # La app guarda sus cachés en el directorio actual: usar uno temporal
+    os.chdir(tempfile.mkdtemp(prefix='sai_llm_client_'))
+    server, url = sai_stub_server.start()
+    app = sai_stub_server.load_dashboard_module(url, SAI_LLM_CACHE='0', SAI_LLM_SINGLE_FLIGHT='0')
+    logging.getLogger('dash_sai.llm').setLevel(logging.ERROR)
+
+    failures = []
+
+    def check(description, condition, detail):
+        print(f"{'OK   ' if condition else 'FALLA'} {description}: {detail}")
+        if not condition:
+            failures.append(description)
+
+    inputs = {'data': 'x' * 4000}
+
+    # 1. Conexiones: una llamada por conexión nueva (requests.post) contra la sesión compartida
+    for label, call in [
+        ('requests.post', lambda: requests.post(f"{url}/api/templates/t/execute", json={'inputs': inputs}, headers={'X-Api-Key': 'k'})),
+        ('sesión compartida', lambda: app.post_llm_template('t', inputs, 'k'))
+    ]:
+        call()
+        reset_state()
+        start_time = time.perf_counter()
+        for _ in range(50):
+            call()
+        milliseconds = (time.perf_counter() - start_time) / 50 * 1000
+        if label == 'sesión compartida':
+            check("keep-alive", STATE['connections'] <= 1, f"{milliseconds:.2f} ms/llamada, {STATE['connections']} conexiones nuevas para 50 llamadas")
+        else:
+            print(f"      referencia {label}: {milliseconds:.2f} ms/llamada, {STATE['connections']} conexiones para 50 llamadas")
+
+    # 2. Reintentos con backoff ante errores transitorios
+    reset_state(script=[(503, 0), (429, 0), (502, 0)])
+    start_time = time.perf_counter()
+    response = app.post_llm_template('t', inputs, 'k')
+    check("reintentos 503, 429, 502 y luego 200", response.status_code == 200 and STATE['requests'] == 4,
+          f"código {response.status_code} en el intento {STATE['requests']} ({time.perf_counter() - start_time:.2f} s)")
+
+    # 3. Retry-After mayor que el backoff
+    reset_state(script=[(429, 0)], retry_after=1)
+    start_time = time.perf_counter()
+    response = app.post_llm_template('t', inputs, 'k')
+    elapsed_seconds = time.perf_counter() - start_time
+    check("429 con Retry-After: 1", response.status_code == 200 and elapsed_seconds >= 1.0, f"esperó {elapsed_seconds:.2f} s")
+
+    # 4. Reintentos agotados: el error llega a la pestaña con el mismo texto de siempre
+    reset_state(status=500)
+    result = app.execute_llm_template('t', inputs, 'k', use_cache=False)
+    check("error 500 persistente", result['text'] == "Error en la API: Código de estado 500" and STATE['requests'] == app.LLM_MAX_RETRIES + 1,
+          f"'{result['text']}' tras {STATE['requests']} intentos en {result['seconds']:.2f} s")
+
+    # 5. Timeout de lectura: no se reintenta
+    app.LLM_READ_TIMEOUT_SECONDS = 1.0
+    reset_state(delay=3)
+    start_time = time.perf_counter()
+    result = app.execute_llm_template('t', inputs, 'k', use_cache=False)
+    elapsed_seconds = time.perf_counter() - start_time
+    check("servidor colgado con timeout de lectura de 1 s", result['text'].startswith("Error") and STATE['requests'] == 1 and elapsed_seconds < 2,
+          f"{STATE['requests']} intento en {elapsed_seconds:.2f} s")
+    app.LLM_READ_TIMEOUT_SECONDS = 90.0
+
+    # 6. Plazo total de la llamada, reintentos incluidos
+    reset_state(status=503, delay=0.4)
+    start_time = time.perf_counter()
+    try:
+        response = app.post_llm_template('t', inputs, 'k', deadline_seconds=1.5)
+        outcome = f"código {response.status_code}"
+    except requests.RequestException as error:
+        outcome = type(error).__name__
+    elapsed_seconds = time.perf_counter() - start_time
+    check("503 lentos con plazo de 1.5 s", elapsed_seconds < 2.0, f"{outcome} tras {STATE['requests']} intentos en {elapsed_seconds:.2f} s")
+
+    reset_state(delay=3)
+    start_time = time.perf_counter()
+    try:
+        app.post_llm_template('t', inputs, 'k', deadline_seconds=1.0)
+        outcome = "respuesta"
+    except requests.RequestException as error:
+        outcome = type(error).__name__
+    elapsed_seconds = time.perf_counter() - start_time
+    check("respuesta de 3 s con plazo de 1 s", outcome != "respuesta" and elapsed_seconds < 1.5, f"{outcome} en {elapsed_seconds:.2f} s")
+
+    # 7. Servicio caído (conexión rechazada)
+    app.LLM_SERVICE_URL = 'http://127.0.0.1:9'
+    result = app.execute_llm_template('t', inputs, 'k', use_cache=False)
+    check("conexión rechazada", result['text'].startswith("Error al conectar con el LLM"), f"'{result['text'][:60]}' en {result['seconds']:.2f} s")
+    app.LLM_SERVICE_URL = url
+
+    # 8. Llamadas concurrentes sobre el pool de conexiones
+    reset_state(delay=0.3)
+    status_codes = []
+    threads = [threading.Thread(target=lambda: status_codes.append(app.post_llm_template('t', inputs, 'k').status_code)) for _ in range(10)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed_seconds = time.perf_counter() - start_time
+    check("10 llamadas concurrentes de 0.3 s", status_codes == [200] * 10 and elapsed_seconds < 1.0, f"{elapsed_seconds:.2f} s")
+
+    server.shutdown()
+    print(f"\n{'Todas las comprobaciones pasaron' if not failures else f'{len(failures)} comprobaciones fallaron'}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
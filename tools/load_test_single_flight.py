@@ -0,0 +1,137 @@
+"""
+Prueba de carga de las consultas idénticas compartidas (single-flight) contra el servidor local de
+tools/sai_stub_server.py: N sesiones piden a la vez el mismo resumen ejecutivo, con
+SAI_LLM_SINGLE_FLIGHT desactivado y activado, y se comparan las llamadas al servicio y la latencia.
+
+También comprueba que las consultas con datos distintos no se comparten y que, si se cancela la
+consulta que hace la llamada, las unidas a ella la repiten en lugar de recibir la cancelación.
+
+Uso (desde la raíz del repositorio):
+    python tools/load_test_single_flight.py
+    python tools/load_test_single_flight.py 10 30 100
+
+Termina con código 1 si alguna comprobación falla.
+"""
+
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sai_stub_server
+from sai_stub_server import STATE, reset_state
+
+DEFAULT_SESSION_COUNTS = [10, 30]
+SERVICE_DELAY_SECONDS = 0.5
+
+def run_sessions(app, session_count, data_for_session=None, cancel_first_after=None):
+    """
+    Lanza session_count sesiones que llaman a generate_llm_summary a la vez (sin caché de respuestas
+    previa). Con cancel_first_after, la primera sesión empieza antes que las demás (es la que hace la
+    llamada) y se cancela a los cancel_first_after segundos.
+
+    Returns:
+        tuple: (resultados, latencias en segundos, fragmentos recibidos), por sesión
+    """
+    shutil.rmtree(app.CACHE_DIR_NAME, ignore_errors=True)
+    if data_for_session is None:
+        data_for_session = lambda index: "Resumen con los filtros por defecto"
+
+    results = [None] * session_count
+    latencies = [0.0] * session_count
+    chunk_counts = [0] * session_count
+
+    def session(index, start_barrier):
+        cancel_event = threading.Event()
+        if cancel_first_after is not None and index == 0:
+            threading.Timer(cancel_first_after, cancel_event.set).start()
+
+        def on_chunk(text_chunk):
+            chunk_counts[index] += 1
+
+        if start_barrier is not None:
+            start_barrier.wait()
+        start_time = time.perf_counter()
+        results[index] = app.generate_llm_summary(data_for_session(index), f"clave-{index}", True, cancel_event, on_chunk)
+        latencies[index] = time.perf_counter() - start_time
+
+    if cancel_first_after is None:
+        start_barrier = threading.Barrier(session_count)
+        threads = [threading.Thread(target=session, args=(index, start_barrier)) for index in range(session_count)]
+    else:
+        # La primera sesión arranca sola y las demás se unen a su llamada un momento después
+        start_barrier = threading.Barrier(session_count - 1)
+        threads = [threading.Thread(target=session, args=(0, None))]
+        threads += [threading.Thread(target=session, args=(index, start_barrier)) for index in range(1, session_count)]
+
+    for index, thread in enumerate(threads):
+        thread.start()
+        if cancel_first_after is not None and index == 0:
+            time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+
+    return results, latencies, chunk_counts
+
+def main(session_counts):
+    # La app guarda sus cachés en el directorio actual: usar uno temporal
+    os.chdir(tempfile.mkdtemp(prefix='sai_single_flight_'))
+    server, url = sai_stub_server.start()
+    apps = {
+        single_flight: sai_stub_server.load_dashboard_module(
+            url, f"dash_sai_LLM_single_flight_{single_flight}", SAI_LLM_SINGLE_FLIGHT=single_flight
+        )
+        for single_flight in ('0', '1')
+    }
+    logging.getLogger('dash_sai.llm').setLevel(logging.ERROR)
+
+    failures = []
+
+    def check(description, condition, detail):
+        print(f"{'OK   ' if condition else 'FALLA'} {description}: {detail}")
+        if not condition:
+            failures.append(description)
+
+    # 1. N sesiones con el mismo resumen, sin y con consultas compartidas
+    for session_count in session_counts:
+        for single_flight, app in apps.items():
+            reset_state(delay=SERVICE_DELAY_SECONDS, mode='chunked', tokens=10, token_delay=0.05)
+            results, latencies, chunk_counts = run_sessions(app, session_count)
+            latencies.sort()
+            detail = (
+                f"{STATE['requests']} llamadas al servicio, latencia p50 {statistics.median(latencies):.2f} s y "
+                f"máx {latencies[-1]:.2f} s, {sum(result['coalesced'] for result in results)} compartidas, "
+                f"fragmentos por sesión {min(chunk_counts)}-{max(chunk_counts)}"
+            )
+            if single_flight == '1':
+                answers = {result['text'] for result in results}
+                check(f"{session_count} sesiones con consultas compartidas", STATE['requests'] == 1 and len(answers) == 1, detail)
+            else:
+                print(f"      referencia {session_count} sesiones sin consultas compartidas: {detail}")
+
+    app = apps['1']
+
+    # 2. Datos distintos (por ejemplo otros filtros) no se comparten
+    reset_state(delay=SERVICE_DELAY_SECONDS)
+    run_sessions(app, 10, data_for_session=lambda index: f"Resumen con los filtros {index % 3}")
+    check("10 sesiones con 3 selecciones distintas", STATE['requests'] == 3, f"{STATE['requests']} llamadas al servicio")
+
+    # 3. La sesión que hace la llamada cancela a mitad de la respuesta: las demás la repiten
+    reset_state(delay=SERVICE_DELAY_SECONDS, mode='chunked', tokens=10, token_delay=0.1)
+    results, latencies, chunk_counts = run_sessions(app, 10, cancel_first_after=0.3)
+    followers_ok = all(not result['text'].startswith("Error") for result in results[1:])
+    check("consulta compartida cancelada por quien la hizo", followers_ok and STATE['requests'] == 2,
+          f"'{results[0]['text'][-18:]}' en la cancelada, {STATE['requests']} llamadas al servicio, "
+          f"{app.get_llm_flights()['repeated_calls']} repetidas")
+
+    server.shutdown()
+    print(f"\n{'Todas las comprobaciones pasaron' if not failures else f'{len(failures)} comprobaciones fallaron'}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main([int(argument) for argument in sys.argv[1:]] or DEFAULT_SESSION_COUNTS))
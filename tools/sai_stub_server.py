@@ -0,0 +1,184 @@
+"""
+Servidor local que reemplaza al servicio de plantillas de SAI (POST /api/templates/<id>/execute) para
+probar el cliente HTTP y las consultas al LLM del dashboard sin llamar al servicio real.
+
+Simula latencia, códigos de estado (con Retry-After opcional) y respuestas en streaming (texto por
+fragmentos o Server-Sent Events), y cuenta solicitudes y conexiones abiertas.
+
+Uso como servidor independiente:
+    python tools/sai_stub_server.py --port 8765 --delay 0.5 --mode sse
+    SAI_API_BASE_URL=http://127.0.0.1:8765 streamlit run dash_sai_LLM.py
+
+Uso desde los scripts de prueba (ver check_llm_client.py y load_test_single_flight.py):
+    server, url = start()
+    STATE.update(delay=0.5, status=503)
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import socket
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Comportamiento del servidor (se puede cambiar entre llamadas) y contadores
+# - script: lista de (status, delay) que se consume una por solicitud; después se usan status y delay
+# - mode: 'plain' (respuesta completa), 'chunked' (texto por fragmentos) o 'sse' (Server-Sent Events)
+STATE = {
+    'requests': 0,
+    'connections': 0,
+    'delay': 0.0,
+    'status': 200,
+    'script': [],
+    'retry_after': None,
+    'mode': 'plain',
+    'tokens': 20,
+    'token_delay': 0.0
+}
+STATE_LOCK = threading.Lock()
+
+def reset_state(**changes):
+    """
+    Vuelve al comportamiento por defecto (respuesta 200 inmediata), pone los contadores en cero y
+    aplica los cambios indicados
+    """
+    with STATE_LOCK:
+        STATE.update(requests=0, connections=0, delay=0.0, status=200, script=[], retry_after=None,
+                     mode='plain', tokens=20, token_delay=0.0)
+        STATE.update(changes)
+
+class StubTemplateHandler(BaseHTTPRequestHandler):
+    """
+    Atiende las ejecuciones de plantillas con keep-alive (HTTP/1.1), como el servicio real
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        with STATE_LOCK:
+            STATE['connections'] += 1
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        inputs = body.get('inputs', {})
+
+        with STATE_LOCK:
+            STATE['requests'] += 1
+            request_number = STATE['requests']
+            status, delay = STATE['script'].pop(0) if STATE['script'] else (STATE['status'], STATE['delay'])
+        time.sleep(delay)
+
+        try:
+            if status == 200 and STATE['mode'] in ('chunked', 'sse'):
+                self.send_streamed_response(request_number)
+                return
+
+            # El texto identifica la solicitud y resume las entradas recibidas
+            text = (
+                f"Respuesta #{request_number} a {self.path}: {len(inputs.get('data', ''))} caracteres, "
+                f"pregunta={inputs.get('pregunta')}"
+            ).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(text)))
+            if status == 429 and STATE['retry_after'] is not None:
+                self.send_header('Retry-After', str(STATE['retry_after']))
+            self.end_headers()
+            self.wfile.write(text)
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente cortó la conexión (cancelación o plazo vencido)
+            pass
+
+    def send_streamed_response(self, request_number):
+        """
+        Envía la respuesta en STATE['tokens'] fragmentos (transfer-encoding chunked), como texto o como
+        eventos SSE (alternando texto plano y JSON, con un comentario y el cierre [DONE])
+        """
+        use_sse = STATE['mode'] == 'sse'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8' if use_sse else 'text/plain; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        for index in range(STATE['tokens']):
+            token = f"tok{index}ñ " if index else f"Respuesta #{request_number} "
+            if use_sse:
+                payload = f"data: {json.dumps({'text': token})}\n\n" if index % 2 else f"data: {token}\n\n"
+                if index == 3:
+                    payload = ": comentario\n\n" + payload
+            else:
+                payload = token
+            self.write_chunk(payload.encode('utf-8'))
+            time.sleep(STATE['token_delay'])
+
+        if use_sse:
+            self.write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Servidor con una cola de conexiones pendientes amplia: con la cola por defecto (5) las conexiones
+    simultáneas que no caben esperan la retransmisión del SYN (1 s) y las pruebas de concurrencia
+    miden al servidor en lugar del cliente
+    """
+    request_queue_size = 128
+    daemon_threads = True
+
+def start(port=0):
+    """
+    Inicia el servidor en un hilo en segundo plano (port=0 elige un puerto libre)
+
+    Returns:
+        tuple: (servidor, URL base para SAI_API_BASE_URL)
+    """
+    server = StubServer(('127.0.0.1', port), StubTemplateHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def load_dashboard_module(base_url, module_name='dash_sai_LLM', **settings):
+    """
+    Carga dash_sai_LLM.py como módulo (sin ejecutar main) apuntando el cliente del LLM al servidor
+    local. settings son variables de entorno adicionales (por ejemplo SAI_LLM_CACHE='0'), que la app
+    lee al cargarse.
+    """
+    os.environ['SAI_API_BASE_URL'] = base_url
+    os.environ.update(settings)
+
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'dash_sai_LLM.py')
+    spec = importlib.util.spec_from_file_location(module_name, app_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Servidor local que reemplaza al servicio de plantillas de SAI")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.5, help="Segundos antes de responder")
+    parser.add_argument('--status', type=int, default=200, help="Código de estado de las respuestas")
+    parser.add_argument('--mode', choices=['plain', 'chunked', 'sse'], default='plain')
+    parser.add_argument('--tokens', type=int, default=20, help="Fragmentos de las respuestas en streaming")
+    parser.add_argument('--token-delay', type=float, default=0.05, help="Segundos entre fragmentos")
+    arguments = parser.parse_args()
+
+    reset_state(delay=arguments.delay, status=arguments.status, mode=arguments.mode,
+                tokens=arguments.tokens, token_delay=arguments.token_delay)
+    server, url = start(arguments.port)
+    print(f"Servicio SAI local en {url} (Ctrl+C para terminar)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()